@@ -0,0 +1,251 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks of the generation and augmentation hot paths on synthetic inputs (no Blender, TensorFlow or datasets needed).
+
+Usage (from the repository root or this folder):
+  python benchmarks/run_benchmarks.py                      # run, write results.json, compare to baseline.json
+  python benchmarks/run_benchmarks.py --save_baseline      # store the results as new baseline
+  python benchmarks/run_benchmarks.py --sizes large --cases paste
+
+Every case is timed 'repeat' times; the median time per call is compared to the baseline and reported as
+regression if it is slower by more than 'tolerance'. The exit code is 1 if a regression was found."""
+
+import os, sys
+import ast
+import json
+import time
+import random
+import platform
+import argparse
+import sqlite3
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'util'))
+sys.path.append(os.path.join(ROOT, 'blender_addon'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+import index_pass
+import relight
+import paste_rendered
+import overlay_rendered
+import write_class_info
+import yolo_example
+import image_loading
+
+parser = argparse.ArgumentParser(description='Benchmark the generation and augmentation hot paths.')
+parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=['small', 'medium', 'large'],
+                    help='Input sizes to benchmark.')
+parser.add_argument('--cases', nargs='+', default=None,
+                    help='Only run cases whose name contains one of these strings.')
+parser.add_argument('--repeat', action='store', type = int,
+                    default=5,
+                    help='Number of timed repetitions per case.')
+parser.add_argument('--output', '--o', action='store',
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.json'),
+                    help='Path of the results JSON file.')
+parser.add_argument('--baseline', action='store',
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json'),
+                    help='Path of the baseline JSON file.')
+parser.add_argument('--save_baseline', action='store_true', default=False,
+                    help='Store the results as baseline.')
+parser.add_argument('--tolerance', action='store', type = float,
+                    default=.2,
+                    help='Allowed relative slowdown against the baseline.')
+
+SIZES = {
+  'small':  {'pass': (300, 300), 'objects': 5, 'sprite': (150, 150), 'bg': (640, 480), 'tree': 1000},
+  'medium': {'pass': (1024, 1024), 'objects': 10, 'sprite': (300, 300), 'bg': (1920, 1080), 'tree': 10000},
+  'large':  {'pass': (2048, 2048), 'objects': 20, 'sprite': (600, 600), 'bg': (4000, 3000), 'tree': 50000},
+}
+
+## every case gets the size parameters, a numpy rng and a temporary folder and returns (prepare, run):
+## prepare() creates the (untimed) arguments of one call of run()
+
+def case_save_label(size, rng, tmp):
+  class_img = synthetic.index_pass(size['pass'], size['objects'], rng)
+  return (lambda: (class_img, size['objects'])), index_pass.pass_boxes
+
+def case_rand_paste(size, rng, tmp):
+  img = synthetic.sprite(size['sprite'], rng)
+  bg = synthetic.background(size['bg'], rng)
+  return (lambda: (img, bg.copy())), lambda img, bg: paste_rendered.rand_paste(img, bg, rng=random.Random(0))
+
+def case_masked_rand_paste(size, rng, tmp):
+  img = synthetic.sprite(size['sprite'], rng)
+  bg = synthetic.background(size['bg'], rng)
+  mask = np.asarray(synthetic.background(size['bg'], rng))[:,:,0] > 128
+  np.random.seed(0)
+  return (lambda: (img, bg.copy(), mask.copy())), paste_rendered.masked_rand_paste
+
+def case_resize_and_paste(size, rng, tmp):
+  img = synthetic.sprite(size['sprite'], rng)
+  bg = synthetic.background(size['bg'], rng)
+  _, x, y, w, h = map(float, synthetic.sprite_label())
+  return (lambda: (img, w, h, x, y, bg.copy(), .2, .3, .5, .5)), overlay_rendered.resize_and_paste
+
+def case_open_background(size, rng, tmp):
+  ## background decoded at reduced size for 640 px samples (paste_rendered/overlay_rendered --output_size)
+  path = os.path.join(tmp, 'bg_{}x{}.jpg'.format(*size['bg']))
+  with open(path, 'wb') as f_img:
+    f_img.write(synthetic.jpeg_bytes(size['bg'], rng))
+  return (lambda: (path, 640, 'RGB')), image_loading.open_background
+
+def case_write_class_info_full(size, rng, tmp):
+  path = synthetic.label_tree(os.path.join(tmp, 'tree_{}'.format(size['tree'])), size['tree'], rng)
+  def run(db):
+    write_class_info.update_index(db, path)
+    return write_class_info.class_info(db)
+  return (lambda: (sqlite3.connect(':memory:'),)), run
+
+def case_write_class_info_incremental(size, rng, tmp):
+  path = synthetic.label_tree(os.path.join(tmp, 'tree_{}'.format(size['tree'])), size['tree'], rng)
+  db = sqlite3.connect(':memory:')
+  write_class_info.update_index(db, path)
+  def run(db):
+    write_class_info.update_index(db, path)
+    return write_class_info.class_info(db)
+  return (lambda: (db,)), run
+
+def case_txt_to_tf_example(size, rng, tmp):
+  txt = synthetic.label_text(size['objects'], rng)
+  encoded = synthetic.jpeg_bytes(size['bg'], rng)
+  label_id_dict = {i: 'class_{}'.format(i) for i in range(1, 10)}
+  try:
+    import yolo_2_tf_record
+  except ImportError:
+    ## without tensorflow only the tensorflow independent part is timed
+    return (lambda: (txt, encoded, label_id_dict)), yolo_example.example_fields
+  img_path = os.path.join(tmp, 'example.jpg')
+  with open(img_path, 'wb') as f_img:
+    f_img.write(encoded)
+  label_map_dict = {name: i for i, name in label_id_dict.items()}
+  return (lambda: (txt, img_path, label_map_dict, label_id_dict)), yolo_2_tf_record.txt_to_tf_example
+
+def case_relight_variants(size, rng, tmp):
+  ## four lighting variants of a sprite sized render from its light passes
+  width, height = size['sprite']
+  passes = {name: rng.random((height, width, 4), dtype=np.float32) for pair in relight.DIRECT_PASSES for name in pair}
+  combined = rng.random((height, width, 4), dtype=np.float32)
+  object_mask = synthetic.index_pass(size['sprite'], 1, rng) != 0
+  factors = [(.5, 1.), (1.5, .8), (2., 1.2), (.8, 1.4)]
+  return (lambda: (combined, passes, object_mask, factors)), relight.variants
+
+def top_level_imports(path):
+  """Modules imported at the top level of a script (modules imported from the SampleGenerator package by their name)."""
+  with open(path) as f:
+    tree = ast.parse(f.read())
+  modules = []
+  for node in tree.body:
+    if isinstance(node, ast.Import):
+      names = [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom) and node.module == 'SampleGenerator':
+      names = [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom):
+      names = [node.module]
+    else:
+      continue;
+    modules += [name for name in names if name not in modules]
+  return modules
+
+def addon_imports():
+  """Top level imports of generate_samples that work outside blender: all but bpy and the add-on modules importing it."""
+  addon_path = os.path.join(ROOT, 'blender_addon')
+  def needs_bpy(name):
+    path = os.path.join(addon_path, name + '.py')
+    return name.split('.')[0] == 'bpy' or (os.path.isfile(path) and any(needs_bpy(m) for m in top_level_imports(path)))
+  return [name for name in top_level_imports(os.path.join(addon_path, 'generate_samples.py')) if not needs_bpy(name)]
+
+def case_addon_import(size, rng, tmp):
+  ## startup cost of a headless worker: a fresh interpreter importing the generator's module level dependencies
+  ## (see addon_imports, bpy and the modules needing it are only available inside blender)
+  code = 'import sys; sys.path.append({!r}); import {}'.format(os.path.join(ROOT, 'blender_addon'), ', '.join(addon_imports()))
+  return (lambda: ()), lambda: subprocess.check_call([sys.executable, '-c', code])
+
+CASES = [
+  ('save_label', case_save_label),
+  ('rand_paste', case_rand_paste),
+  ('masked_rand_paste', case_masked_rand_paste),
+  ('resize_and_paste', case_resize_and_paste),
+  ('open_background', case_open_background),
+  ('write_class_info_full', case_write_class_info_full),
+  ('write_class_info_incremental', case_write_class_info_incremental),
+  ('txt_to_tf_example', case_txt_to_tf_example),
+  ('relight_variants', case_relight_variants),
+  ('addon_import', case_addon_import),
+]
+
+def time_case(prepare, run, repeat):
+  """Runs run(*prepare()) once untimed and 'repeat' times timed. Returns the times in seconds."""
+  run(*prepare())
+  times = []
+  for _ in range(repeat):
+    args = prepare()
+    start = time.perf_counter()
+    run(*args)
+    times.append(time.perf_counter() - start)
+  return times
+
+def compare(results, baseline, tolerance):
+  """Returns the keys of results that are slower than the baseline by more than tolerance."""
+  regressions = []
+  for key, result in results.items():
+    if key in baseline and result['median'] > baseline[key]['median'] * (1 + tolerance):
+      regressions.append(key)
+  return regressions
+
+def main():
+  args = parser.parse_args()
+  results = {}
+  with tempfile.TemporaryDirectory() as tmp:
+    for size_name in args.sizes:
+      for name, make_case in CASES:
+        if args.cases and not any(c in name for c in args.cases):
+          continue;
+        key = '{}/{}'.format(name, size_name)
+        prepare, run = make_case(SIZES[size_name], np.random.default_rng(0), tmp)
+        times = time_case(prepare, run, args.repeat)
+        results[key] = {'median': float(np.median(times)), 'min': float(np.min(times)), 'repeat': args.repeat}
+        print('{:40s} median {:10.3f} ms   min {:10.3f} ms'.format(key, results[key]['median']*1000, results[key]['min']*1000))
+
+  report = {'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'machine': platform.machine(), 'node': platform.node()},
+            'results': results}
+  with open(args.output, 'w') as f_out:
+    json.dump(report, f_out, indent=2)
+
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f_out:
+      json.dump(report, f_out, indent=2)
+    print('baseline written to', args.baseline)
+    return 0
+
+  if not os.path.isfile(args.baseline):
+    print('no baseline found at {} (create one with --save_baseline)'.format(args.baseline))
+    return 0
+  with open(args.baseline) as f_baseline:
+    baseline = json.load(f_baseline)['results']
+  regressions = compare(results, baseline, args.tolerance)
+  for key in regressions:
+    print('REGRESSION {}: {:.3f} ms (baseline {:.3f} ms)'.format(key, results[key]['median']*1000, baseline[key]['median']*1000))
+  if not regressions:
+    print('no regressions against', args.baseline)
+  return 1 if regressions else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
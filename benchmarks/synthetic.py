@@ -0,0 +1,73 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic inputs for the benchmarks: IndexOB-like pass arrays, RGBA sprites, backgrounds and Yolo label trees."""
+
+import os
+import io
+import numpy as np
+from PIL import Image
+
+def index_pass(size, n_objects, rng):
+  """Object index pass (float, like the Viewer Node pixels) with n_objects rectangles (values 1..n_objects) on 0."""
+  width, height = size
+  class_img = np.zeros((height, width), dtype=np.float64)
+  for i in range(n_objects):
+    w, h = rng.integers(width//8, width//2), rng.integers(height//8, height//2)
+    x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+    class_img[y:y+h, x:x+w] = i + 1
+  return class_img
+
+def sprite(size, rng, fill = .6):
+  """RGBA object image with a random opaque ellipse covering about 'fill' of each side."""
+  width, height = size
+  yy, xx = np.mgrid[0:height, 0:width]
+  mask = ((xx - width/2) / (width*fill/2))**2 + ((yy - height/2) / (height*fill/2))**2 <= 1
+  pixels = np.zeros((height, width, 4), dtype=np.uint8)
+  pixels[:,:,:3] = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+  pixels[:,:,3] = mask * 255
+  return Image.fromarray(pixels, 'RGBA')
+
+def sprite_label(fill = .6):
+  """Label fields (class, x, y, w, h) matching sprite()."""
+  return '1', '0.5', '0.5', str(fill), str(fill)
+
+def background(size, rng):
+  """Smooth noise RGB background."""
+  width, height = size
+  small = rng.integers(0, 256, (max(height//16, 1), max(width//16, 1), 3), dtype=np.uint8)
+  return Image.fromarray(small).resize((width, height), Image.BILINEAR)
+
+def jpeg_bytes(size, rng, quality = 90):
+  buf = io.BytesIO()
+  background(size, rng).save(buf, 'JPEG', quality=quality)
+  return buf.getvalue()
+
+def label_text(n_objects, rng):
+  """Content of a Yolo label file with n_objects random boxes."""
+  boxes = rng.random((n_objects, 4)) * [1, 1, .5, .5]
+  classes = rng.integers(1, 10, n_objects)
+  return ''.join("{} {} {} {} {}\n".format(c, *box) for c, box in zip(classes.tolist(), boxes.tolist()))
+
+def label_tree(path, n, rng, single_object = True, image_bytes = b''):
+  """Writes n label files (and empty placeholder png files) like a folder of rendered object images."""
+  if not os.path.exists(path):
+    os.makedirs(path)
+  for i in range(n):
+    name = os.path.join(path, str(i).zfill(6))
+    with open(name + '.txt', 'w') as f_label:
+      f_label.write(label_text(1 if single_object else int(rng.integers(0, 6)), rng))
+    with open(name + '.png', 'wb') as f_img:
+      f_img.write(image_bytes)
+  return path
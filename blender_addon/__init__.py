@@ -1,4 +1,3 @@
-from SampleGenerator import generate_samples
 import bpy
 from bpy.props import FloatVectorProperty, FloatProperty, BoolProperty, PointerProperty, IntProperty, EnumProperty, StringProperty, IntVectorProperty
 
@@ -35,7 +34,19 @@ class SampleGeneratorPanel(bpy.types.Panel):
       box = self.layout.box()
       box.prop(context.scene, 'sg_cam_dist')
       box.prop(context.scene, 'sg_img_size')
+      box.prop(context.scene, 'sg_output_sizes')
       box.prop(context.scene, 'sg_nSamples')
+      box.prop(context.scene, 'sg_pack_size')
+      box.prop(context.scene, 'sg_relight_variants')
+      box.prop(context.scene, 'sg_trim_sprites')
+      box.prop(context.scene, 'sg_output_layout')
+      box.prop(context.scene, 'sg_fan_out')
+      box.prop(context.scene, 'sg_label_store')
+      box.prop(context.scene, 'sg_queue_path')
+      box.prop(context.scene, 'sg_cache_path')
+      box.prop(context.scene, 'sg_stream_address')
+      box.prop(context.scene, 'sg_auto_tune')
+      box.prop(context.scene, 'sg_dry_run')
       self.layout.operator("object.generate_samples", text="Generate Samples")
 
 class GenerateSamplesOperator(bpy.types.Operator):
@@ -63,9 +74,23 @@ class GenerateSamplesOperator(bpy.types.Operator):
       box = self.layout.box()
       box.prop(context.scene, 'sg_cam_dist')
       box.prop(context.scene, 'sg_img_size')
+      box.prop(context.scene, 'sg_output_sizes')
       box.prop(context.scene, 'sg_nSamples')
+      box.prop(context.scene, 'sg_pack_size')
+      box.prop(context.scene, 'sg_relight_variants')
+      box.prop(context.scene, 'sg_trim_sprites')
+      box.prop(context.scene, 'sg_output_layout')
+      box.prop(context.scene, 'sg_fan_out')
+      box.prop(context.scene, 'sg_label_store')
+      box.prop(context.scene, 'sg_queue_path')
+      box.prop(context.scene, 'sg_cache_path')
+      box.prop(context.scene, 'sg_stream_address')
+      box.prop(context.scene, 'sg_auto_tune')
+      box.prop(context.scene, 'sg_dry_run')
 
     def execute(self, context):
+        ## imported on first use, registering the addon (blender startup, every headless worker) stays cheap
+        from SampleGenerator import generate_samples
         generate_samples.main()
         return {'FINISHED'}
 
@@ -96,12 +121,82 @@ def register():
       description = "Path to background images."
     )
 
+    bpy.types.Scene.sg_label_store = StringProperty(
+      subtype = "DIR_PATH",
+      name = "Label Store",
+      description = "Optional columnar label store (see label_store.py). If set, labels are appended to it instead of written as one .txt file per image."
+    )
+
+    bpy.types.Scene.sg_queue_path = StringProperty(
+      subtype = "DIR_PATH",
+      name = "Work Queue",
+      description = "Optional work queue folder on shared storage (see work_queue.py). If set, any number of workers render the samples together (overridden by the SG_QUEUE environment variable)."
+    )
+
+    bpy.types.Scene.sg_cache_path = StringProperty(
+      subtype = "DIR_PATH",
+      name = "Render Cache",
+      description = "Optional folder of rendered frames by the hash of their objects and settings (see asset_cache.py). If set, only frames of changed objects are rendered again, the others are copied from it."
+    )
+
+    bpy.types.Scene.sg_stream_address = StringProperty(
+      subtype = "FILE_PATH",
+      name = "Frame Stream",
+      description = "Optional socket path. If set, no files are written: sprites and labels are handed to a consumer process connecting to it through a shared memory ring buffer (see frame_ring.py, overridden by the SG_STREAM environment variable)."
+    )
+
+    bpy.types.Scene.sg_auto_tune = BoolProperty(
+      name = "Tune Render Settings",
+      default = False,
+      description = "Render a few calibration frames with different tile sizes and thread counts and use the fastest (Cycles CPU only, cached per machine and scene, see render_tuning.py)."
+    )
+
+    bpy.types.Scene.sg_dry_run = BoolProperty(
+      name = "Dry Run",
+      default = False,
+      description = "Only render a few calibration frames and write the projected render time per number of workers, output size and per object coverage of the job to plan.json and its schedule to plan_schedule.csv in the output folder (see planner.py)."
+    )
+
     bpy.types.Scene.sg_nSamples = IntProperty(
       name = "Number Samples",
       min = 0,
       max = 999999999,
       description = "Number of generated Samples.")
 
+    bpy.types.Scene.sg_pack_size = IntProperty(
+      name = "Objects per Render",
+      min = 1,
+      max = 16,
+      default = 1,
+      description = "Number of objects rendered side by side in one frame and split into separate sprites afterwards (one render for several sprites).")
+
+    bpy.types.Scene.sg_relight_variants = IntProperty(
+      name = "Lighting Variants",
+      min = 0,
+      max = 32,
+      default = 0,
+      description = "Number of extra sprites per render with other sun strength and exposure, recombined from the light passes instead of rendered (see relight.py). Adds a render layer lit by the sun alone.")
+
+    bpy.types.Scene.sg_trim_sprites = BoolProperty(
+      name = "Trim Sprites",
+      default = False,
+      description = "Crop every saved sprite to its non transparent area (object and shadow) plus a small margin, labels are relative to the cropped sprite.")
+
+    bpy.types.Scene.sg_output_layout = EnumProperty(
+      items = [('flat', 'Flat', 'All files in the output folder'),
+               ('ranged', 'Ranged', 'Subdirectories by index range, consecutive frames share a directory'),
+               ('hashed', 'Hashed', 'Subdirectories by a hash of the index')],
+      name = "Output Layout",
+      default = 'flat',
+      description = "Directory layout of the output folders (see output_layout.py). Files are named by their frame number padded to 10 digits, ranged and hashed layouts spread them over subdirectories for very large datasets.")
+
+    bpy.types.Scene.sg_fan_out = IntProperty(
+      name = "Files per Directory",
+      min = 2,
+      max = 1000000,
+      default = 1000,
+      description = "Max entries per subdirectory of a ranged or hashed output layout.")
+
     bpy.types.Scene.sg_cam = PointerProperty(name="Camera", type=bpy.types.Object,
     description = "The scenes camera Object. (needed for perspective changes)")
     bpy.types.Scene.sg_sun = PointerProperty(name="Sun", type=bpy.types.Object,
@@ -123,6 +218,11 @@ def register():
       default=(300,300),
       description="Size of the rendered image (In Background rendering this is set to size of background image)."
       )
+    bpy.types.Scene.sg_output_sizes = StringProperty(
+      name="Output Sizes",
+      default="",
+      description="Optional comma separated long sides in pixels (e.g. 640,320,160). Rendered once at the largest (with the aspect ratio of Image Size, written to rgba/), the others are downscaled from it with labels from the downscaled object index pass (written to rgba_<size>/, see pyramid.py)."
+      )
 
     bpy.utils.register_class(GenerateSamplesOperator)
     bpy.types.INFO_MT_render.append(menu_func)
@@ -0,0 +1,276 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed cache of rendered frames for incremental regeneration of cropped mode jobs.
+
+A frame is identified by a hash of everything its output depends on: the state of its objects (mesh, modifiers,
+materials, children, custom properties), the scene (render settings, camera, sun, ground, world, compositing) and the
+frame's rotations, camera elevation and reflection image (path, size and modification time). The random adjustments of
+a frame are seeded from its key (see main in generate_samples), so its output is a function of the key. Sprites and
+labels of rendered frames are stored under their key and copied by later runs instead of rendering the frame again; the
+assembled dataset is the same as after a full rerun.
+
+Layout of the cache folder:
+  <key[:2]>/<key>/sprite<suffix>.png -- sprites of the frame, suffix is the part of the sprite name after the frame number
+  <key[:2]>/<key>/labels.json        -- [[suffix, labels]] of the sprites
+
+Values the generator randomizes every frame (shape key values, randomized material nodes, sun angle, size and
+strength) and sets itself (location and z rotation of the objects, visibility, pass index) are not part of the state,
+they are overwritten before every render. Uses the Blender data passed in, doesn't import bpy."""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 1 ## increase when a change of the generator changes its output, every cached frame is rendered again
+
+## properties of nodes that don't change the render (layout in the node editor and output locations)
+NODE_EXCLUDE = ('location', 'width', 'width_hidden', 'height', 'dimensions', 'select', 'show_options', 'show_preview',
+                'show_texture', 'hide', 'label', 'color', 'use_custom_color', 'base_path')
+## render settings changed by render_tuning or that only affect the output location
+RENDER_EXCLUDE = ('filepath', 'tile_x', 'tile_y', 'threads', 'threads_mode')
+
+def _update(h, *values):
+    for value in values:
+        h.update(repr(value).encode('utf-8'))
+        h.update(b'\0')
+
+def _plain(value):
+    ## deterministic, repr()-able value of an RNA or ID property (vectors, colors, matrices, ID property groups and arrays)
+    for attr in ('to_dict', 'to_list'):
+        if hasattr(value, attr):
+            return getattr(value, attr)()
+    if hasattr(value, '__len__') and not isinstance(value, str):
+        return tuple(_plain(v) for v in value)
+    return value
+
+def rna_state(struct, exclude = (), depth = 2):
+    ## values of the RNA properties of a Blender struct. data blocks pointed to are represented by their name (and file path),
+    ## other pointers (e.g. a node's color ramp) are followed up to depth levels. collections are left out.
+    state = []
+    for prop in struct.bl_rna.properties:
+        key = prop.identifier
+        if key == 'rna_type' or key in exclude or prop.type == 'COLLECTION':
+            continue
+        try:
+            value = getattr(struct, key)
+        except AttributeError:
+            continue
+        if prop.type == 'POINTER':
+            if value is None:
+                pass
+            elif hasattr(value, 'users'):
+                value = (value.name, getattr(value, 'filepath', None))
+            elif depth > 0:
+                value = rna_state(value, depth=depth-1)
+            else:
+                continue
+        else:
+            value = _plain(value)
+        state.append((key, value))
+    return state
+
+def randomized_nodes(material):
+    ## names of the nodes texture_adjustments in generate_samples sets randomly (by its material and node naming conventions)
+    names = set()
+    for n in material.node_tree.nodes:
+        if 'rand' in material.name and ('RGB' in n.name or 'rand' in n.name or 'switch' in n.name):
+            names.add(n.name)
+        if 'shift' in material.name and 'Mapping' in n.name:
+            names.add(n.name)
+        if 'mix' in material.name and 'noise_mix' in n.name:
+            names.add(n.name)
+    return names
+
+def node_tree_state(tree, randomized = ()):
+    ## nodes (by name) with their properties and the values of unlinked sockets, and the links of a node tree.
+    ## only the type of the randomized nodes is part of the state
+    if tree is None:
+        return None
+    nodes = []
+    for node in sorted(tree.nodes, key=lambda n: n.name):
+        if node.name in randomized:
+            nodes.append((node.name, node.bl_idname))
+            continue
+        sockets = [(s.identifier, _plain(s.default_value)) for s in list(node.inputs) + list(node.outputs)
+                   if hasattr(s, 'default_value') and not s.is_linked]
+        group = node_tree_state(node.node_tree) if getattr(node, 'node_tree', None) else None
+        nodes.append((node.name, node.bl_idname, rna_state(node, NODE_EXCLUDE), sockets, group))
+    links = sorted((l.from_node.name, l.from_socket.identifier, l.to_node.name, l.to_socket.identifier) for l in tree.links)
+    return nodes, links
+
+def material_state(material):
+    if material is None:
+        return None
+    tree = material.node_tree if material.use_nodes else None
+    return (material.name, rna_state(material), node_tree_state(tree, randomized_nodes(material) if tree else ()))
+
+def mesh_state(mesh):
+    ## hash of the geometry, uv maps and shape keys of a mesh (shape key values are randomized, see shape_key_adjustments)
+    h = hashlib.sha256()
+    def update(collection, attr, length, dtype = np.float32):
+        data = np.empty(len(collection) * length, dtype)
+        collection.foreach_get(attr, data)
+        h.update(data.tobytes())
+    update(mesh.vertices, 'co', 3)
+    update(mesh.loops, 'vertex_index', 1, np.int32)
+    update(mesh.polygons, 'loop_total', 1, np.int32)
+    update(mesh.polygons, 'material_index', 1, np.int32)
+    update(mesh.polygons, 'use_smooth', 1, np.bool_)
+    for layer in mesh.uv_layers:
+        _update(h, layer.name)
+        update(layer.data, 'uv', 2)
+    if mesh.shape_keys:
+        for block in mesh.shape_keys.key_blocks:
+            _update(h, block.name, block.relative_key.name, block.slider_min, block.slider_max, block.mute)
+            update(block.data, 'co', 3)
+    _update(h, rna_state(mesh, ('shape_keys',)))
+    return h.hexdigest()
+
+def custom_properties(id_data):
+    return sorted((k, _plain(id_data[k])) for k in id_data.keys() if k not in ('_RNA_UI', 'cycles', 'cycles_visibility'))
+
+def object_state(obj, top = True):
+    """Hash of everything the renders of an object depend on: its data (mesh), modifiers, materials, custom properties
+    and children. The location and z rotation of a top level object are set by the generator and not part of the state."""
+    h = hashlib.sha256()
+    _update(h, obj.type, obj.rotation_mode, _plain(obj.scale), _plain(obj.delta_scale), obj.rotation_euler[0], obj.rotation_euler[1],
+            obj.location[2], custom_properties(obj))
+    if not top:
+        _update(h, obj.name, _plain(obj.location), _plain(obj.rotation_euler), _plain(obj.matrix_parent_inverse))
+    if hasattr(obj, 'cycles_visibility'):
+        _update(h, rna_state(obj.cycles_visibility))
+    if obj.type == 'MESH':
+        _update(h, mesh_state(obj.data))
+    elif obj.data is not None:
+        _update(h, rna_state(obj.data))
+    for m in obj.modifiers:
+        _update(h, m.name, m.type, rna_state(m, ('show_expanded',)))
+    for slot in obj.material_slots:
+        _update(h, slot.link, material_state(slot.material))
+    for child in sorted(obj.children, key=lambda c: c.name):
+        _update(h, object_state(child, top=False))
+    return h.hexdigest()
+
+def file_state(path):
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_size, int(stat.st_mtime))
+    except OSError:
+        return (path, None, None)
+
+def scene_state(scene, camera, sun, ground, materials, options):
+    """Hash of the scene a job renders its objects in.
+
+    Arguments:
+        scene {bpy.types.Scene} -- the scene (render and Cycles settings, world, compositing nodes)
+        camera, sun, ground {bpy.types.Object} -- the generator's camera, sun and shadow catcher
+        materials {list} -- all materials (texture_adjustments draws its random values in their order)
+        options {tuple} -- generator options changing the output (e.g. objects per render, lighting variants, trimming)
+
+    Returns:
+        str -- hex digest
+    """
+    h = hashlib.sha256()
+    _update(h, CACHE_VERSION, options)
+    _update(h, rna_state(scene.render, RENDER_EXCLUDE), rna_state(scene.cycles) if hasattr(scene, 'cycles') else None)
+    _update(h, node_tree_state(scene.node_tree))
+    if scene.world:
+        _update(h, rna_state(scene.world), node_tree_state(scene.world.node_tree if scene.world.use_nodes else None))
+    _update(h, rna_state(camera.data))
+    _update(h, rna_state(sun.data, ('shadow_soft_size',)), node_tree_state(sun.data.node_tree if sun.data.use_nodes else None, ('Emission',)))
+    _update(h, object_state(ground, top=False), ground.cycles.is_shadow_catcher if hasattr(ground, 'cycles') else None)
+    _update(h, [m.name for m in materials])
+    return h.hexdigest()
+
+def frame_key(scene_hash, visible, cam_elevation, bg_img_path, noise_frame = None):
+    """Key of a frame.
+
+    Arguments:
+        scene_hash {str} -- scene_state() of the job
+        visible {list} -- (object_state(), rotation) of every object in the frame in slot order
+        cam_elevation {float} -- camera elevation in degrees
+        bg_img_path {str} -- background reflection image (hashed with its size and modification time)
+
+    Keyword Arguments:
+        noise_frame {int} -- frame number if the render noise depends on it (Cycles' animated seed)
+
+    Returns:
+        str -- hex digest
+    """
+    h = hashlib.sha256()
+    _update(h, scene_hash, [(obj_hash, round(angle, 6)) for obj_hash, angle in visible], round(cam_elevation, 6), file_state(bg_img_path), noise_frame)
+    return h.hexdigest()
+
+def _sprite_path(output_path, name, layout):
+    if layout is None:
+        return output_path + name + '.png'
+    return layout.path(output_path, name, '.png', create=True)
+
+class FrameCache(object):
+    """Sprites and labels of rendered frames by frame key (see the module doc). Safe to share between workers.
+
+    Arguments:
+        path {str} -- cache folder
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _dir(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """[(suffix, labels)] of a cached frame or None."""
+        try:
+            with open(os.path.join(self._dir(key), 'labels.json')) as f:
+                return [(suffix, [tuple(label) for label in labels]) for suffix, labels in json.load(f)]
+        except (IOError, ValueError):
+            return None
+
+    def restore(self, key, output_path, frame_name, layout = None):
+        """Copies the sprites of a cached frame to output_path (named like a render of frame_name, placed by the
+        output_layout.Layout layout, flat if None). Returns the [(sprite name, labels)] to write or None if the frame isn't cached."""
+        entries = self.get(key)
+        if entries is None:
+            return None
+        written = []
+        for suffix, labels in entries:
+            shutil.copyfile(os.path.join(self._dir(key), 'sprite' + suffix + '.png'), _sprite_path(output_path, frame_name + suffix, layout))
+            written.append((frame_name + suffix, labels))
+        return written
+
+    def put(self, key, output_path, frame_name, written, layout = None):
+        """Stores a rendered frame: written is [(sprite name, labels)], the sprites are read from output_path."""
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=self.path)
+        entries = []
+        for name, labels in written:
+            suffix = name[len(frame_name):]
+            shutil.copyfile(_sprite_path(output_path, name, layout), os.path.join(tmp_dir, 'sprite' + suffix + '.png'))
+            entries.append((suffix, labels))
+        with open(os.path.join(tmp_dir, 'labels.json'), 'w') as f:
+            json.dump(entries, f)
+        parent = os.path.dirname(self._dir(key))
+        os.makedirs(parent, exist_ok=True)
+        try:
+            ## atomic, a reader never sees a partly written frame
+            os.rename(tmp_dir, self._dir(key))
+        except OSError:
+            ## stored meanwhile by another worker
+            shutil.rmtree(tmp_dir, ignore_errors=True)
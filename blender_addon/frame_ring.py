@@ -0,0 +1,201 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared memory ring buffer handing rendered sprites from the generator to a consumer process without files.
+
+The publisher (generate_samples in stream mode) creates a file of n_slots fixed size slots in shared memory
+(/dev/shm if available) and listens on a local (Unix domain) socket. One consumer connects and maps the file.
+Messages are JSON lines:
+  publisher -> consumer: {"slots": n, "slot_bytes": b, "path": ring file}          once, after connecting
+                         {"slot": k, "name": sprite name, "shape": [h, w, 4], "labels": [[class, x, y, w, h]]}
+                         {"end": true}                                            after the last sprite
+  consumer -> publisher: {"release": k}                                           slot k may be overwritten
+A slot is only written again after the consumer released it, so a slow consumer blocks the generator (backpressure)
+instead of frames being dropped or piling up. Pixels are read in place (numpy views into the mapped file).
+
+Consumer (e.g. a compositor or a training input pipeline):
+  from frame_ring import Consumer
+  for frame in Consumer('/tmp/sg_frames.sock'):
+    ## frame.pixels is released when the next frame is requested, copy it to keep it
+    train_step(frame.pixels, frame.labels)
+Test consumer printing throughput:
+  python frame_ring.py --address /tmp/sg_frames.sock"""
+
+import os
+import json
+import time
+import socket
+import tempfile
+import argparse
+from collections import deque
+import numpy as np
+
+N_SLOTS = 8
+
+def ring_path():
+  """Path of a new ring file, in shared memory where available."""
+  folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+  return os.path.join(folder, 'sg_frames_{}'.format(os.getpid()))
+
+class _Channel(object):
+  ## JSON lines over a connected socket
+
+  def __init__(self, sock):
+    self.sock = sock
+    self.file = sock.makefile('rb')
+
+  def send(self, message):
+    self.sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+  def receive(self):
+    line = self.file.readline()
+    if not line:
+      raise EOFError('Frame ring connection closed.')
+    return json.loads(line.decode('utf-8'))
+
+  def close(self):
+    self.file.close()
+    self.sock.close()
+
+class Publisher(object):
+  """Publishing side of a frame ring. The constructor waits for the consumer to connect.
+
+  Arguments:
+    address {str} -- path of the Unix domain socket the consumer connects to
+    slot_bytes {int} -- size of a slot, the largest sprite (height * width * 4)
+
+  Keyword Arguments:
+    n_slots {int} -- number of slots, sprites published but not released yet (default: {N_SLOTS})
+    path {str} -- ring file (default: {None}, see ring_path)
+  """
+
+  def __init__(self, address, slot_bytes, n_slots = N_SLOTS, path = None):
+    self.path = path or ring_path()
+    self.slot_bytes = slot_bytes
+    self.n_slots = n_slots
+    with open(self.path, 'wb') as f:
+      f.truncate(n_slots * slot_bytes)
+    self.data = np.memmap(self.path, dtype=np.uint8, mode='r+')
+    self.free = deque(range(n_slots))
+    if os.path.exists(address):
+      os.remove(address)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(address)
+    server.listen(1)
+    print('Waiting for a frame consumer at {}.'.format(address))
+    conn, _ = server.accept()
+    server.close()
+    os.remove(address)
+    self.channel = _Channel(conn)
+    self.channel.send({'slots': n_slots, 'slot_bytes': slot_bytes, 'path': self.path})
+
+  def publish(self, name, pixels, labels):
+    """Copies pixels (height x width x 4 uint8) into a free slot and announces it with its labels.
+    Blocks until the consumer released a slot if all are in use."""
+    if pixels.nbytes > self.slot_bytes:
+      raise ValueError('Sprite {} ({} bytes) is larger than a slot ({} bytes).'.format(name, pixels.nbytes, self.slot_bytes))
+    while not self.free:
+      self.free.append(self.channel.receive()['release'])
+    slot = self.free.popleft()
+    start = slot * self.slot_bytes
+    self.data[start:start + pixels.nbytes] = pixels.reshape(-1)
+    self.channel.send({'slot': slot, 'name': name, 'shape': list(pixels.shape), 'labels': [list(l) for l in labels]})
+
+  def close(self):
+    """Announces the end of the stream, waits until the consumer released all slots (or disconnected) and removes the ring."""
+    try:
+      self.channel.send({'end': True})
+      while len(self.free) < self.n_slots:
+        self.free.append(self.channel.receive()['release'])
+    except (OSError, EOFError):
+      pass
+    self.channel.close()
+    del self.data
+    os.remove(self.path)
+
+class Frame(object):
+  """A published sprite: name, pixels (read-only view into the ring, height x width x 4) and labels (class, x, y, w, h)."""
+
+  def __init__(self, slot, name, pixels, labels):
+    self.slot = slot
+    self.name = name
+    self.pixels = pixels
+    self.labels = labels
+
+class Consumer(object):
+  """Consuming side of a frame ring.
+
+  Arguments:
+    address {str} -- socket path of the publisher
+
+  Keyword Arguments:
+    timeout {float} -- seconds to wait for the publisher to start listening (default: {60})
+  """
+
+  def __init__(self, address, timeout = 60.):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    deadline = time.time() + timeout
+    while True:
+      try:
+        sock.connect(address)
+        break
+      except (FileNotFoundError, ConnectionRefusedError):
+        if time.time() > deadline:
+          raise
+        time.sleep(.1)
+    self.channel = _Channel(sock)
+    hello = self.channel.receive()
+    self.slot_bytes = hello['slot_bytes']
+    self.data = np.memmap(hello['path'], dtype=np.uint8, mode='r')
+
+  def receive(self):
+    """Next frame or None at the end of the stream. The frame's slot stays reserved until release() is called."""
+    message = self.channel.receive()
+    if message.get('end'):
+      return None
+    shape = message['shape']
+    start = message['slot'] * self.slot_bytes
+    pixels = self.data[start:start + int(np.prod(shape))].reshape(shape)
+    return Frame(message['slot'], message['name'], pixels, [tuple(l) for l in message['labels']])
+
+  def release(self, frame):
+    """Hands the slot of frame back to the publisher, its pixels mustn't be used afterwards."""
+    frame.pixels = None
+    self.channel.send({'release': frame.slot})
+
+  def __iter__(self):
+    ## every frame is released when the next one is requested
+    while True:
+      frame = self.receive()
+      if frame is None:
+        break
+      yield frame
+      self.release(frame)
+    self.channel.close()
+
+def main():
+  parser = argparse.ArgumentParser(description='Consume the sprites of a generator in stream mode and print the throughput.')
+  parser.add_argument('--address', '--a', action='store', required=True,
+                      help='Socket path of the frame ring (the generator\'s Frame Stream setting).')
+  args = parser.parse_args()
+  start = time.time()
+  n = 0
+  for frame in Consumer(args.address):
+    n += 1
+    print(frame.name, frame.pixels.shape, frame.labels)
+  duration = time.time() - start
+  print('{} sprites in {:.1f}s ({:.1f} per second).'.format(n, duration, n / max(duration, 1e-9)))
+
+if __name__ == "__main__":
+  main()
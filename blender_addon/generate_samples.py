@@ -1,10 +1,9 @@
 import bpy
 from math import radians, pi, sin, cos
 import random
-import os, glob
-from scipy import ndimage, misc
-from skimage import draw, color
+import os, re, json
 import numpy as np
+from SampleGenerator import label_store, index_pass, work_queue, render_tuning, relight, planner, asset_cache, frame_ring, pyramid, output_layout
 
 def getChildren(objs):
     ## returns children of a blender object
@@ -73,8 +72,8 @@ def place_objects_rand_on_bg(objects, img_list, step, tree_nodes):
 
 def cyclic_arangement(objects, camera, cam_dist, step, step_count, img_list):
     ## hides, reveals and rotates the objects and moves the camera so every object is visible for the same amount of images from a diverse range of viewpoints
+    ## returns the visible object
 
-    MAX_CAM_STEPS = 20 ## the max amount of camera steps to go from the lowest to the highest position and start again. lowest and highest position are defined by cam_pos_range
     BACKGROUND_REFLECTIONS = True
 
     # Image texture onto background for more realistic reflections
@@ -90,27 +89,78 @@ def cyclic_arangement(objects, camera, cam_dist, step, step_count, img_list):
         child.hide_render = True
 
     # get the current object when every object should be visible in the same number of render steps
-    # (step_count/len(objects) is the number of steps for each object)
-    steps_per_obj = step_count/len(objects)
-    obj = objects[int(step/steps_per_obj)]
+    # (step_count/len(objects) is the number of steps for each object, see planner.cyclic_step)
+    i, rotation_angle, cam_elevation = planner.cyclic_step(objects, step, step_count)
+    obj = objects[i]
 
     # visibility and rotation of object
     obj.hide_render = False
     for child in getChildren([obj]):
         child.hide_render = False
     # obj.hide = False
-    rotation_min = obj['rotation_range'][0]
-    rotation_range = obj['rotation_range'][1] - rotation_min
-    rotation_angle = rotation_min + (step % steps_per_obj) * (rotation_range / steps_per_obj)
     obj.rotation_euler[2] = radians(rotation_angle)
     
     # cam placement
-    cam_steps = min(steps_per_obj, MAX_CAM_STEPS)
-    cam_pos_min = obj['cam_pos_range'][0]
-    cam_pos_range = obj['cam_pos_range'][1] - cam_pos_min
-    camera.location[0] = cam_dist*cos(radians(cam_pos_min + (step%cam_steps)*cam_pos_range/cam_steps))
+    camera.location[0] = cam_dist*cos(radians(cam_elevation))
     camera.location[1] = 0
-    camera.location[2] = cam_dist*sin(radians(cam_pos_min + (step%cam_steps)*cam_pos_range/cam_steps))
+    camera.location[2] = cam_dist*sin(radians(cam_elevation))
+    return obj
+
+def pack_layout(camera, bg_size, cam_dist, pack_size):
+    ## widens the frame to pack_size slots of bg_size side by side. The camera keeps the vertical field of view of a
+    ## single slot, so every slot shows its object like a frame of the single object mode. Returns the slot width in
+    ## scene units at the camera target distance and the camera settings to restore afterwards.
+    cam_data = camera.data
+    saved = (cam_data.sensor_fit, cam_data.sensor_height)
+    width, height = bg_size[0], bg_size[1]
+    if cam_data.sensor_fit == 'VERTICAL':
+        sensor_height = cam_data.sensor_height
+    elif cam_data.sensor_fit == 'HORIZONTAL' or width >= height:
+        sensor_height = cam_data.sensor_width * height / width
+    else:
+        sensor_height = cam_data.sensor_width
+    cam_data.sensor_fit = 'VERTICAL'
+    cam_data.sensor_height = sensor_height
+    bpy.data.scenes["Scene"].render.resolution_x = width * pack_size
+    bpy.data.scenes["Scene"].render.resolution_y = height
+    slot_width = cam_dist * sensor_height * width / height / cam_data.lens
+    return slot_width, saved
+
+def packed_arangement(objects, pack_size, slot_width, camera, cam_dist, step, step_count, img_list):
+    ## like cyclic_arangement, but shows pack_size objects side by side (object k centered in slot k of the packed frame, see pack_layout)
+    ## step counts packed frames; every object is visible in step_count/len(objects) of them with its own rotation range.
+    ## the camera position is shared, taken from the overlap of the objects' cam_pos_range (the first object's if they don't overlap)
+    ## returns the visible objects
+
+    BACKGROUND_REFLECTIONS = True
+
+    if BACKGROUND_REFLECTIONS:
+        bg_img_path = img_list[step % len(img_list)-1]
+        bpy.data.images["ground.jpg"].filepath = bg_img_path
+
+    # hide all objects
+    for obj in objects:
+        obj.hide_render = True
+    for child in getChildren(objects):
+        child.hide_render = True
+
+    pack_steps, cam_elevation = planner.packed_step(objects, pack_size, step, step_count)
+    pack = [objects[i] for i, _ in pack_steps]
+
+    for k, (obj, (_, rotation_angle)) in enumerate(zip(pack, pack_steps)):
+        obj.hide_render = False
+        for child in getChildren([obj]):
+            child.hide_render = False
+        obj.rotation_euler[2] = radians(rotation_angle)
+        ## the camera looks along -x, slots are ordered along +y (left to right in the image)
+        obj.location[0] = 0
+        obj.location[1] = (k - (pack_size-1)/2.) * slot_width
+
+    # shared cam placement
+    camera.location[0] = cam_dist*cos(radians(cam_elevation))
+    camera.location[1] = 0
+    camera.location[2] = cam_dist*sin(radians(cam_elevation))
+    return pack
 
 def random_cam_placement(camera, focus, target_obj):
     # not used in current version
@@ -174,7 +224,16 @@ def texture_adjustments():
                 if "noise_mix" in n.name:
                     n.inputs[0].default_value = .35 + random.random()*.65
 
-def save_label(output_path, bg_size, objects, bg_img_path=None, read_classes=True, segmentation=False):
+FLAT_LAYOUT = output_layout.Layout()
+
+def save_label(output_path, bg_size, objects, bg_img_path=None, read_classes=True, segmentation=False, store_path=None, relight_factors=None, trim=False, sizes=(), pack=None, layout=FLAT_LAYOUT, writers=None):
+    ## writes a Yolo label file per frame or, if store_path is set, appends the labels to a label store (see label_store.py)
+    ## writers: label_store.LabelWriters holding the stores open for the job (opened per frame without)
+    ## layout: file names and subdirectories of the output folder (see output_layout.py)
+    ## relight_factors: (direct_scale, exposure) per lighting variant written along with the frame (see relit_variants)
+    ## trim: the rendered sprite (and its variants) is cropped to its alpha extent and the labels are relative to the crop
+    ## sizes: further output sizes the sprites of the visible object (pack) are written in (see save_sizes)
+    ## returns {output size (None for the rendered one): [(sprite name, labels)] written}
     if segmentation:
         ## Save the segmentation image
         classImg = np.array(bpy.data.images['Viewer Node'].pixels[:]).reshape(bg_size[0],bg_size[1],-1)
@@ -183,43 +242,319 @@ def save_label(output_path, bg_size, objects, bg_img_path=None, read_classes=Tru
         # classImg = np.array( [ [ pixel[0] for pixel in row ] for row in classImg ] )
         if not os.path.exists(output_path):
             os.makedirs(output_path)
-        misc.toimage(classImg, cmin=0, cmax=255).save(output_path + str(bpy.data.scenes['Scene'].frame_current).zfill(4) + '.png')
-        # misc.imsave(output_path + str(bpy.data.scenes['Scene'].frame_current).zfill(4) + '.png', classImg)
+        index_pass.save_class_image(layout.path(output_path, output_layout.index_name(bpy.data.scenes['Scene'].frame_current), '.png', create=True), classImg)
     else:
-        f_label = open(output_path + str(bpy.data.scenes['Scene'].frame_current).zfill(4) + '.txt', 'w')
+        frame_name = output_layout.index_name(bpy.data.scenes['Scene'].frame_current)
+        labels = []
         if read_classes and os.path.isfile(bg_img_path[:-4] + '.txt'):
             bg_annotation = open(bg_img_path[:-4] + '.txt', 'r')
-            f_label.write(bg_annotation.read())
+            labels += label_store.parse_labels(bg_annotation.read())
             bg_annotation.close()
         classImg = np.array(bpy.data.images['Viewer Node'].pixels[:]).reshape(bg_size[1],bg_size[0],-1)
         # One value per pixel
         classImg = classImg[::-1,:,0]
         # YOLO style boundingboxes
-        for i in range(len(objects)):
-            # Finding non zero values
-            mask = (classImg == i+1)
-            rows = np.any(mask, axis=1)
-            cols = np.any(mask, axis=0)
-            if rows.any():
-                # min and max indices for bounding box
-                ymin, ymax = np.where(rows)[0][[0, -1]]
-                xmin, xmax = np.where(cols)[0][[0, -1]]
-                print(ymin, ymax, xmin, xmax)
-                x = ((xmin + xmax)/2)/ bg_size[0]
-                width = (xmax - xmin) / bg_size[0]
-                y = ((ymin + ymax)/2)/ bg_size[1]
-                height = (ymax - ymin) / bg_size[1]
-                if (width*height)>.005:
-                    print("{} {} {} {} {}".format(objects[i]['class'],x,y,width,height))
-                    print("{} {} {} {} {}".format(objects[i]['class'],x,y,width,height), file = f_label)
-
+        for i, x, y, width, height in index_pass.pass_boxes(classImg, len(objects)):
+            print("{} {} {} {} {}".format(objects[i]['class'],x,y,width,height))
+            labels.append((objects[i]['class'],x,y,width,height))
+
+        rgba = None
+        if trim or sizes:
+            frame_path = file_output_path(bpy.data.scenes['Scene'].node_tree.nodes['File Output'], 3, bpy.data.scenes['Scene'].frame_current)
+            rgba = load_rgba8(frame_path)
+        extent = None
+        if trim:
+            crop, extent = index_pass.trim(rgba)
+            if extent:
+                index_pass.save_png(frame_path, crop)
+                labels = [label[:1] + index_pass.crop_box(label[1:], bg_size, extent) for label in labels]
+
+        ## lighting variants share the labels (and the alpha) of the frame
+        names = [frame_name]
+        variants = relit_variants(classImg, relight_factors) if relight_factors else []
+        for k, variant in enumerate(variants):
+            names.append('{}_l{}'.format(frame_name, k+1))
+            index_pass.save_png(layout.path(output_path, names[-1], '.png', create=True), index_pass.crop_to(variant, extent))
+
+        for name in names:
+            write_labels(output_path, name, labels, store_path, layout, writers)
+        written = {None: [(name, labels) for name in names]}
+        if sizes:
+            written.update(save_sizes(output_path, sizes, rgba, classImg, variants, pack, bg_size[0], [frame_name], store_path, trim, layout, writers))
+        return written
+
+def write_labels(output_path, name, labels, store_path=None, layout=FLAT_LAYOUT, writers=None):
+    ## Yolo label file next to the sprite or entry in the label store
+    if store_path and writers is not None:
+        writers.add(store_path, name, labels)
+    elif store_path:
+        label_store.append_labels(store_path, name, labels)
+    else:
+        f_label = open(layout.path(output_path, name, '.txt', create=True), 'w')
+        f_label.write(label_store.format_labels(labels))
         f_label.close()
 
+def file_output_path(node, slot_index, frame):
+    ## path of the image a File Output node wrote for frame (Blender replaces the last run of '#' in the slot path
+    ## by the zero padded frame number or appends 4 digits if there is none)
+    path = node.file_slots[slot_index].path
+    runs = list(re.finditer('#+', path))
+    if runs:
+        run = runs[-1]
+        path = path[:run.start()] + str(frame).zfill(run.end() - run.start()) + path[run.end():]
+    else:
+        path += str(frame).zfill(4)
+    slot_format = node.format if node.file_slots[slot_index].use_node_format else node.file_slots[slot_index].format
+    extension = {'PNG': '.png', 'JPEG': '.jpg', 'TIFF': '.tif', 'OPEN_EXR': '.exr'}.get(slot_format.file_format, '.png')
+    return node.base_path.replace('//','./') + path + extension
+
+def layout_slot_path(path, layout, name):
+    ## File Output slot path writing the frame named name into its layout directory (Blender creates it), with the
+    ## frame number padded to the index width. path is the slot path set in the scene, e.g. rgba/####
+    head, tail = path[:path.rfind('/')+1], path[path.rfind('/')+1:]
+    runs = list(re.finditer('#+', tail))
+    if runs:
+        tail = tail[:runs[-1].start()] + '#' * layout.width + tail[runs[-1].end():]
+    else:
+        tail += '#' * layout.width
+    return head + os.path.join(layout.subdir(name), tail)
+
+def load_rgba8(path):
+    ## 8 bit RGBA pixels (top row first) of a rendered png
+    img = bpy.data.images.load(path)
+    width, height = img.size[:]
+    rgba = np.array(img.pixels[:]).reshape(height, width, 4)[::-1]
+    bpy.data.images.remove(img)
+    return (np.clip(rgba, 0, 1)*255 + .5).astype(np.uint8)
+
+def save_packed(output_path, frame_path, slot_width, pack, store_path=None, relight_factors=None, trim=False, sizes=(), layout=FLAT_LAYOUT, writers=None):
+    ## splits a packed frame (see packed_arangement) into one sprite per object, each with its own label
+    ## (the sprites look like frames of the single object mode, named <frame>_<slot>, lighting variants <frame>_<slot>_l<k>)
+    ## trim: every sprite is cropped to its alpha extent, its variants to the same extent
+    ## sizes: further output sizes (see save_sizes)
+    ## returns {output size (None for the rendered one): [(sprite name, labels)] written}
+    rgba = load_rgba8(frame_path)
+    height, width = rgba.shape[:2]
+    os.remove(frame_path)
+    classImg = np.array(bpy.data.images['Viewer Node'].pixels[:]).reshape(height, width, -1)
+    classImg = classImg[::-1,:,0]
+
+    frame_name = output_layout.index_name(bpy.data.scenes['Scene'].frame_current)
+    names = ['{}_{}'.format(frame_name, k) for k in range(len(pack))]
+    variants = relit_variants(classImg, relight_factors) if relight_factors else []
+    written = {None: save_sprites(output_path, frame_sprites(rgba, classImg, pack, slot_width, names, variants, trim), store_path, layout, writers)}
+    if sizes:
+        written.update(save_sizes(output_path, sizes, rgba, classImg, variants, pack, slot_width, names, store_path, trim, layout, writers))
+    return written
+
+def save_sprites(output_path, sprites, store_path=None, layout=FLAT_LAYOUT, writers=None):
+    ## writes [(sprite name, rgba, labels)] as png and labels, returns [(sprite name, labels)]
+    for name, crop, labels in sprites:
+        index_pass.save_png(layout.path(output_path, name, '.png', create=True), crop)
+        write_labels(output_path, name, labels, store_path, layout, writers)
+    return [(name, labels) for name, _, labels in sprites]
+
+def sized_path(path, size):
+    ## output folder or label store of an output size: <path>_<size>
+    return path.rstrip('/') + '_{}'.format(size) + ('/' if path.endswith('/') else '')
+
+def save_sizes(output_path, sizes, rgba, classImg, variants, pack, slot_width, names, store_path=None, trim=False, layout=FLAT_LAYOUT, writers=None):
+    ## writes the sprites of a frame (rgba and lighting variants, 8 bit) at every output size (long side in pixels) to
+    ## <output_path>_<size>/ (labels to <store_path>_<size> with a label store). pixels and index pass are downscaled
+    ## (see pyramid.py) and the labels computed from the downscaled index pass. returns {size: [(sprite name, labels)]}
+    height, width = rgba.shape[:2]
+    n_slots = width // slot_width
+    written = {}
+    for size in sizes:
+        level_width, level_height = pyramid.level_size((slot_width, height), size)
+        frame_width = level_width * n_slots
+        level_class = pyramid.downscale_index(classImg, frame_width, level_height)
+        level_variants = [pyramid.downscale_rgba(variant, frame_width, level_height) for variant in variants]
+        sprites = frame_sprites(pyramid.downscale_rgba(rgba, frame_width, level_height), level_class, pack, level_width, names, level_variants, trim)
+        written[size] = save_sprites(sized_path(output_path, size), sprites, store_path and sized_path(store_path, size), layout, writers)
+    return written
+
+def frame_sprites(rgba, classImg, pack, slot_width, names, variants=(), trim=False):
+    ## sprites of a frame of side by side slots (one object of pack each, see index_pass.split_slots) and of its lighting
+    ## variants (<name>_l<k>), optionally trimmed to their alpha extent. returns [(sprite name, rgba, labels)]
+    height = rgba.shape[0]
+    pass_indices = [obj.pass_index for obj in pack]
+    slots = index_pass.split_slots(rgba, classImg, pass_indices, slot_width)
+    extents = [None] * len(slots)
+    if trim:
+        for k, (crop, box) in enumerate(slots):
+            crop, extents[k] = index_pass.trim(crop)
+            if extents[k] and box:
+                box = index_pass.crop_box(box, (slot_width, height), extents[k])
+            slots[k] = (crop, box)
+    sprites = [[(names[k], crop)] for k, (crop, _) in enumerate(slots)]
+    for l, variant in enumerate(variants):
+        for k, (crop, _) in enumerate(index_pass.split_slots(variant, classImg, pass_indices, slot_width)):
+            sprites[k].append(('{}_l{}'.format(names[k], l+1), index_pass.crop_to(crop, extents[k])))
+
+    result = []
+    for obj, (_, box), obj_sprites in zip(pack, slots, sprites):
+        labels = [(obj['class'],) + tuple(box)] if box else []
+        result += [(name, crop, labels) for name, crop in obj_sprites]
+    return result
+
+STREAM_NODES = ('Stream Separate', 'Stream Index', 'Stream Alpha', 'Stream Combine')
+
+def setup_stream_viewer(tree):
+    ## stream mode: links the render to the Viewer node with the object index encoded in its alpha (alpha + 2 * IndexOB),
+    ## so the pixels and the index pass of a frame are read from memory in one go (see read_stream_viewer) and the
+    ## File Output node is muted (restored by main)
+    nodes = tree.nodes
+    def node(name, node_type):
+        n = nodes.get(name)
+        if n is None:
+            n = nodes.new(node_type)
+            n.name = n.label = name
+        return n
+    separate, index, alpha, combine = [node(name, node_type) for name, node_type in zip(STREAM_NODES,
+        ('CompositorNodeSepRGBA', 'CompositorNodeMath', 'CompositorNodeMath', 'CompositorNodeCombRGBA'))]
+    index.operation = 'MULTIPLY'
+    index.inputs[1].default_value = 2
+    alpha.operation = 'ADD'
+    index.use_clamp = alpha.use_clamp = False
+    render_layers = nodes["Render Layers"]
+    tree.links.new(render_layers.outputs["Image"], separate.inputs[0])
+    tree.links.new(render_layers.outputs["IndexOB"], index.inputs[0])
+    tree.links.new(separate.outputs['A'], alpha.inputs[0])
+    tree.links.new(index.outputs[0], alpha.inputs[1])
+    for channel in 'RGB':
+        tree.links.new(separate.outputs[channel], combine.inputs[channel])
+    tree.links.new(alpha.outputs[0], combine.inputs['A'])
+    tree.links.new(combine.outputs[0], nodes["Viewer"].inputs[0])
+    nodes["Viewer"].use_alpha = True
+    nodes['File Output'].mute = True
+
+def read_stream_viewer(width, height):
+    ## 8 bit sRGB RGBA pixels (like the File Output png) and index pass (top row first) of the frame in the Viewer node
+    pixels = np.array(bpy.data.images['Viewer Node'].pixels[:], dtype=np.float32).reshape(height, width, 4)[::-1]
+    classImg = np.floor(pixels[...,3] / 2)
+    pixels[...,3] -= 2 * classImg
+    return relight.to_srgb8(pixels), classImg
+
+def publish_frame(ring, width, height, pack, slot_width, names, relight_factors=None, trim=False):
+    ## stream mode: the sprites and labels of the frame go to the frame ring (see frame_ring.py) instead of files
+    rgba, classImg = read_stream_viewer(width, height)
+    variants = relit_variants(classImg, relight_factors) if relight_factors else []
+    for name, crop, labels in frame_sprites(rgba, classImg, pack, slot_width, names, variants, trim):
+        ring.publish(name, np.ascontiguousarray(crop), labels)
+
+RELIGHT_NODE = 'Relight Passes'
+## render layer (and light group) lit by the sun alone
+SUN_LAYER = 'Relight Sun'
+
+def setup_relight_passes(scene, sun):
+    ## enables the passes a render is relit from (see relight.py) and a File Output node writing them as float EXR per frame.
+    ## the direct light passes of a render layer include the direct light of the world, so the ones of the sun come from
+    ## a second render layer without other lamps and world (rendered along with the frame), the color passes from the first
+    layer = scene.render.layers[0]
+    layer.use_pass_diffuse_color = layer.use_pass_glossy_color = layer.use_pass_transmission_color = True
+    sun_layer = scene.render.layers.get(SUN_LAYER)
+    if sun_layer is None:
+        sun_layer = scene.render.layers.new(SUN_LAYER)
+    sun_layer.layers = layer.layers
+    sun_layer.use_sky = False
+    group = bpy.data.groups.get(SUN_LAYER) or bpy.data.groups.new(SUN_LAYER)
+    for obj in list(group.objects):
+        if obj != sun:
+            group.objects.unlink(obj)
+    if sun.name not in group.objects:
+        group.objects.link(sun)
+    sun_layer.light_override = group
+    sun_layer.use_pass_diffuse_direct = sun_layer.use_pass_glossy_direct = sun_layer.use_pass_transmission_direct = True
+    tree = scene.node_tree
+    node = tree.nodes.get(RELIGHT_NODE)
+    if node is None:
+        node = tree.nodes.new('CompositorNodeOutputFile')
+        node.name = node.label = RELIGHT_NODE
+        node.file_slots[0].path = 'Image_'
+        for light, color in relight.DIRECT_PASSES:
+            node.file_slots.new(light + '_')
+            node.file_slots.new(color + '_')
+    node.base_path = os.path.join(bpy.app.tempdir, 'relight_passes', '')
+    node.format.file_format = 'OPEN_EXR'
+    node.format.color_mode = 'RGBA'
+    node.format.color_depth = '32'
+    sun_passes = tree.nodes.get(SUN_LAYER)
+    if sun_passes is None:
+        sun_passes = tree.nodes.new('CompositorNodeRLayers')
+        sun_passes.name = sun_passes.label = SUN_LAYER
+    sun_passes.layer = SUN_LAYER
+    render_layers = tree.nodes["Render Layers"]
+    lights = [light for light, _ in relight.DIRECT_PASSES]
+    for slot in node.inputs:
+        source = sun_passes if slot.name[:-1] in lights else render_layers
+        tree.links.new(source.outputs[slot.name[:-1]], slot)
+    return node
+
+def load_pass(path):
+    ## float pixels (top row first) of an image written by a File Output node, the file is removed afterwards
+    img = bpy.data.images.load(path)
+    width, height = img.size[:]
+    pixels = np.array(img.pixels[:], dtype=np.float32).reshape(height, width, -1)[::-1]
+    bpy.data.images.remove(img)
+    os.remove(path)
+    return pixels
+
+def relit_variants(class_img, factors):
+    ## lighting variants of the current frame from the passes written by the relight node (see setup_relight_passes)
+    node = bpy.data.scenes['Scene'].node_tree.nodes[RELIGHT_NODE]
+    frame = bpy.data.scenes['Scene'].frame_current
+    passes = {slot.path[:-1]: load_pass(file_output_path(node, i, frame)) for i, slot in enumerate(node.file_slots)}
+    combined = passes.pop('Image')
+    return relight.variants(combined, passes, class_img != 0, factors)
+
+def write_plan(output_path, objects, step_count, frame_count, pack_size, relight_variants, prepare_frame, chunk_size = None, slot_width = None, trim = False, sizes = ()):
+    ## dry run: renders the calibration frames only and writes the projected time and size (plan.json) and the
+    ## schedule of the job (plan_schedule.csv: frame, object, rotation, camera elevation per sprite) to output_path
+    ## slot_width, trim, sizes: sprites of a packed frame, trimmed and further output sizes (see planner.output_bytes)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    sample_path = os.path.join(output_path, 'plan_sample.png')
+    seconds_per_frame = render_tuning.time_frames(bpy.context.scene, prepare_frame, sample_path=sample_path)
+    if trim or sizes or slot_width:
+        ## the sprites the job writes, encoded like save_sprites does
+        rgba = load_rgba8(sample_path)
+        bytes_per_frame = planner.output_bytes(rgba, slot_width or rgba.shape[1], trim, sizes)
+    else:
+        bytes_per_frame = os.path.getsize(sample_path)
+    os.remove(sample_path)
+    entries = list(planner.schedule(objects, step_count, pack_size))
+    ## sprites of a packed frame share its pixels, every lighting variant is a copy of them
+    sprites_per_frame = len(entries) * (1 + relight_variants) / float(frame_count)
+    projection = planner.project(frame_count, seconds_per_frame, bytes_per_frame * (1 + relight_variants), sprites_per_frame, chunk_size)
+
+    names = [o.name for o in objects]
+    with open(os.path.join(output_path, 'plan_schedule.csv'), 'w') as f:
+        f.write('frame,object,rotation,cam_elevation\n')
+        for frame, i, angle, elevation in entries:
+            f.write('{},{},{:.3f},{:.3f}\n'.format(frame, names[i], angle, elevation))
+    plan = {'projection': projection, 'coverage': planner.coverage(entries, names)}
+    with open(os.path.join(output_path, 'plan.json'), 'w') as f:
+        json.dump(plan, f, indent=2)
+    planner.print_plan(plan)
+
 def main():
     # SEGMENTATION = bpy.context.scene.sg_label_mode == "sgSegment"
     # RENDER_CROPPED = bpy.context.scene.sg_render_mode == "sgCropped"
     SEGMENTATION = False
     RENDER_CROPPED = True
+    ## objects per render in cropped mode, split into one sprite per object afterwards
+    PACK_SIZE = bpy.context.scene.sg_pack_size if RENDER_CROPPED else 1
+    ## extra lighting variants per render in cropped mode, recombined from light passes (see relight.py)
+    RELIGHT_VARIANTS = bpy.context.scene.sg_relight_variants if RENDER_CROPPED else 0
+    ## only calibration frames are rendered, the schedule and projected time and size of the job are written (see planner.py)
+    DRY_RUN = bpy.context.scene.sg_dry_run
+    ## sprites are cropped to their alpha extent, labels relative to the crop
+    TRIM_SPRITES = bpy.context.scene.sg_trim_sprites and RENDER_CROPPED
+    ## long sides of the outputs in pixels: rendered at the largest (to rgba/), the others downscaled from it (to rgba_<size>/)
+    OUTPUT_SIZES = pyramid.parse_sizes(bpy.context.scene.sg_output_sizes) if RENDER_CROPPED else []
+    ## file names (frame numbers padded to INDEX_WIDTH digits) and subdirectories of the output folders (see output_layout.py)
+    layout = output_layout.Layout(bpy.context.scene.sg_output_layout, bpy.context.scene.sg_fan_out)
 
     cam = bpy.context.scene.sg_cam
     objects = bpy.context.scene.sg_objectGroup.objects
@@ -230,14 +565,25 @@ def main():
     cam_target = bpy.context.scene.sg_cam_target
     tree_nodes = bpy.context.scene.node_tree.nodes
     bg_size = bpy.context.scene.sg_img_size
+    if OUTPUT_SIZES:
+        ## the aspect ratio of the image size, scaled to the largest output size
+        scale = float(OUTPUT_SIZES[0]) / max(bg_size)
+        bg_size = (int(round(bg_size[0] * scale)), int(round(bg_size[1] * scale)))
+        OUTPUT_SIZES = OUTPUT_SIZES[1:]
     cam_dist = bpy.context.scene.sg_cam_dist
     compositing_node_group = bpy.data.scenes["Scene"].node_tree
 
     step_count = bpy.context.scene.sg_nSamples
     bg_path = bpy.context.scene.sg_backgroundPath.replace("//","")
     output_path = tree_nodes['File Output'].base_path.replace('//','./')
-
-    img_list = sorted(glob.glob(bg_path+"*.png")+glob.glob(bg_path+"*.jpg"))
+    store_path = bpy.context.scene.sg_label_store.replace('//','./') or None
+    queue_path = os.environ.get('SG_QUEUE') or bpy.context.scene.sg_queue_path.replace('//','./')
+    ## rendered frames are cached by the hash of their objects and settings, unchanged frames are copied (see asset_cache.py)
+    cache_path = bpy.context.scene.sg_cache_path.replace('//','./') if RENDER_CROPPED else ''
+    ## stream mode: sprites and labels are handed to a consumer process through shared memory instead of files (see frame_ring.py)
+    stream_address = (os.environ.get('SG_STREAM') or bpy.context.scene.sg_stream_address) if RENDER_CROPPED else ''
+
+    img_list = output_layout.scan(bg_path, ('.png', '.jpg'))
     
     if RENDER_CROPPED:
         output_path += 'rgba/'
@@ -279,11 +625,114 @@ def main():
         compositing_node_group.links.new(c_nodes["Render Layers"].outputs["Image"],c_nodes["File Output"].inputs[3])
         compositing_node_group.links.new(c_nodes["Render Layers"].outputs["IndexOB"],c_nodes["Viewer"].inputs[0])
 
+    if RELIGHT_VARIANTS:
+        setup_relight_passes(bpy.context.scene, sun)
 
-    for step in range(0, step_count):
+    if stream_address:
+        setup_stream_viewer(compositing_node_group)
 
-        if RENDER_CROPPED:
+    if PACK_SIZE > 1:
+        slot_width, saved_sensor = pack_layout(cam, bg_size, cam_dist, PACK_SIZE)
+    ## every pack of objects gets the frames a single object gets in cropped mode
+    frame_count = planner.frame_count(len(objects), step_count, PACK_SIZE)
+
+    if queue_path and not DRY_RUN:
+        ## steps are leased from a queue shared with other workers and every frame is named by its step
+        queue = work_queue.WorkQueue.create(queue_path, frame_count)
+        frame_count = queue.n_samples
+        if PACK_SIZE == 1:
+            step_count = frame_count
+        steps = queue.steps(store_path)
+    else:
+        queue = None
+        steps = ((step, store_path) for step in range(0, frame_count))
+
+    ## calibration frames spread over all objects like the frames of the job
+    def prepare_frame(i):
+        step = int((i + .5) * frame_count / render_tuning.CALIBRATION_FRAMES)
+        if PACK_SIZE > 1:
+            packed_arangement(objects, PACK_SIZE, slot_width, cam, cam_dist, step, step_count, img_list)
+        elif RENDER_CROPPED:
             cyclic_arangement(objects, cam, cam_dist, step, step_count, img_list)
+        else:
+            place_objects_rand_on_bg(objects, img_list, step, tree_nodes)
+
+    if bpy.context.scene.sg_auto_tune and frame_count:
+        render_tuning.tune(bpy.context.scene, prepare_frame)
+
+    if DRY_RUN:
+        chunk_size = None
+        if queue_path:
+            ## the chunk size of an existing queue, the default one of a queue that would be created
+            job_exists = os.path.exists(os.path.join(queue_path, 'job.json'))
+            chunk_size = work_queue.WorkQueue(queue_path).chunk_size if job_exists else work_queue.CHUNK_SIZE
+        if frame_count:
+            write_plan(output_path, objects, step_count, frame_count, PACK_SIZE, RELIGHT_VARIANTS, prepare_frame, chunk_size,
+                       bg_size[0] if PACK_SIZE > 1 else None, TRIM_SPRITES, OUTPUT_SIZES)
+        steps = ()
+
+    ring = None
+    if stream_address and not DRY_RUN:
+        ## a slot holds the largest sprite, an untrimmed one
+        ring = frame_ring.Publisher(stream_address, bg_size[0] * bg_size[1] * 4)
+
+    if not (DRY_RUN or ring):
+        ## readers of the output folders find the layout in their layout.json
+        for path in [output_path] + [sized_path(output_path, size) for size in OUTPUT_SIZES]:
+            layout.save(path)
+    ## the rendered frame is written to its layout directory, the slot path is restored after the job
+    output_slot = tree_nodes['File Output'].file_slots[3]
+    slot_path = output_slot.path
+
+    cache = None
+    if cache_path and not (DRY_RUN or ring):
+        ## hashed once, before the per frame adjustments change anything
+        cache = asset_cache.FrameCache(cache_path)
+        scene_hash = asset_cache.scene_state(bpy.context.scene, cam, sun, ground, bpy.data.materials,
+                                             (cam_dist, tuple(bg_size), PACK_SIZE, RELIGHT_VARIANTS, TRIM_SPRITES, tuple(OUTPUT_SIZES)))
+        object_hashes = [asset_cache.object_state(o) for o in objects]
+
+    ## label stores are kept open for the frames of a chunk (of the whole job without a queue), opening one reads its names
+    ## (closed when a chunk starts: its store is new, also if the chunk was leased before)
+    writers = label_store.LabelWriters()
+    chunk = (None, None)
+    for step, step_store_path in steps:
+        if chunk != (step_store_path, step - 1):
+            writers.close()
+        chunk = (step_store_path, step)
+
+        if queue:
+            bpy.data.scenes['Scene'].frame_current = step
+        frame_name = output_layout.index_name(bpy.data.scenes['Scene'].frame_current)
+
+        if cache:
+            if PACK_SIZE > 1:
+                pack_steps, cam_elevation = planner.packed_step(objects, PACK_SIZE, step, step_count)
+            else:
+                i, rotation_angle, cam_elevation = planner.cyclic_step(objects, step, step_count)
+                pack_steps = [(i, rotation_angle)]
+            noise_frame = bpy.data.scenes['Scene'].frame_current if bpy.context.scene.cycles.use_animated_seed else None
+            key = asset_cache.frame_key(scene_hash, [(object_hashes[i], angle) for i, angle in pack_steps], cam_elevation,
+                                        img_list[step % len(img_list)-1], noise_frame)
+            ## (key, output folder, label store) of every output size, the sprites of further sizes are cached under <key>_<size>
+            outputs = {None: (key, output_path, step_store_path)}
+            for size in OUTPUT_SIZES:
+                outputs[size] = ('{}_{}'.format(key, size), sized_path(output_path, size), step_store_path and sized_path(step_store_path, size))
+            if all(cache.get(size_key) is not None for size_key, _, _ in outputs.values()):
+                print(frame_name, 'unchanged, copied from the cache.')
+                for size_key, size_path, size_store_path in outputs.values():
+                    for name, labels in cache.restore(size_key, size_path, frame_name, layout):
+                        write_labels(size_path, name, labels, size_store_path, layout, writers)
+                bpy.data.scenes['Scene'].frame_current += 1
+                continue
+            ## the random adjustments of a frame only depend on its key, like its cached output
+            random.seed(key)
+
+        if PACK_SIZE > 1:
+            pack = packed_arangement(objects, PACK_SIZE, slot_width, cam, cam_dist, step, step_count, img_list)
+
+        elif RENDER_CROPPED:
+            pack = [cyclic_arangement(objects, cam, cam_dist, step, step_count, img_list)]
 
         else:
             # Object placement
@@ -302,24 +751,51 @@ def main():
         sun.rotation_euler[2] = random.random()*pi
         sun.rotation_euler[1] = random.random()*pi/2
         # randomize light strength
-        sun.data.node_tree.nodes['Emission'].inputs[1].default_value = random.random()*7 + .8
+        strength = random.random()*7 + .8
+        sun.data.node_tree.nodes['Emission'].inputs[1].default_value = strength
         lamp_sun.shadow_soft_size = random.random()*.3+.015
+        ## lighting variants: strengths from the same range (relative to the rendered one) and exposures of +-half a stop
+        relight_factors = [((random.random()*7 + .8) / strength, 2**random.uniform(-.5, .5)) for _ in range(RELIGHT_VARIANTS)]
 
         ## Rendering
-        bpy.ops.render.render( write_still=True )
+        output_slot.path = layout_slot_path(slot_path, layout, frame_name)
+        bpy.ops.render.render( write_still=not ring )
 
         # save Label
-        if RENDER_CROPPED:
-            save_label(output_path, bg_size, objects, read_classes=False, segmentation=SEGMENTATION)
+        if ring:
+            names = ['{}_{}'.format(frame_name, k) for k in range(len(pack))] if PACK_SIZE > 1 else [frame_name]
+            render = bpy.context.scene.render
+            publish_frame(ring, render.resolution_x, render.resolution_y, pack, bg_size[0], names, relight_factors, TRIM_SPRITES)
+        elif PACK_SIZE > 1:
+            frame_path = file_output_path(tree_nodes['File Output'], 3, bpy.data.scenes['Scene'].frame_current)
+            written = save_packed(output_path, frame_path, bg_size[0], pack, store_path=step_store_path, relight_factors=relight_factors, trim=TRIM_SPRITES, sizes=OUTPUT_SIZES, layout=layout, writers=writers)
+        elif RENDER_CROPPED:
+            written = save_label(output_path, bg_size, objects, read_classes=False, segmentation=SEGMENTATION, store_path=step_store_path, relight_factors=relight_factors, trim=TRIM_SPRITES, sizes=OUTPUT_SIZES, pack=pack, layout=layout, writers=writers)
         else:
-            save_label(output_path, bg_size, objects, bg_img_path=bg_img_path, segmentation=SEGMENTATION)
+            save_label(output_path, bg_size, objects, bg_img_path=bg_img_path, segmentation=SEGMENTATION, store_path=step_store_path, layout=layout, writers=writers)
+
+        if cache:
+            for size, (size_key, size_path, _) in outputs.items():
+                cache.put(size_key, size_path, frame_name, written[size], layout)
 
         bpy.data.scenes['Scene'].frame_current += 1
+    writers.close()
     
+    output_slot.path = slot_path
+    if ring:
+        ring.close()
+    if stream_address:
+        tree_nodes['File Output'].mute = False
+
     # hide all objects again
     for obj in objects:
         obj.hide_render = True
 
+    if PACK_SIZE > 1:
+        for obj in objects:
+            obj.location[1] = 0
+        cam.data.sensor_fit, cam.data.sensor_height = saved_sensor
+
     bpy.data.scenes['Scene'].frame_current = 0
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Yolo style bounding boxes from the object index pass (IndexOB) of a render. Needs nothing but numpy."""
+
+import struct
+import zlib
+import numpy as np
+
+# minimal relative box area (width*height) of a labelled object
+MIN_BOX_AREA = .005
+# transparent border in pixels kept around trimmed sprites
+TRIM_MARGIN = 1
+
+def pass_boxes(class_img, n_objects, min_area = MIN_BOX_AREA):
+    ## returns (object number, x, y, width, height) relative to the image size for every object 1..n_objects in the pass
+    ## (class_img holds one pass index per pixel, top row first)
+    height_px, width_px = class_img.shape[:2]
+    boxes = []
+    for i in range(n_objects):
+        # Finding non zero values
+        mask = (class_img == i+1)
+        rows = np.any(mask, axis=1)
+        cols = np.any(mask, axis=0)
+        if rows.any():
+            # min and max indices for bounding box
+            ymin, ymax = np.where(rows)[0][[0, -1]]
+            xmin, xmax = np.where(cols)[0][[0, -1]]
+            x = ((xmin + xmax)/2)/ width_px
+            width = (xmax - xmin) / width_px
+            y = ((ymin + ymax)/2)/ height_px
+            height = (ymax - ymin) / height_px
+            if (width*height)>min_area:
+                boxes.append((i, x, y, width, height))
+    return boxes
+
+def save_png(path, pixels):
+    ## writes uint8 pixels (height x width greyscale or height x width x 4 RGBA, top row first) as png
+    ## with numpy and zlib only, so the generator doesn't need scipy or PIL inside blender
+    with open(path, 'wb') as f:
+        f.write(png_bytes(pixels))
+
+def png_bytes(pixels):
+    ## the png file save_png writes for pixels
+    height, width = pixels.shape[:2]
+    channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+    color_type = {1: 0, 4: 6}[channels]
+    ## every row starts with filter type 0 (None)
+    raw = np.zeros((height, width * channels + 1), np.uint8)
+    raw[:,1:] = pixels.reshape(height, -1)
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+def save_class_image(path, class_img):
+    ## writes the pass as 8 bit greyscale png (values clipped to 0..255 and rounded like scipy's misc.toimage(cmin=0, cmax=255))
+    save_png(path, (np.clip(class_img, 0, 255) + .5).astype(np.uint8))
+
+def split_slots(rgba, class_img, pass_indices, slot_width, min_area = MIN_BOX_AREA):
+    ## splits a frame of side by side slots of slot_width pixels (one object each, the object with pass_indices[k] in slot k,
+    ## see packed_arangement in generate_samples) into per-object crops. Pixels of other objects reaching into a slot are made transparent.
+    ## returns (crop, box) per object, box is (x, y, width, height) relative to the crop or None if the object isn't (enough) visible
+    slots = []
+    for k, pass_index in enumerate(pass_indices):
+        crop = rgba[:, k*slot_width:(k+1)*slot_width].copy()
+        slot_class = class_img[:, k*slot_width:(k+1)*slot_width]
+        crop[(slot_class != 0) & (slot_class != pass_index), 3] = 0
+        boxes = [b[1:] for b in pass_boxes(slot_class, pass_index, min_area) if b[0] == pass_index-1]
+        slots.append((crop, boxes[0] if boxes else None))
+    return slots
+
+def alpha_extent(alpha, margin = TRIM_MARGIN):
+    ## (xmin, ymin, xmax, ymax) pixel extent (max exclusive) of the non transparent pixels plus margin, clipped to the image
+    ## None if the image is fully transparent. The alpha of a cropped render covers the object (IndexOB) and its shadow.
+    height, width = alpha.shape[:2]
+    rows = np.any(alpha, axis=1)
+    cols = np.any(alpha, axis=0)
+    if not rows.any():
+        return None
+    ymin, ymax = np.where(rows)[0][[0, -1]]
+    xmin, xmax = np.where(cols)[0][[0, -1]]
+    return (int(max(xmin - margin, 0)), int(max(ymin - margin, 0)),
+            int(min(xmax + margin + 1, width)), int(min(ymax + margin + 1, height)))
+
+def crop_box(box, size, extent):
+    ## box (x, y, width, height) relative to an image of size (width, height) made relative to its crop to extent
+    x, y, w, h = box
+    width, height = size
+    xmin, ymin, xmax, ymax = extent
+    crop_w = float(xmax - xmin)
+    crop_h = float(ymax - ymin)
+    return ((x*width - xmin)/crop_w, (y*height - ymin)/crop_h, w*width/crop_w, h*height/crop_h)
+
+def crop_to(pixels, extent):
+    ## pixels inside extent (see alpha_extent), all of them if extent is None
+    if extent is None:
+        return pixels
+    xmin, ymin, xmax, ymax = extent
+    return pixels[ymin:ymax, xmin:xmax]
+
+def trim(rgba, margin = TRIM_MARGIN):
+    ## crops an RGBA image to its alpha extent plus margin. returns the crop and the extent (None and the image unchanged if it is empty)
+    extent = alpha_extent(rgba[...,3], margin)
+    return crop_to(rgba, extent), extent
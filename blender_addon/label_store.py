@@ -0,0 +1,286 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Columnar binary store for Yolo style labels (an alternative to one text file per image).
+
+A store is a folder with one flat file per column and per-image offsets into them:
+  names.txt   -- image name (file name without extension) per image, one per line
+  offsets.i64 -- int64, offsets[i]:offsets[i+1] are the rows of image i
+  class.i32   -- int32 object class per row
+  cx.f64, cy.f64, w.f64, h.f64 -- float64 relative box centre and size per row
+
+All columns are memory-mapped for reading and only appended to for writing. The offset of an image is written after
+its names and columns, so an interrupted append leaves an image the next writer drops. Needs nothing but numpy,
+so it is used by the Blender addon as well as by the scripts in util/ (run as script to convert from and to .txt files)."""
+
+import os
+import argparse
+import numpy as np
+try:
+  from SampleGenerator import output_layout
+except ImportError:
+  ## imported from outside the addon
+  import output_layout
+
+COLUMNS = (('class', np.int32, 'i32'), ('cx', np.float64, 'f64'), ('cy', np.float64, 'f64'),
+           ('w', np.float64, 'f64'), ('h', np.float64, 'f64'))
+
+def _column_path(path, name, ext):
+  return os.path.join(path, '{}.{}'.format(name, ext))
+
+def _map(file_path, dtype, count = None):
+  ## read only memory map (np.memmap can not map empty files)
+  itemsize = np.dtype(dtype).itemsize
+  size = os.path.getsize(file_path) // itemsize if count is None else count
+  if size == 0:
+    return np.zeros(0, dtype)
+  return np.memmap(file_path, dtype=dtype, mode='r', shape=(size,))
+
+def _names_end(names_path, n):
+  ## byte length of the first n lines of names.txt, raises if it has fewer
+  end = 0
+  with open(names_path, 'rb') as f:
+    while n:
+      block = f.read(1 << 20)
+      if not block:
+        raise ValueError('{} lists fewer images than the offsets of the store.'.format(names_path))
+      count = block.count(b'\n')
+      if count >= n:
+        pos = -1
+        for _ in range(n):
+          pos = block.index(b'\n', pos + 1)
+        return end + pos + 1
+      n -= count
+      end += len(block)
+  return end
+
+def is_label_store(path):
+  return path is not None and os.path.isfile(os.path.join(path, 'offsets.i64'))
+
+def parse_labels(text):
+  """Parses the content of a Yolo label file into rows (class, x, y, w, h)."""
+  rows = []
+  for line in text.split('\n'):
+    params = line.split()
+    if len(params) == 5:
+      rows.append((int(float(params[0])),) + tuple(map(float, params[1:])))
+  return rows
+
+def format_labels(rows):
+  """Formats label rows (class, x, y, w, h) as the content of a Yolo label file."""
+  return ''.join("{} {} {} {} {}\n".format(int(c), x, y, w, h) for c, x, y, w, h in rows)
+
+class LabelStore(object):
+  """Read access to a label store. Columns are memory-mapped numpy arrays over all rows:
+  store.classes, store.cx, store.cy, store.w, store.h; store.offsets delimits the rows of each image.
+  
+  Arguments:
+    path {str} -- Path of the store folder.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    offsets = _map(_column_path(path, 'offsets', 'i64'), np.int64)
+    self.offsets = offsets if len(offsets) else np.zeros(1, np.int64)
+    n_rows = int(self.offsets[-1])
+    self.classes, self.cx, self.cy, self.w, self.h = [_map(_column_path(path, name, ext), dtype, n_rows)
+                                                      for name, dtype, ext in COLUMNS]
+    self._names = None
+    self._name_index = None
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  @property
+  def names(self):
+    """Image names, read on first use (reading labels by index doesn't need them)."""
+    if self._names is None:
+      with open(os.path.join(self.path, 'names.txt')) as f_names:
+        self._names = f_names.read().split('\n')[:len(self)]
+    return self._names
+
+  def __getstate__(self):
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+  def labels(self, i):
+    """Labels of image i as array (n x 5) with rows class, x, y, w, h."""
+    s, e = self.offsets[i], self.offsets[i+1]
+    return np.stack([self.classes[s:e], self.cx[s:e], self.cy[s:e], self.w[s:e], self.h[s:e]], axis=1).astype(np.float64)
+
+  def rows(self, i):
+    """Labels of image i as list of tuples (class, x, y, w, h) like parse_labels()."""
+    s, e = self.offsets[i], self.offsets[i+1]
+    return list(zip(self.classes[s:e].tolist(), self.cx[s:e].tolist(), self.cy[s:e].tolist(),
+                    self.w[s:e].tolist(), self.h[s:e].tolist()))
+
+  def index_of(self, name):
+    """Index of the image with the given name (file name without extension). Raises KeyError if missing."""
+    if self._name_index is None:
+      self._name_index = {n: i for i, n in enumerate(self.names)}
+    return self._name_index[name]
+
+  def __contains__(self, name):
+    try:
+      self.index_of(name)
+      return True
+    except KeyError:
+      return False
+
+  def image_ids(self):
+    """Image index of every row."""
+    return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+class LabelWriter(object):
+  """Appends images and their labels to a label store (created if it does not exist). Keep one writer open while
+  appending many images, opening a store reads its names.
+  
+  Arguments:
+    path {str} -- Path of the store folder.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    if not os.path.exists(path):
+      os.makedirs(path)
+    offsets_path = _column_path(path, 'offsets', 'i64')
+    if not os.path.isfile(offsets_path):
+      np.zeros(1, np.int64).tofile(offsets_path)
+    self.n = os.path.getsize(offsets_path) // 8 - 1
+    with open(offsets_path, 'rb') as f_offsets:
+      f_offsets.seek(self.n * 8)
+      self.offset = int(np.frombuffer(f_offsets.read(8), np.int64)[0])
+    ## drop what an interrupted append wrote after the last complete image (only then the files are changed)
+    _truncate(offsets_path, (self.n + 1) * 8)
+    for name, dtype, ext in COLUMNS:
+      _truncate(_column_path(path, name, ext), self.offset * np.dtype(dtype).itemsize)
+    names_path = os.path.join(path, 'names.txt')
+    _truncate(names_path, _names_end(names_path, self.n) if self.n else 0)
+    self.f_columns = [open(_column_path(path, name, ext), 'ab') for name, _, ext in COLUMNS]
+    self.f_names = open(names_path, 'ab')
+    self.f_offsets = open(offsets_path, 'ab')
+
+  def add(self, name, rows):
+    """Appends an image name and its label rows (class, x, y, w, h)."""
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    for f_column, (_, dtype, _), column in zip(self.f_columns, COLUMNS, rows.T):
+      f_column.write(column.astype(dtype).tobytes())
+    self.f_names.write((name + '\n').encode('utf-8'))
+    ## names and columns reach the files before the offset completing the image
+    for f in self.f_columns + [self.f_names]:
+      f.flush()
+    self.offset += len(rows)
+    self.n += 1
+    self.f_offsets.write(np.int64(self.offset).tobytes())
+    self.f_offsets.flush()
+
+  def close(self):
+    for f in self.f_columns + [self.f_names, self.f_offsets]:
+      f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def _truncate(file_path, size):
+  ## shortens a file to size bytes (creates an empty one), raises if it is shorter
+  if not os.path.isfile(file_path):
+    open(file_path, 'wb').close()
+  actual = os.path.getsize(file_path)
+  if actual < size:
+    raise ValueError('{} is shorter than the offsets of the store ({} instead of {} bytes).'.format(file_path, actual, size))
+  if actual > size:
+    with open(file_path, 'r+b') as f:
+      f.truncate(size)
+
+def append_labels(path, name, rows):
+  """Appends labels of a single image to the store at path (see LabelWriters to append many)."""
+  with LabelWriter(path) as writer:
+    writer.add(name, rows)
+
+class LabelWriters(object):
+  """Open LabelWriters by store path, for a job appending to one or a few stores (e.g. one per output size)."""
+
+  def __init__(self):
+    self.writers = {}
+
+  def add(self, path, name, rows):
+    """Appends an image to the store at path, opened on first use."""
+    if path not in self.writers:
+      self.writers[path] = LabelWriter(path)
+    self.writers[path].add(name, rows)
+
+  def close(self):
+    for writer in self.writers.values():
+      writer.close()
+    self.writers = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def from_txt(input_path, store_path):
+  """Appends all Yolo label files in input_path (sorted, in any layout, see output_layout.py) to a store. Returns the number of images."""
+  txt_list = output_layout.scan(input_path, ('.txt',))
+  with LabelWriter(store_path) as writer:
+    for txt_name in txt_list:
+      with open(txt_name) as label_file:
+        writer.add(os.path.basename(txt_name)[:-4], parse_labels(label_file.read()))
+  return len(txt_list)
+
+def merge(store_paths, out_path):
+  """Appends all images of the stores in store_paths (in order) to the store at out_path. Returns the number of images."""
+  n = 0
+  with LabelWriter(out_path) as writer:
+    for store_path in store_paths:
+      store = LabelStore(store_path)
+      for i, name in enumerate(store.names):
+        writer.add(name, store.rows(i))
+      n += len(store)
+  return n
+
+def to_txt(store_path, output_path):
+  """Writes one Yolo label file per image of a store into output_path (next to the images in the layout of the folder,
+  see output_layout.py). Returns the number of images."""
+  store = LabelStore(store_path)
+  if not os.path.exists(output_path):
+    os.makedirs(output_path)
+  layout = output_layout.Layout.load(output_path)
+  for i, name in enumerate(store.names):
+    with open(layout.path(output_path, name, '.txt', create=True), 'w') as label_file:
+      label_file.write(format_labels(store.rows(i)))
+  return len(store)
+
+def main():
+  parser = argparse.ArgumentParser(description='Convert Yolo label files to a label store and back.')
+  parser.add_argument('--from_txt', action='store', default=None,
+                      help='Folder with Yolo label files that are appended to the store.')
+  parser.add_argument('--to_txt', action='store', default=None,
+                      help='Output folder for Yolo label files of all images in the store.')
+  parser.add_argument('--store', '--s', action='store', required=True,
+                      help='Path to the label store.')
+  args = parser.parse_args()
+  if args.from_txt:
+    print(from_txt(args.from_txt, args.store), 'label files added to', args.store)
+  if args.to_txt:
+    print(to_txt(args.store, args.to_txt), 'label files written to', args.to_txt)
+
+if __name__ == "__main__":
+  main()
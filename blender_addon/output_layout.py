@@ -0,0 +1,177 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Directory layout of dataset folders: wide zero padded indices and subdirectories with a fixed fan-out.
+
+Frames and samples are named by their index, zero padded to INDEX_WIDTH digits, so names sort like their indices up to
+10 billion samples. The files of a dataset folder are spread over subdirectories, so no directory holds more than
+fan_out entries whatever the size of the dataset:
+  flat   -- <root>/<name>.<ext>, the layout of every folder without a layout.json
+  ranged -- <root>/<a>/<b>/<c>/<name>.<ext>, consecutive indices share a directory (index // fan_out split into levels)
+  hashed -- like ranged, but the last level from a hash of the index: every fan_out**2 consecutive indices share
+            fan_out directories evenly (an even spread of names that aren't consecutive, directories fill like ranged)
+Sprites of a frame (<index>_<slot>, <index>_l<k>, ...) are placed by the index their name starts with, so they share a
+directory. Writers store the layout of a folder in its layout.json and readers load it from there (Layout.load), so
+scripts find files without being told the layout, and scan() lists a folder directory by directory instead of globbing it.
+
+Needs nothing but the standard library, so it is used by the Blender addon as well as by the scripts in util/."""
+
+import os
+import re
+import json
+import zlib
+
+INDEX_WIDTH = 10
+FAN_OUT = 1000
+KINDS = ('flat', 'ranged', 'hashed')
+LAYOUT_FILE = 'layout.json'
+
+_INDEX = re.compile(r'\d+')
+
+def index_name(index, width = INDEX_WIDTH):
+  """Name of a frame or sample: its index zero padded to width digits."""
+  return str(index).zfill(width)
+
+class Layout(object):
+  """Maps file names to paths in a dataset folder.
+
+  Keyword Arguments:
+    kind {str} -- 'flat', 'ranged' or 'hashed' (default: {'flat'})
+    fan_out {int} -- max entries of a subdirectory (default: {FAN_OUT})
+    width {int} -- digits of an index (default: {INDEX_WIDTH}), sets the number of directory levels with fan_out
+  """
+
+  def __init__(self, kind = 'flat', fan_out = FAN_OUT, width = INDEX_WIDTH):
+    if kind not in KINDS:
+      raise ValueError('Unknown layout {}, use one of {}.'.format(kind, ', '.join(KINDS)))
+    if fan_out < 2:
+      raise ValueError('The fan-out of a layout must be at least 2.')
+    self.kind = kind
+    self.fan_out = fan_out
+    self.width = width
+    ## directory levels, so that the files of 10**width indices fit
+    self.levels = 0
+    if kind != 'flat':
+      capacity = fan_out
+      while capacity < 10**width:
+        capacity *= fan_out
+        self.levels += 1
+    self.digits = len(str(fan_out - 1))
+    self._created = set()
+
+  def subdir(self, name):
+    """Directory of a file (by name without extension) relative to the dataset folder, '' in the flat layout."""
+    if not self.levels:
+      return ''
+    match = _INDEX.match(name)
+    if self.kind == 'ranged':
+      if match is None:
+        raise ValueError('{} is not named by an index, it has no place in a ranged layout.'.format(name))
+      bucket = int(match.group()) // self.fan_out
+    elif match:
+      ## the range of fan_out leaf directories ranged uses for these indices, the leaf picked by the hash
+      bucket = int(match.group()) // self.fan_out**2 * self.fan_out + zlib.crc32(match.group().encode('utf-8')) % self.fan_out
+    else:
+      bucket = zlib.crc32(name.encode('utf-8')) % self.fan_out**self.levels
+    parts = []
+    for _ in range(self.levels):
+      bucket, part = divmod(bucket, self.fan_out)
+      parts.append(str(part).zfill(self.digits))
+    return os.path.join(*reversed(parts))
+
+  def relpath(self, name, ext = ''):
+    """Path of a file relative to the dataset folder."""
+    return os.path.join(self.subdir(name), name + ext)
+
+  def path(self, root, name, ext = '', create = False):
+    """Path of the file name + ext in the dataset folder root. If create is set, its directory is created if needed."""
+    folder = os.path.join(root, self.subdir(name))
+    if create and folder not in self._created:
+      if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+      self._created.add(folder)
+    return os.path.join(folder, name + ext)
+
+  def to_dict(self):
+    return {'kind': self.kind, 'fan_out': self.fan_out, 'width': self.width}
+
+  def save(self, root):
+    """Creates the dataset folder root and stores the layout in its layout.json (a flat folder needs none).
+    Raises a ValueError if the folder already has another layout or is a flat folder holding files, its files couldn't
+    be found anymore."""
+    if not os.path.exists(root):
+      os.makedirs(root, exist_ok=True)
+    existing = Layout.load(root)
+    if existing.to_dict() == self.to_dict():
+      return
+    if existing.levels or os.path.exists(os.path.join(root, LAYOUT_FILE)):
+      raise ValueError('{} has the layout {}, not {}.'.format(root, existing.to_dict(), self.to_dict()))
+    if not self.levels:
+      return
+    ## files of a flat folder are only listed without layout.json
+    files = _top_level_files(root)
+    if files:
+      raise ValueError('{} holds files of a flat layout ({}{}), it can not get the layout {}.'.format(
+        root, ', '.join(files[:3]), ', ...' if len(files) > 3 else '', self.to_dict()))
+    ## written at once, other workers writing the same folder read a complete file
+    tmp_path = '{}.{}.tmp'.format(os.path.join(root, LAYOUT_FILE), os.getpid())
+    with open(tmp_path, 'w') as f:
+      json.dump(self.to_dict(), f)
+    os.replace(tmp_path, os.path.join(root, LAYOUT_FILE))
+
+  @classmethod
+  def load(cls, root):
+    """Layout of a dataset folder, flat if it has no layout.json."""
+    try:
+      with open(os.path.join(root, LAYOUT_FILE)) as f:
+        return cls(**json.load(f))
+    except FileNotFoundError:
+      return cls()
+
+def _top_level_files(root):
+  ## sorted names of the files directly in root, without layout.json (and its temporary files) and hidden files
+  with os.scandir(root) as it:
+    return sorted(e.name for e in it if e.is_file() and not e.name.startswith((LAYOUT_FILE, '.')))
+
+def _entries(folder, depth):
+  with os.scandir(folder) as it:
+    entries = sorted(it, key=lambda e: e.name)
+  for entry in entries:
+    if depth:
+      if entry.is_dir():
+        yield from _entries(entry.path, depth - 1)
+    elif entry.is_file():
+      yield entry
+
+def entries(root):
+  """Yields the os.DirEntry of every file of a dataset folder, sorted by directory and name.
+  A flat folder is listed with a single os.scandir, subdirectories are only read in a folder with a layout."""
+  return _entries(root, Layout.load(root).levels)
+
+def scan(root, exts):
+  """Sorted paths of the files of a dataset folder with one of the extensions exts (lower case, with the dot).
+  In index order for flat and ranged layouts, by directory for a hashed one."""
+  exts = tuple(exts)
+  return [entry.path for entry in entries(root) if os.path.splitext(entry.name)[1].lower() in exts]
+
+def add_arguments(parser):
+  """Adds the layout arguments of an output folder to an argparse parser."""
+  parser.add_argument('--layout', action='store', choices=KINDS, default='flat',
+                      help='Directory layout of the output folder (see blender_addon/output_layout.py).')
+  parser.add_argument('--fan_out', action='store', type = int, default=FAN_OUT,
+                      help='Max entries per output subdirectory in a ranged or hashed layout.')
+
+def from_args(args):
+  """Layout of the parsed arguments (see add_arguments)."""
+  return Layout(args.layout, args.fan_out)
@@ -0,0 +1,161 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Schedule of a generation job and projections of its duration and size (the dry run of generate_samples).
+
+The per step object, rotation and camera elevation of the cropped modes are computed here and used by
+cyclic_arangement and packed_arangement, so the schedule of a dry run is exactly the one that is rendered.
+Objects are anything with 'rotation_range' and 'cam_pos_range' items (Blender objects or dicts). Needs no bpy."""
+
+import math
+from collections import Counter
+try:
+    from SampleGenerator import index_pass, pyramid
+except ImportError:
+    ## imported from outside the addon
+    import index_pass, pyramid
+
+MAX_CAM_STEPS = 20 ## the max amount of camera steps to go from the lowest to the highest position and start again. lowest and highest position are defined by cam_pos_range
+ROTATION_BIN = 30 ## degrees per bin of the coverage histograms
+ELEVATION_BIN = 10
+WORKER_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+LABEL_LINE_BYTES = 60 ## approximate size of a label line
+
+def rotation(obj, step, steps_per_obj):
+    ## rotation angle (degrees) of an object in a step, its rotation range is covered once over its steps
+    rotation_min = obj['rotation_range'][0]
+    rotation_range = obj['rotation_range'][1] - rotation_min
+    return rotation_min + (step % steps_per_obj) * (rotation_range / steps_per_obj)
+
+def cam_elevation(step, steps_per_obj, cam_pos_min, cam_pos_max):
+    ## camera elevation (degrees) of a step, cycles through the range in at most MAX_CAM_STEPS steps
+    cam_steps = min(steps_per_obj, MAX_CAM_STEPS)
+    return cam_pos_min + (step % cam_steps) * (cam_pos_max - cam_pos_min) / cam_steps
+
+def cyclic_step(objects, step, step_count):
+    """(object index, rotation, camera elevation) of a step in cropped mode: every object is visible in the same number of steps."""
+    steps_per_obj = step_count/len(objects)
+    i = int(step/steps_per_obj)
+    obj = objects[i]
+    return i, rotation(obj, step, steps_per_obj), cam_elevation(step, steps_per_obj, obj['cam_pos_range'][0], obj['cam_pos_range'][1])
+
+def packed_step(objects, pack_size, step, step_count):
+    """([(object index, rotation)], camera elevation) of a packed frame (see packed_arangement in generate_samples).
+
+    The camera elevation is shared, from the overlap of the objects' cam_pos_range (the first object's if they don't overlap)."""
+    steps_per_obj = step_count/len(objects)
+    first = int(step/steps_per_obj) * pack_size
+    pack = list(range(first, min(first + pack_size, len(objects))))
+    cam_pos_min = max(objects[i]['cam_pos_range'][0] for i in pack)
+    cam_pos_max = min(objects[i]['cam_pos_range'][1] for i in pack)
+    if cam_pos_min > cam_pos_max:
+        cam_pos_min, cam_pos_max = objects[pack[0]]['cam_pos_range']
+    return [(i, rotation(objects[i], step, steps_per_obj)) for i in pack], cam_elevation(step, steps_per_obj, cam_pos_min, cam_pos_max)
+
+def frame_count(n_objects, step_count, pack_size = 1):
+    """Number of rendered frames for step_count sprites (every pack of objects gets the frames a single object gets)."""
+    if pack_size <= 1:
+        return step_count
+    return int(-(-n_objects // pack_size) * step_count / n_objects)
+
+def schedule(objects, step_count, pack_size = 1):
+    """Yields (frame, object index, rotation, camera elevation) for every sprite of a cropped mode job."""
+    for frame in range(frame_count(len(objects), step_count, pack_size)):
+        if pack_size > 1:
+            pack, elevation = packed_step(objects, pack_size, frame, step_count)
+            for i, angle in pack:
+                yield frame, i, angle, elevation
+        else:
+            i, angle, elevation = cyclic_step(objects, frame, step_count)
+            yield frame, i, angle, elevation
+
+def coverage(entries, names):
+    """Sprites, rotation and elevation histograms (ROTATION_BIN/ELEVATION_BIN degree bins) per object of schedule() entries."""
+    result = {name: {'sprites': 0, 'rotation': Counter(), 'elevation': Counter(), 'elevations': set()} for name in names}
+    for _, i, angle, elevation in entries:
+        c = result[names[i]]
+        c['sprites'] += 1
+        c['rotation'][int(math.floor(angle / ROTATION_BIN)) * ROTATION_BIN] += 1
+        c['elevation'][int(math.floor(elevation / ELEVATION_BIN)) * ELEVATION_BIN] += 1
+        c['elevations'].add(round(elevation, 3))
+    for c in result.values():
+        c['rotation'] = dict(sorted(c['rotation'].items()))
+        c['elevation'] = dict(sorted(c['elevation'].items()))
+        c['elevations'] = len(c['elevations'])
+    return result
+
+def output_bytes(rgba, slot_width, trim = False, sizes = ()):
+    """Bytes of the png sprites written for a rendered frame, like save_packed and save_sizes of generate_samples write them.
+
+    Arguments:
+        rgba {np.ndarray} -- 8 bit RGBA pixels of the frame (a calibration frame of the dry run)
+        slot_width {int} -- width of a slot of a packed frame in pixels (the frame width if it isn't packed)
+
+    Keyword Arguments:
+        trim {bool} -- sprites are cropped to their alpha extent (default: {False})
+        sizes {list} -- further output sizes (long side in pixels) the sprites are downscaled to (default: {()})
+
+    Returns:
+        int -- bytes of the sprites of the frame at all output sizes (lighting variants not included)
+    """
+    height, width = rgba.shape[:2]
+    n_slots = max(1, width // slot_width)
+    levels = [rgba]
+    for size in sizes:
+        level_width, level_height = pyramid.level_size((slot_width, height), size)
+        levels.append(pyramid.downscale_rgba(rgba, level_width * n_slots, level_height))
+    total = 0
+    for level in levels:
+        level_slot = level.shape[1] // n_slots
+        for k in range(n_slots):
+            sprite = level[:, k * level_slot:(k + 1) * level_slot]
+            if trim:
+                sprite = index_pass.trim(sprite)[0]
+            total += len(index_pass.png_bytes(sprite))
+    return total
+
+def project(frames, seconds_per_frame, bytes_per_frame, sprites_per_frame = 1, chunk_size = None, worker_counts = WORKER_COUNTS):
+    """Projected wall time per number of workers (one machine each) and output size of a job.
+
+    Keyword Arguments:
+        chunk_size {int} -- frames leased at once from a work queue, the last round of chunks limits the speedup
+
+    Returns:
+        dict -- frames, sprites, bytes and per worker count the projected hours
+    """
+    rows = []
+    for workers in worker_counts:
+        if chunk_size:
+            chunks = -(-frames // chunk_size)
+            rounds = -(-chunks // workers)
+            per_worker = min(frames, rounds * chunk_size)
+        else:
+            per_worker = -(-frames // workers)
+        rows.append({'workers': workers, 'hours': per_worker * seconds_per_frame / 3600.})
+    sprites = int(frames * sprites_per_frame)
+    return {'frames': frames, 'sprites': sprites, 'seconds_per_frame': seconds_per_frame,
+            'bytes': int(frames * bytes_per_frame + sprites * LABEL_LINE_BYTES), 'workers': rows}
+
+def print_plan(plan):
+    projection = plan['projection']
+    print('{} frames, {} sprites, {:.2f}s per frame, {:.2f} GB output'.format(
+        projection['frames'], projection['sprites'], projection['seconds_per_frame'], projection['bytes'] / 1e9))
+    for row in projection['workers']:
+        print('  {:4d} workers: {:8.2f} h'.format(row['workers'], row['hours']))
+    for name, c in plan['coverage'].items():
+        print('{}: {} sprites, {} camera elevations'.format(name, c['sprites'], c['elevations']))
+        print('  rotation:  ' + '; '.join('{}: {}'.format(a, n) for a, n in c['rotation'].items()))
+        print('  elevation: ' + '; '.join('{}: {}'.format(a, n) for a, n in c['elevation'].items()))
+        if not c['sprites']:
+            print('  WARNING: {} is never rendered (fewer samples than objects).'.format(name))
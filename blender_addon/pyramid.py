@@ -0,0 +1,72 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Downscaled copies of a render for several output resolutions (render once at the largest size). Needs nothing but numpy.
+
+Pixels are resampled by area averaging (every output pixel is the mean of the input area it covers, no aliasing) of
+linear, premultiplied RGBA, so edges against transparency don't get dark fringes. The index pass (IndexOB) is resampled
+as categories: every output pixel gets the object (or the background) covering most of its area, and the boxes of a
+resolution are computed from its index pass like from a rendered one (see index_pass.pass_boxes)."""
+
+import numpy as np
+try:
+    from SampleGenerator import relight
+except ImportError:
+    ## imported from outside the addon
+    import relight
+
+def parse_sizes(text):
+    ## output sizes (long side in pixels) from a comma separated list, largest first
+    return sorted(set(int(size) for size in text.replace(' ', '').split(',') if size), reverse=True)
+
+def level_size(size, long_side):
+    ## (width, height) of an image of size (width, height) scaled to long_side (never enlarged)
+    width, height = size
+    scale = min(1., float(long_side) / max(width, height))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+def area_weights(n_in, n_out):
+    ## n_out x n_in matrix averaging the input pixels under every output pixel (weighted by the covered fraction)
+    edges = np.arange(n_out + 1) * (float(n_in) / n_out)
+    lo = np.minimum.outer(edges[1:], np.arange(1, n_in + 1)) ## min(output end, input end)
+    hi = np.maximum.outer(edges[:-1], np.arange(n_in))       ## max(output start, input start)
+    weights = np.maximum(lo - hi, 0)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+def resize_area(img, width, height):
+    ## area average resampling of a height x width (x channels) float image
+    rows = area_weights(img.shape[0], height)
+    cols = area_weights(img.shape[1], width)
+    return np.tensordot(cols, np.tensordot(rows, img, axes=(1, 0)), axes=(1, 1)).swapaxes(0, 1)
+
+def to_linear(rgba):
+    ## 8 bit sRGB straight alpha RGBA to linear premultiplied float (the inverse of relight.to_srgb8)
+    rgba = rgba.astype(np.float32) / 255
+    rgb = rgba[...,:3]
+    rgb = np.where(rgb <= .04045, rgb / 12.92, np.power((rgb + .055) / 1.055, 2.4))
+    return np.concatenate([rgb * rgba[...,3:], rgba[...,3:]], axis=-1)
+
+def downscale_rgba(rgba, width, height):
+    ## anti-aliased 8 bit RGBA image of width x height pixels
+    if rgba.shape[:2] == (height, width):
+        return rgba
+    return relight.to_srgb8(resize_area(to_linear(rgba), width, height))
+
+def downscale_index(class_img, width, height):
+    ## index pass of width x height pixels, every pixel gets the index covering most of its area
+    if class_img.shape[:2] == (height, width):
+        return class_img
+    indices = np.unique(class_img)
+    coverage = np.stack([resize_area((class_img == i).astype(np.float32), width, height) for i in indices])
+    return indices[np.argmax(coverage, axis=0)]
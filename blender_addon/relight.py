@@ -0,0 +1,53 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lighting variants of a render recombined from its light passes (render once, relight many). Needs nothing but numpy.
+
+Cycles' combined pass is the sum of direct light * color, indirect light * color (for diffuse, glossy and transmission),
+emission and environment. The direct light passes hold the direct light of every lamp and of the world, so the ones used
+here are rendered on a render layer lit by the sun alone (see setup_relight_passes in generate_samples.py). The sun
+strength scales its direct light linearly, so a variant with another strength is
+  combined + (strength / rendered strength - 1) * sun direct
+on the pixels of the objects (the shadow catcher keeps its shadow), times an exposure factor.
+The light of the world and the indirect light (bounces, of the sun as well) are kept as rendered."""
+
+import numpy as np
+
+# (light, color) pass pairs making up the direct light (light passes of the sun layer, color passes of the render)
+DIRECT_PASSES = (('DiffDir', 'DiffCol'), ('GlossDir', 'GlossCol'), ('TransDir', 'TransCol'))
+
+def direct_light(passes):
+    ## direct light of the sun in the combined pass from a dict of pass name -> height x width x channels float array
+    return sum(passes[light][...,:3] * passes[color][...,:3] for light, color in DIRECT_PASSES)
+
+def relight(combined, direct, object_mask, direct_scale, exposure = 1.):
+    ## returns the linear, premultiplied RGBA image lit by the sun with direct_scale times the rendered strength
+    rgba = combined.copy()
+    rgba[...,:3] += (direct_scale - 1) * direct * object_mask[...,None]
+    rgba[...,:3] = np.maximum(rgba[...,:3], 0) * exposure
+    return rgba
+
+def to_srgb8(rgba):
+    ## linear premultiplied float RGBA to straight alpha 8 bit sRGB (like Blender's png output with the Default/Standard view transform)
+    alpha = np.clip(rgba[...,3:], 0, 1)
+    rgb = np.where(alpha > 0, rgba[...,:3] / np.maximum(alpha, 1e-6), 0)
+    rgb = np.clip(rgb, 0, 1)
+    rgb = np.where(rgb <= .0031308, rgb * 12.92, 1.055 * np.power(rgb, 1 / 2.4) - .055)
+    return (np.concatenate([rgb, alpha], axis=-1) * 255 + .5).astype(np.uint8)
+
+def variants(combined, passes, object_mask, factors):
+    ## 8 bit sRGB RGBA images for every (direct_scale, exposure) in factors
+    ## direct light of the sun
+    direct = direct_light(passes)
+    return [to_srgb8(relight(combined, direct, object_mask, direct_scale, exposure)) for direct_scale, exposure in factors]
@@ -0,0 +1,164 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tunes the Cycles CPU tile size and thread count for the current machine and scene.
+
+A few calibration frames are rendered with every candidate setting and the fastest one is applied. Results are
+cached per machine and scene (hash of the .blend file, resolution and sample count) in a JSON file
+(~/.cache/sample_generator/render_tuning.json or the SG_TUNING_CACHE environment variable), so every
+further run on the same machine only looks them up. Sample counts are never changed, they define the image quality."""
+
+import os
+import json
+import time
+import hashlib
+import platform
+import bpy
+
+TILE_SIZES = (16, 32, 64, 128)
+CALIBRATION_FRAMES = 2
+
+def cache_path():
+    return os.environ.get('SG_TUNING_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'sample_generator', 'render_tuning.json')
+
+def machine_key():
+    ## cpu model and count identify the machine for render speed, not its name (farm nodes are usually identical)
+    return '{}|{}|{}'.format(platform.machine(), platform.processor() or platform.node(), os.cpu_count())
+
+def blend_hash(path):
+    h = hashlib.sha256()
+    if path and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+def scene_key(scene):
+    render = scene.render
+    return '{}|{}x{}@{}|{}'.format(blend_hash(bpy.data.filepath), render.resolution_x, render.resolution_y,
+                                   render.resolution_percentage, scene.cycles.samples)
+
+def candidate_settings(width, height):
+    ## (tile size, threads): square tiles up to one tile for the whole image, all logical cores or one per physical core
+    full_tile = max(width, height)
+    tiles = sorted(set([t for t in TILE_SIZES if t < full_tile] + [full_tile]))
+    cpus = os.cpu_count() or 1
+    threads = sorted(set([cpus, max(1, cpus // 2)]), reverse=True)
+    return [(tile, n) for tile in tiles for n in threads]
+
+def current_settings(scene):
+    ## the settings apply_settings changes, to restore them with restore_settings
+    render = scene.render
+    return render.tile_x, render.tile_y, render.threads_mode, render.threads
+
+def restore_settings(scene, settings):
+    render = scene.render
+    render.tile_x, render.tile_y, render.threads_mode, render.threads = settings
+
+def apply_settings(scene, tile, threads):
+    scene.render.tile_x = tile
+    scene.render.tile_y = tile
+    scene.render.threads_mode = 'FIXED'
+    scene.render.threads = threads
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _save_cache(path, cache):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+def time_frames(scene, prepare_frame, n_frames = CALIBRATION_FRAMES, sample_path = None):
+    """Renders n_frames (set up by prepare_frame(i)) without writing output files. Returns the seconds per frame.
+    A warm-up frame is rendered first and not timed (scene sync, BVH build and kernel loading of the first render).
+
+    Keyword Arguments:
+        sample_path {str} -- if set, the last frame is saved there with the scene's output format (to measure its size)
+    """
+    nodes = scene.node_tree.nodes if scene.node_tree else []
+    ## no output files for calibration frames
+    muted = [n for n in nodes if n.type == 'OUTPUT_FILE' and not n.mute]
+    for n in muted:
+        n.mute = True
+    duration = 0.
+    try:
+        prepare_frame(0)
+        bpy.ops.render.render(write_still=False)
+        for i in range(n_frames):
+            prepare_frame(i)
+            start = time.perf_counter()
+            bpy.ops.render.render(write_still=False)
+            duration += time.perf_counter() - start
+        if sample_path:
+            bpy.data.images['Render Result'].save_render(sample_path, scene=scene)
+    finally:
+        for n in muted:
+            n.mute = False
+    return duration / n_frames
+
+def calibrate(scene, prepare_frame, n_frames = CALIBRATION_FRAMES):
+    ## renders n_frames per candidate setting and returns [(seconds per frame, tile, threads)] fastest first
+    timings = []
+    for tile, threads in candidate_settings(scene.render.resolution_x, scene.render.resolution_y):
+        apply_settings(scene, tile, threads)
+        seconds = time_frames(scene, prepare_frame, n_frames)
+        timings.append((seconds, tile, threads))
+        print('tile {0}x{0}, {1} threads: {2:.3f}s per frame'.format(tile, threads, seconds))
+    return sorted(timings)
+
+def tune(scene, prepare_frame, n_frames = CALIBRATION_FRAMES):
+    """Applies the fastest tile size and thread count for this machine and scene (calibrated on the first run, cached after).
+
+    Arguments:
+        scene {bpy.types.Scene} -- scene to tune, rendered with Cycles on the CPU
+        prepare_frame {function} -- prepare_frame(i) sets up the scene for calibration frame i
+
+    Keyword Arguments:
+        n_frames {int} -- calibration frames rendered per candidate setting
+
+    Returns:
+        (tile, threads) -- the applied settings or None if the scene isn't rendered by Cycles on the CPU
+    """
+    if scene.render.engine != 'CYCLES' or scene.cycles.device != 'CPU':
+        print('Render tuning only applies to Cycles CPU rendering, skipped.')
+        return None
+    path = cache_path()
+    cache = _load_cache(path)
+    key = '{}|{}'.format(machine_key(), scene_key(scene))
+    if key not in cache:
+        original = current_settings(scene)
+        try:
+            timings = calibrate(scene, prepare_frame, n_frames)
+        except BaseException:
+            ## aborted (e.g. cancelled), the scene keeps the settings it had
+            restore_settings(scene, original)
+            raise
+        seconds, tile, threads = timings[0]
+        ## re-read, other workers on this machine may have written meanwhile
+        cache = _load_cache(path)
+        cache[key] = {'tile': tile, 'threads': threads, 'seconds_per_frame': seconds,
+                      'slowest_seconds_per_frame': timings[-1][0], 'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+        _save_cache(path, cache)
+    settings = cache[key]
+    apply_settings(scene, settings['tile'], settings['threads'])
+    print('Render settings: tile {0}x{0}, {1} threads ({2:.3f}s per frame).'.format(settings['tile'], settings['threads'], settings['seconds_per_frame']))
+    return settings['tile'], settings['threads']
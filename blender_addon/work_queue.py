@@ -0,0 +1,322 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Work queue on a shared folder, so any number of (headless) Blender workers on any number of machines
+can render one job together.
+
+The job's samples (frames) are split into chunks of consecutive steps. A worker leases a chunk, renders it
+and marks it done; leases are kept alive by a heartbeat after every frame and taken over by another worker
+once they expire (crashed or killed worker), workers without a chunk left to lease wait for that until the job
+is done. A queue is a folder:
+  job.json         -- n_samples, chunk_size and lease_timeout (seconds) of the job
+  leases/<chunk>   -- lease of a chunk in progress, holds the worker id; its mtime is the last heartbeat
+  done/<chunk>     -- marker of a finished chunk
+  labels/<chunk>   -- label store of a chunk (only if the job writes a label store, see label_store.py)
+  labels/<chunk>_<size> -- label store of a chunk for a further output size (see sized_path in generate_samples)
+  merged           -- marker created once the label stores of all chunks are merged into the job's store
+
+Only atomic file operations (exclusive create, rename, link) are used, so any shared file system works
+(and a local folder stands in for it). Lease ages are measured against the file server's clock, clocks of the
+workers don't have to be in sync. Frames are named by their step in the job, so names are unique across workers.
+
+Workers (same .blend, queue set in the addon panel or with the SG_QUEUE environment variable):
+  SG_QUEUE=/shared/queue blender -b scene.blend --python-expr "import bpy; bpy.ops.object.generate_samples()"
+Progress:
+  python work_queue.py --queue /shared/queue --status"""
+
+import os, glob
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+try:
+  from SampleGenerator import label_store
+except ImportError:
+  ## run as script
+  import label_store
+
+LEASE_TIMEOUT = 600.
+CHUNK_SIZE = 50
+POLL_INTERVAL = 10.
+
+def worker_id():
+  """Id of this worker, unique across machines and processes."""
+  return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+def _create_exclusive(path, content):
+  ## creates path with content if it doesn't exist yet. Returns False if it does.
+  ## (written to a temporary file first and linked, so other workers never see a partial file)
+  tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+  with open(tmp_path, 'w') as f:
+    f.write(content)
+  try:
+    os.link(tmp_path, path)
+    return True
+  except FileExistsError:
+    return False
+  finally:
+    os.remove(tmp_path)
+
+def _read(path):
+  try:
+    with open(path) as f:
+      return f.read()
+  except FileNotFoundError:
+    return None
+
+class Lease(object):
+  """A leased chunk: the steps start..end-1 of the job."""
+
+  def __init__(self, chunk, start, end, path):
+    self.chunk = chunk
+    self.start = start
+    self.end = end
+    self.path = path
+    self.lost = False
+
+class WorkQueue(object):
+  """A job on a shared folder (see the module docstring), created with create()."""
+
+  def __init__(self, path, worker = None):
+    self.path = path
+    with open(os.path.join(path, 'job.json')) as f:
+      job = json.load(f)
+    self.n_samples = job['n_samples']
+    self.chunk_size = job['chunk_size']
+    self.lease_timeout = job['lease_timeout']
+    self.n_chunks = (self.n_samples + self.chunk_size - 1) // self.chunk_size
+    self.worker = worker or worker_id()
+
+  @classmethod
+  def create(cls, path, n_samples, chunk_size = CHUNK_SIZE, lease_timeout = LEASE_TIMEOUT, worker = None):
+    """Creates the job at path, or opens it if it exists already (the first worker creates it, all others join)."""
+    for folder in ('leases', 'done', 'labels'):
+      os.makedirs(os.path.join(path, folder), exist_ok=True)
+    job = {'n_samples': n_samples, 'chunk_size': chunk_size, 'lease_timeout': lease_timeout}
+    _create_exclusive(os.path.join(path, 'job.json'), json.dumps(job))
+    queue = cls(path, worker)
+    if queue.n_samples != n_samples:
+      print('Joining existing job with {} samples at {} (instead of {}).'.format(queue.n_samples, path, n_samples))
+    return queue
+
+  def _chunk_name(self, chunk):
+    return str(chunk).zfill(6)
+
+  def _lease_path(self, chunk):
+    return os.path.join(self.path, 'leases', self._chunk_name(chunk))
+
+  def _done_path(self, chunk):
+    return os.path.join(self.path, 'done', self._chunk_name(chunk))
+
+  def label_store_path(self, chunk):
+    return os.path.join(self.path, 'labels', self._chunk_name(chunk))
+
+  def now(self):
+    """Current time of the file server (mtime of a freshly touched file), to compare with lease mtimes."""
+    clock = os.path.join(self.path, 'leases', '.clock.' + self.worker)
+    with open(clock, 'w'):
+      pass
+    now = os.stat(clock).st_mtime
+    os.remove(clock)
+    return now
+
+  def _done(self):
+    return set(int(name) for name in os.listdir(os.path.join(self.path, 'done')) if name.isdigit())
+
+  def _take_over(self, chunk, now):
+    ## moves an expired lease out of the way. Returns True if this worker did it.
+    lease_path = self._lease_path(chunk)
+    try:
+      if now - os.stat(lease_path).st_mtime <= self.lease_timeout:
+        return False
+    except FileNotFoundError:
+      return True
+    expired_path = '{}.expired.{}'.format(lease_path, self.worker)
+    try:
+      os.rename(lease_path, expired_path)
+    except FileNotFoundError:
+      return False
+    if now - os.stat(expired_path).st_mtime <= self.lease_timeout:
+      ## another worker took over and renewed the lease in the meantime: put it back
+      try:
+        os.link(expired_path, lease_path)
+      except FileExistsError:
+        pass
+      os.remove(expired_path)
+      return False
+    print('Lease of chunk {} ({}) expired, taking over.'.format(chunk, (_read(expired_path) or '').strip()))
+    os.remove(expired_path)
+    return True
+
+  def acquire(self):
+    """Leases the next unfinished chunk that isn't leased (or whose lease expired). Returns a Lease or None if there is none."""
+    done = self._done()
+    now = None
+    for chunk in range(self.n_chunks):
+      if chunk in done:
+        continue
+      lease_path = self._lease_path(chunk)
+      if os.path.exists(lease_path):
+        now = now or self.now()
+        if not self._take_over(chunk, now):
+          continue
+      if _create_exclusive(lease_path, self.worker):
+        if os.path.exists(self._done_path(chunk)):
+          ## finished between listing and leasing
+          os.remove(lease_path)
+          continue
+        start = chunk * self.chunk_size
+        return Lease(chunk, start, min(start + self.chunk_size, self.n_samples), lease_path)
+    return None
+
+  def heartbeat(self, lease):
+    """Renews the lease. Returns False (and marks the lease lost) if another worker has taken it over."""
+    if _read(lease.path) != self.worker:
+      lease.lost = True
+      return False
+    try:
+      os.utime(lease.path)
+    except FileNotFoundError:
+      ## taken over between reading and touching it
+      lease.lost = True
+      return False
+    return True
+
+  def complete(self, lease):
+    """Marks the leased chunk as done and releases the lease."""
+    if self.heartbeat(lease):
+      _create_exclusive(self._done_path(lease.chunk), self.worker)
+      os.remove(lease.path)
+
+  def is_done(self):
+    return len(self._done()) >= self.n_chunks
+
+  def steps(self, store_path = None):
+    """Yields (step, label store path) for the steps of every chunk this worker leases until the job is done.
+    While the remaining chunks are leased by other workers it waits for them, so it takes over the chunk of a worker
+    that crashed once its lease expires (and the job still gets merged).
+
+    Keyword Arguments:
+      store_path {str} -- label store of the job, if set every chunk gets its own store (see label_store_path)
+        that is merged into store_path by the worker finishing the job (see merge_labels)
+    """
+    while True:
+      lease = self.acquire()
+      if lease is None:
+        if self.is_done():
+          break
+        time.sleep(min(POLL_INTERVAL, self.lease_timeout / 4))
+        continue
+      print('Worker {} renders chunk {} (steps {} to {}).'.format(self.worker, lease.chunk, lease.start, lease.end - 1))
+      chunk_store = None
+      if store_path:
+        ## start over, a chunk taken over from a crashed worker may have a partial store
+        chunk_store = self.label_store_path(lease.chunk)
+        for path in [chunk_store] + glob.glob(chunk_store + '_*'):
+          shutil.rmtree(path, ignore_errors=True)
+      for step in range(lease.start, lease.end):
+        if not self.heartbeat(lease):
+          print('Lost the lease of chunk {}, skipping the rest of it.'.format(lease.chunk))
+          break
+        yield step, chunk_store
+      if not lease.lost:
+        self.complete(lease)
+    if store_path and self.is_done():
+      self.merge_labels(store_path)
+
+  def merge_labels(self, store_path):
+    """Merges the label stores of all chunks (in step order) into a new store at store_path, once per job. Returns False
+    if it was done already.
+
+    Every merged store is built under a temporary name and renamed into place, the merged marker is created after all
+    of them. A merge that failed or was interrupted is therefore done again by the next call, stores renamed into place
+    by it are kept (they are complete)."""
+    marker = os.path.join(self.path, 'merged')
+    if os.path.exists(marker):
+      return False
+    store_path = store_path.rstrip('/')
+    chunk_stores = [self.label_store_path(chunk) for chunk in range(self.n_chunks)]
+    ## stores of further output sizes go to <store_path>_<size>
+    suffixes = set('_' + name.split('_', 1)[1] for name in os.listdir(os.path.join(self.path, 'labels')) if '_' in name)
+    for suffix in [''] + sorted(suffixes):
+      target = store_path + suffix
+      if label_store.is_label_store(target):
+        continue
+      tmp_path = '{}.merging.{}'.format(target, self.worker)
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      try:
+        label_store.merge([p + suffix for p in chunk_stores if label_store.is_label_store(p + suffix)], tmp_path)
+      except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+      try:
+        os.rename(tmp_path, target)
+      except OSError:
+        ## merged by another worker meanwhile
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    if not _create_exclusive(marker, self.worker):
+      return False
+    print('Labels of {} chunks merged into {}.'.format(self.n_chunks, store_path))
+    return True
+
+  def status(self):
+    """Returns the number of chunks that are done, leased (active and expired) and pending."""
+    done = self._done()
+    now = self.now()
+    active = expired = 0
+    for lease_path in glob.glob(os.path.join(self.path, 'leases', '[0-9]*')):
+      if not os.path.basename(lease_path).isdigit():
+        continue
+      try:
+        age = now - os.stat(lease_path).st_mtime
+      except FileNotFoundError:
+        continue
+      if age > self.lease_timeout:
+        expired += 1
+      else:
+        active += 1
+    return {'done': len(done), 'active': active, 'expired': expired,
+            'pending': self.n_chunks - len(done) - active - expired, 'chunks': self.n_chunks}
+
+def main():
+  parser = argparse.ArgumentParser(description='Create and inspect the work queue of a multi-worker generation job.')
+  parser.add_argument('--queue', '--q', action='store', required=True,
+                      help='Path to the queue folder (on storage shared by all workers).')
+  parser.add_argument('--create', action='store', type = int, default=None,
+                      help='Create a job with this number of samples.')
+  parser.add_argument('--chunk_size', action='store', type = int, default=CHUNK_SIZE,
+                      help='Number of consecutive samples leased at once.')
+  parser.add_argument('--lease_timeout', action='store', type = float, default=LEASE_TIMEOUT,
+                      help='Seconds without heartbeat (one per rendered frame) after which a lease is taken over.')
+  parser.add_argument('--status', action='store_true', default=False,
+                      help='Print the progress of the job.')
+  parser.add_argument('--merge_labels', action='store', default=None,
+                      help='Merge the label stores of all chunks into this store (done by the last worker otherwise).')
+  args = parser.parse_args()
+  if args.create:
+    queue = WorkQueue.create(args.queue, args.create, args.chunk_size, args.lease_timeout)
+  else:
+    queue = WorkQueue(args.queue)
+  if args.status:
+    print(queue.status())
+  if args.merge_labels:
+    if not queue.is_done():
+      print('Job not finished yet.')
+    elif not queue.merge_labels(args.merge_labels):
+      print('Labels were merged already.')
+
+if __name__ == "__main__":
+  main()
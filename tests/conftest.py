@@ -0,0 +1,25 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the modules that need neither Blender nor TensorFlow (those needing TensorFlow are skipped without it).
+
+Run from the repository root:
+  python -m pytest tests"""
+
+import os, sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'util'))
+sys.path.append(os.path.join(ROOT, 'blender_addon'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
@@ -0,0 +1,37 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from asset_cache import frame_key
+
+def test_frame_key_depends_on_its_background_only(tmp_path):
+  paths = []
+  for name in ('a', 'b'):
+    path = str(tmp_path / (name + '.jpg'))
+    with open(path, 'wb') as f:
+      f.write(b'image')
+    paths.append(path)
+  visible = [('object', 90.)]
+  key_a, key_b = [frame_key('scene', visible, 30., path) for path in paths]
+  assert key_a != key_b
+  assert frame_key('scene', visible, 30., paths[0]) == key_a
+  ## a changed background changes the keys of its frames, the other frames keep theirs
+  with open(paths[0], 'wb') as f:
+    f.write(b'another image')
+  assert frame_key('scene', visible, 30., paths[0]) != key_a
+  assert frame_key('scene', visible, 30., paths[1]) == key_b
+  os.remove(paths[1])
+  assert frame_key('scene', visible, 30., paths[1]) != key_b
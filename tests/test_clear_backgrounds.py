@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import numpy as np
+from PIL import Image
+
+import synthetic
+from clear_backgrounds import IGNORED_CLASSES, label_boxes, push_pull_fill, clear_image, clear_file
+
+LABELS = '\n'.join([
+  '0 0.5 0.5 0.25 0.3',
+  '1 0.3 0.3 0.2 0.2',
+  '2 0.123 0.871 0.3337 0.41',
+  '3 0.98 0.02 0.1 0.1',
+  'not a label',
+  '',
+])
+
+def gimp_selection(label_path, width, height):
+  ## selection of the gimp script: rectangles at the truncated corner, gimp-image-select-rectangle truncates the size
+  mask = np.zeros((height, width), dtype=bool)
+  with open(label_path) as f_labels:
+    labels = f_labels.read().split('\n')
+  for label in labels:
+    params = label.split(' ')
+    if len(params) != 5:
+      continue;
+    c, x, y, w, h = list(map(float, params))
+    if int(c) in IGNORED_CLASSES:
+      continue;
+    x *= width
+    y *= height
+    w *= width
+    h *= height
+    x0, y0 = int(x-w/2), int(y-h/2)
+    mask[max(y0, 0):max(y0 + int(h), 0), max(x0, 0):max(x0 + int(w), 0)] = True
+  return mask
+
+def write_image(folder, name, labels, size = (97, 61)):
+  path = str(folder / (name + '.jpg'))
+  synthetic.background(size, np.random.default_rng(0)).save(path, quality=95)
+  with open(path[:-4] + '.txt', 'w') as f:
+    f.write(labels)
+  return path
+
+def test_label_boxes_match_the_gimp_selection(tmp_path):
+  label_path = str(tmp_path / 'a.txt')
+  with open(label_path, 'w') as f:
+    f.write(LABELS)
+  for width, height in ((97, 61), (640, 480), (33, 200)):
+    boxes = label_boxes(label_path, width, height)
+    ## the ignored class and the malformed lines are skipped
+    assert len(boxes) == 3
+    mask = np.zeros((height, width), dtype=bool)
+    for x0, y0, x1, y1 in boxes:
+      mask[y0:y1, x0:x1] = True
+    assert np.array_equal(mask, gimp_selection(label_path, width, height))
+
+def test_label_boxes_ignored_classes(tmp_path):
+  label_path = str(tmp_path / 'a.txt')
+  with open(label_path, 'w') as f:
+    f.write(LABELS)
+  assert len(label_boxes(label_path, 100, 100, ignored_classes=[])) == 4
+  assert len(label_boxes(label_path, 100, 100, ignored_classes=[0, 1, 2, 3])) == 0
+
+def test_push_pull_fill_restores_a_constant_region():
+  img = np.empty((45, 70, 3))
+  img[:] = (12., 130., 250.)
+  mask = np.zeros((45, 70), dtype=bool)
+  mask[5:30, 20:61] = True
+  masked = np.where(mask[:,:,None], 0., img)
+  assert np.allclose(push_pull_fill(masked, mask), img)
+
+def test_clear_image_without_boxes_keeps_the_image():
+  img = np.asarray(synthetic.background((64, 48), np.random.default_rng(1)))
+  assert np.array_equal(clear_image(img, []), img)
+
+def test_clear_image_changes_only_the_boxes():
+  img = np.asarray(synthetic.background((64, 48), np.random.default_rng(1))).copy()
+  img[10:20, 30:40] = (255, 0, 255)
+  cleared = clear_image(img, [(30, 10, 40, 20)])
+  outside = np.ones(img.shape[:2], dtype=bool)
+  outside[10:20, 30:40] = False
+  assert np.array_equal(cleared[outside], img[outside])
+  assert not (cleared[10:20, 30:40] == (255, 0, 255)).all(axis=-1).any()
+
+def test_clear_file_in_place_replaces_the_file(tmp_path):
+  path = write_image(tmp_path, 'a', '0 0.5 0.5 0.3 0.3\n')
+  with open(path, 'rb') as f:
+    original = f.read()
+  ## a hardlinked copy keeps the original, the file is replaced and not written into
+  link = str(tmp_path / 'link.jpg')
+  os.link(path, link)
+  assert clear_file(path) == path
+  with open(link, 'rb') as f:
+    assert f.read() == original
+  with open(path, 'rb') as f:
+    assert f.read() != original
+  assert Image.open(path).size == (97, 61)
+  assert sorted(os.listdir(str(tmp_path))) == ['a.jpg', 'a.txt', 'link.jpg']
+
+def test_clear_file_to_output_path(tmp_path):
+  path = write_image(tmp_path, 'a', '0 0.5 0.5 0.3 0.3\n')
+  out = tmp_path / 'out'
+  out.mkdir()
+  assert clear_file(path, str(out)) == str(out / 'a.jpg')
+  assert os.listdir(str(out)) == ['a.jpg']
+  assert clear_file(str(tmp_path / 'missing.jpg')) is None
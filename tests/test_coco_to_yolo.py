@@ -0,0 +1,78 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import numpy as np
+
+import coco_to_yolo
+from coco_to_yolo import read_coco, group_annotations, write_label
+
+COCO = {
+  'info': {'description': 'nested {"images": []} and [brackets]', 'year': 2017},
+  'images': [{'id': 7, 'width': 200, 'height': 100, 'file_name': 'b.jpg', 'extra': [1, {'x': None}]},
+             {'id': 3, 'width': 100, 'height': 100, 'file_name': 'a.jpg'},
+             {'id': 9, 'width': 50, 'height': 50, 'file_name': 'empty.jpg'}],
+  'categories': [{'id': 1, 'name': 'cube'}],
+  'annotations': [{'image_id': 3, 'category_id': 1, 'bbox': [10, 20, 30, 40], 'segmentation': [[1, 2, 3]]},
+                  {'image_id': 7, 'category_id': 2, 'bbox': [0, 0, 100, 50]},
+                  {'image_id': 42, 'category_id': 1, 'bbox': [0, 0, 1, 1]},
+                  {'image_id': 3, 'category_id': 5, 'bbox': [0, 0, 100, 100]}],
+}
+
+def write_coco(tmp_path, coco = COCO):
+  path = str(tmp_path / 'instances.json')
+  with open(path, 'w') as f:
+    json.dump(coco, f)
+  return path
+
+def test_read_coco(tmp_path):
+  images, file_names, anns, boxes = read_coco(write_coco(tmp_path))
+  assert images.tolist() == [[7, 200, 100], [3, 100, 100], [9, 50, 50]]
+  assert file_names == ['b.jpg', 'a.jpg', 'empty.jpg']
+  assert anns.tolist() == [[3, 1], [7, 2], [42, 1], [3, 5]]
+  assert boxes.tolist() == [[10, 20, 30, 40], [0, 0, 100, 50], [0, 0, 1, 1], [0, 0, 100, 100]]
+
+def test_read_coco_across_chunks(tmp_path, monkeypatch):
+  ## values split between reads of the file are parsed like in one piece
+  expected = read_coco(write_coco(tmp_path))
+  monkeypatch.setattr(coco_to_yolo, 'CHUNK_SIZE', 7)
+  result = read_coco(write_coco(tmp_path))
+  for a, b in zip(expected, result):
+    assert np.array_equal(a, b)
+
+def test_group_annotations(tmp_path):
+  images, _, anns, boxes = read_coco(write_coco(tmp_path))
+  anns, yolo, starts, ends, unmatched = group_annotations(images, anns, boxes)
+  ## annotations of image ids without an image are left out
+  assert unmatched.tolist() == [42]
+  ## b.jpg, a.jpg (in file order), empty.jpg
+  assert anns[starts[0]:ends[0]].tolist() == [[7, 2]]
+  assert anns[starts[1]:ends[1]].tolist() == [[3, 1], [3, 5]]
+  assert starts[2] == ends[2]
+  assert np.allclose(yolo[starts[0]], [.25, .25, .5, .5])
+  assert np.allclose(yolo[starts[1]:ends[1]], [[.25, .4, .3, .4], [.5, .5, 1, 1]])
+
+def test_group_annotations_without_images_or_annotations():
+  no_boxes = np.zeros((0, 4))
+  anns, yolo, starts, ends, unmatched = group_annotations(np.array([[1, 10, 10]]), np.zeros((0, 2), np.int64), no_boxes)
+  assert len(anns) == 0 and len(yolo) == 0 and starts.tolist() == ends.tolist() == [0]
+  anns, yolo, starts, ends, unmatched = group_annotations(np.zeros((0, 3), np.int64), np.array([[1, 1]]), np.ones((1, 4)))
+  assert len(anns) == 0 and unmatched.tolist() == [1]
+
+def test_write_label(tmp_path):
+  path = str(tmp_path / 'a.txt')
+  write_label(path, [1, 5], [[.25, .4, .3, .4], [.5, .5, 1., 1.]])
+  with open(path) as f:
+    assert f.read() == '1 0.25 0.4 0.3 0.4\n5 0.5 0.5 1.0 1.0\n'
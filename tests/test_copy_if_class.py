@@ -0,0 +1,136 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import pytest
+
+import copy_if_class
+from copy_if_class import build_class_index, load_class_index, select_images, place_file
+
+LABELS = {
+  'a': '1 0.5 0.5 0.1 0.1\n1 0.2 0.2 0.1 0.1\n2 0.7 0.7 0.1 0.1\n',
+  'b': '3 0.5 0.5 0.2 0.2\n',
+  'c': '',
+  'd': '2 0.5 0.5 0.3 0.3\n',
+}
+
+def make_folder(path):
+  ## a to d are labelled images (c without objects), e has no label file and f no image
+  os.makedirs(str(path))
+  for name, label in LABELS.items():
+    with open(str(path / (name + '.jpg')), 'wb') as f:
+      f.write(name.encode('utf-8'))
+    with open(str(path / (name + '.txt')), 'w') as f:
+      f.write(label)
+  with open(str(path / 'e.png'), 'wb') as f:
+    f.write(b'e')
+  with open(str(path / 'f.txt'), 'w') as f:
+    f.write('1 0.5 0.5 0.1 0.1\n')
+  return str(path)
+
+def run(monkeypatch, input_path, out_path, *args):
+  ## runs the script and returns the names of the placed images
+  monkeypatch.setattr(sys, 'argv', ['copy_if_class.py', '--i', input_path, '--o', out_path, '--w', '2'] + list(args))
+  copy_if_class.main()
+  return sorted(name for name in os.listdir(out_path) if name.endswith('.jpg'))
+
+def test_class_index(tmp_path):
+  index = build_class_index(make_folder(tmp_path / 'in'), workers=2)
+  assert index['images'] == ['a', 'b', 'c', 'd']
+  assert index['ext'] == ['.jpg'] * 4
+  assert index['classes'] == {'1': [[0, 2]], '2': [[0, 1], [3, 1]], '3': [[1, 1]]}
+
+def test_select_images_and_reverse(tmp_path):
+  index = build_class_index(make_folder(tmp_path / 'in'), workers=2)
+  assert select_images(index, [2]) == [0, 3]
+  assert select_images(index, [3, 1]) == [0, 1]
+  assert select_images(index, [7]) == []
+  ## reverse keeps the images without any of the classes, including the one with an empty label file
+  assert select_images(index, [1, 2], reverse=True) == [1, 2]
+  assert select_images(index, [1, 2, 3], reverse=True) == [2]
+
+def test_main_reverse(tmp_path, monkeypatch):
+  input_path = make_folder(tmp_path / 'in')
+  out_path = str(tmp_path / 'out')
+  assert run(monkeypatch, input_path, out_path, '--c', '1', '2', '--r') == ['b.jpg', 'c.jpg']
+  with open(os.path.join(out_path, 'c.txt')) as f:
+    assert f.read() == ''
+
+def test_main_n_first_in_sorted_order(tmp_path, monkeypatch):
+  input_path = make_folder(tmp_path / 'in')
+  assert run(monkeypatch, input_path, str(tmp_path / 'out'), '--c', '1', '2', '3', '--n', '2') == ['a.jpg', 'b.jpg']
+
+def test_main_n_random(tmp_path, monkeypatch):
+  input_path = make_folder(tmp_path / 'in')
+  chosen = [run(monkeypatch, input_path, str(tmp_path / 'out_{}'.format(i)), '--c', '1', '2', '3', '--n', '2', '--random', '--seed', '4')
+            for i in range(2)]
+  ## reproducible with a seed, n of the candidates
+  assert chosen[0] == chosen[1]
+  assert len(chosen[0]) == 2 and set(chosen[0]) <= {'a.jpg', 'b.jpg', 'd.jpg'}
+  seen = set()
+  for seed in range(20):
+    seen.update(run(monkeypatch, input_path, str(tmp_path / 'seed_{}'.format(seed)), '--c', '1', '2', '3', '--n', '1', '--random', '--seed', str(seed)))
+  assert seen == {'a.jpg', 'b.jpg', 'd.jpg'}
+  ## n larger than the number of candidates places all of them
+  assert run(monkeypatch, input_path, str(tmp_path / 'all'), '--c', '2', '--n', '10', '--random') == ['a.jpg', 'd.jpg']
+
+def test_stale_index_is_rebuilt(tmp_path):
+  input_path = make_folder(tmp_path / 'in')
+  index_path = str(tmp_path / 'index.json')
+  index = load_class_index(input_path, index_path, workers=2)
+  assert os.path.isfile(index_path)
+  ## an unchanged folder uses the stored index
+  with open(index_path) as f:
+    stored = json.load(f)
+  stored['classes']['9'] = [[2, 1]]
+  with open(index_path, 'w') as f:
+    json.dump(stored, f)
+  assert load_class_index(input_path, index_path, workers=2)['classes']['9'] == [[2, 1]]
+  ## a changed label file rebuilds it
+  with open(os.path.join(input_path, 'c.txt'), 'w') as f:
+    f.write('3 0.5 0.5 0.2 0.2\n')
+  index = load_class_index(input_path, index_path, workers=2)
+  assert '9' not in index['classes']
+  assert index['classes']['3'] == [[1, 1], [2, 1]]
+  with open(index_path) as f:
+    assert json.load(f)['classes'] == index['classes']
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'symlink'])
+def test_place_file_modes(tmp_path, mode):
+  input_path = make_folder(tmp_path / 'in')
+  out_path = str(tmp_path / 'out')
+  os.makedirs(out_path)
+  src = os.path.join(input_path, 'a.jpg')
+  dst = os.path.join(out_path, 'a.jpg')
+  ## an existing file is replaced
+  with open(dst, 'w') as f:
+    f.write('old')
+  place_file(src, out_path, mode)
+  with open(dst, 'rb') as f:
+    assert f.read() == b'a'
+  assert os.path.islink(dst) == (mode == 'symlink')
+  assert os.path.samefile(src, dst) == (mode != 'copy')
+  if mode == 'symlink':
+    assert os.readlink(dst) == os.path.abspath(src)
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'symlink'])
+def test_main_modes(tmp_path, monkeypatch, mode):
+  input_path = make_folder(tmp_path / 'in')
+  out_path = str(tmp_path / 'out')
+  assert run(monkeypatch, input_path, out_path, '--c', '3', '--m', mode) == ['b.jpg']
+  for name in ('b.jpg', 'b.txt'):
+    assert os.path.samefile(os.path.join(input_path, name), os.path.join(out_path, name)) == (mode != 'copy')
@@ -0,0 +1,86 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import numpy as np
+
+from frame_ring import Publisher, Consumer
+
+def sprites(n):
+  return [('{:04d}'.format(i), np.full((2 + i, 3, 4), i, np.uint8), [(i, .5, .5, .1, .2)]) for i in range(n)]
+
+def publish(address, ring_path, items, n_slots, published):
+  publisher = Publisher(address, 64 * 4, n_slots=n_slots, path=ring_path)
+  for name, pixels, labels in items:
+    publisher.publish(name, pixels, labels)
+    published.append(name)
+  publisher.close()
+
+def start_publisher(tmp_path, items, n_slots):
+  address = str(tmp_path / 'frames.sock')
+  ring_path = str(tmp_path / 'ring')
+  published = []
+  thread = threading.Thread(target=publish, args=(address, ring_path, items, n_slots, published))
+  thread.start()
+  return thread, address, ring_path, published
+
+def test_frames_arrive_in_order(tmp_path):
+  items = sprites(6)
+  thread, address, ring_path, _ = start_publisher(tmp_path, items, 2)
+  received = [(frame.name, frame.pixels.copy(), frame.labels) for frame in Consumer(address, timeout=10)]
+  thread.join(10)
+  assert [name for name, _, _ in received] == [name for name, _, _ in items]
+  for (_, pixels, labels), (_, expected, expected_labels) in zip(received, items):
+    assert np.array_equal(pixels, expected)
+    assert labels == [tuple(l) for l in expected_labels]
+  ## the publisher removes the ring after the consumer released every slot
+  assert not thread.is_alive() and not os.path.exists(ring_path)
+
+def test_slots_are_reused_after_release(tmp_path):
+  thread, address, _, published = start_publisher(tmp_path, sprites(4), 2)
+  consumer = Consumer(address, timeout=10)
+  first = consumer.receive()
+  second = consumer.receive()
+  assert first.slot != second.slot
+  ## all slots are in use: the publisher waits until one is released
+  thread.join(.3)
+  assert published == ['0000', '0001']
+  consumer.release(first)
+  third = consumer.receive()
+  assert third.name == '0002' and third.slot == first.slot and first.pixels is None
+  consumer.release(second)
+  consumer.release(third)
+  fourth = consumer.receive()
+  consumer.release(fourth)
+  assert consumer.receive() is None
+  thread.join(10)
+  assert published == ['0000', '0001', '0002', '0003']
+
+def test_sprite_larger_than_a_slot(tmp_path):
+  errors = []
+  def publish_large(address):
+    publisher = Publisher(address, 16, n_slots=1, path=str(tmp_path / 'ring'))
+    try:
+      publisher.publish('large', np.zeros((4, 4, 4), np.uint8), [])
+    except ValueError as e:
+      errors.append(e)
+    publisher.close()
+  address = str(tmp_path / 'frames.sock')
+  thread = threading.Thread(target=publish_large, args=(address,))
+  thread.start()
+  assert list(Consumer(address, timeout=10)) == []
+  thread.join(10)
+  assert len(errors) == 1
@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import numpy as np
+import pytest
+
+import label_store
+import output_layout
+from label_store import LabelStore, LabelWriter, LabelWriters
+
+IMAGES = [('0000000000', [(1, .5, .5, .25, .125)]),
+          ('0000000001', []),
+          ('0000000002', [(0, .1, .2, .3, .4), (7, .9, .8, .1, .05)])]
+
+def write_store(path, images = IMAGES):
+  with LabelWriter(path) as writer:
+    for name, rows in images:
+      writer.add(name, rows)
+
+def contents(path):
+  store = LabelStore(path)
+  return [(store.names[i], store.rows(i)) for i in range(len(store))]
+
+def test_round_trip(tmp_path):
+  path = str(tmp_path / 'store')
+  write_store(path)
+  store = LabelStore(path)
+  assert len(store) == 3
+  assert contents(path) == IMAGES
+  assert store.labels(2).shape == (2, 5) and store.labels(1).shape == (0, 5)
+  assert store.index_of('0000000002') == 2
+  assert '0000000001' in store and 'missing' not in store
+  with pytest.raises(KeyError):
+    store.index_of('missing')
+  ## only the path is pickled
+  assert pickle.loads(pickle.dumps(store)).rows(0) == IMAGES[0][1]
+
+def test_append_to_existing_store(tmp_path):
+  path = str(tmp_path / 'store')
+  write_store(path, IMAGES[:2])
+  label_store.append_labels(path, *IMAGES[2])
+  assert contents(path) == IMAGES
+
+def test_writers_keep_stores_open(tmp_path):
+  a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+  with LabelWriters() as writers:
+    for name, rows in IMAGES:
+      writers.add(a, name, rows)
+      writers.add(b, name + '_1', rows)
+    ## every image is complete on disk right after it was added
+    assert contents(a) == IMAGES
+  assert contents(b) == [(name + '_1', rows) for name, rows in IMAGES]
+
+def test_interrupted_append_is_dropped(tmp_path):
+  path = str(tmp_path / 'store')
+  write_store(path)
+  sizes = {name: os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)}
+  ## an append that was interrupted before its offset was written completely
+  with open(os.path.join(path, 'names.txt'), 'a') as f:
+    f.write('0000000003\n00000')
+  with open(os.path.join(path, 'cx.f64'), 'ab') as f:
+    f.write(np.zeros(3).tobytes())
+  with open(os.path.join(path, 'offsets.i64'), 'ab') as f:
+    f.write(b'\x05\x00\x00')
+  with LabelWriter(path):
+    pass
+  assert {name: os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)} == sizes
+  label_store.append_labels(path, '0000000003', [(2, .5, .5, .5, .5)])
+  assert contents(path) == IMAGES + [('0000000003', [(2, .5, .5, .5, .5)])]
+
+def test_intact_store_is_not_rewritten(tmp_path):
+  path = str(tmp_path / 'store')
+  write_store(path)
+  for name in os.listdir(path):
+    os.utime(os.path.join(path, name), ns=(0, 0))
+  with LabelWriter(path):
+    pass
+  assert all(os.stat(os.path.join(path, name)).st_mtime_ns == 0 for name in os.listdir(path))
+
+def test_damaged_store_raises(tmp_path):
+  path = str(tmp_path / 'store')
+  write_store(path)
+  with open(os.path.join(path, 'w.f64'), 'r+b') as f:
+    f.truncate(8)
+  with pytest.raises(ValueError):
+    LabelWriter(path)
+
+def test_merge(tmp_path):
+  a, b, out = str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path / 'out')
+  write_store(a, IMAGES[:1])
+  write_store(b, IMAGES[1:])
+  assert label_store.merge([a, b], out) == 3
+  assert contents(out) == IMAGES
+
+def test_txt_round_trip(tmp_path):
+  path, txt, back = str(tmp_path / 'store'), str(tmp_path / 'txt'), str(tmp_path / 'back')
+  write_store(path)
+  output_layout.Layout('ranged', fan_out=2).save(txt)
+  assert label_store.to_txt(path, txt) == 3
+  assert os.path.isfile(os.path.join(txt, output_layout.Layout.load(txt).relpath('0000000002', '.txt')))
+  assert label_store.from_txt(txt, back) == 3
+  assert contents(back) == IMAGES
+
+def test_parse_and_format_labels():
+  rows = [(3, .5, .25, .125, 1.)]
+  assert label_store.parse_labels(label_store.format_labels(rows)) == rows
+  assert label_store.parse_labels('1 0.5 0.5 0.5\n\n2.0 1 1 1 1\n') == [(2, 1., 1., 1., 1.)]
@@ -0,0 +1,112 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import collections
+import pytest
+
+import output_layout
+from output_layout import Layout, index_name
+
+def touch(root, layout, name, ext):
+  with open(layout.path(root, name, ext, create=True), 'w'):
+    pass
+
+def test_index_name():
+  assert index_name(42) == '0000000042'
+  assert index_name(42, width=4) == '0042'
+
+def test_flat():
+  layout = Layout()
+  assert layout.levels == 0
+  assert layout.relpath('0000000042_3', '.png') == '0000000042_3.png'
+
+def test_ranged_paths():
+  layout = Layout('ranged', fan_out=1000)
+  assert layout.levels == 3
+  assert layout.relpath(index_name(1234567), '.png') == os.path.join('000', '001', '234', '0001234567.png')
+  ## sprites of a frame share its directory
+  assert layout.subdir(index_name(1234567) + '_2_l1') == layout.subdir(index_name(1234567))
+  assert layout.subdir(index_name(1234999)) == layout.subdir(index_name(1234000))
+  with pytest.raises(ValueError):
+    layout.subdir('background')
+
+def test_levels_fit_the_index_width():
+  assert Layout('ranged', fan_out=10, width=3).levels == 2
+  assert Layout('ranged', fan_out=100, width=4).levels == 1
+  with pytest.raises(ValueError):
+    Layout('sorted')
+  with pytest.raises(ValueError):
+    Layout('ranged', fan_out=1)
+
+def test_hashed_directories_fill_up():
+  layout = Layout('hashed', fan_out=100, width=6)
+  counts = collections.Counter(layout.subdir(index_name(i, 6)) for i in range(100000))
+  ## like ranged: about fan_out files per leaf directory, not one directory per file
+  assert len(counts) == 1000
+  assert max(counts.values()) < 200
+  assert layout.subdir(index_name(5, 6) + '_1') == layout.subdir(index_name(5, 6))
+  ## names without an index still get a directory
+  assert len(layout.subdir('background').split(os.sep)) == layout.levels
+
+def test_save_and_load(tmp_path):
+  root = str(tmp_path / 'out')
+  layout = Layout('hashed', fan_out=50)
+  layout.save(root)
+  assert Layout.load(root).to_dict() == layout.to_dict()
+  ## saving the same layout again is fine, another one isn't
+  layout.save(root)
+  with pytest.raises(ValueError):
+    Layout('ranged', fan_out=50).save(root)
+  ## a flat folder has no layout.json
+  flat = str(tmp_path / 'flat')
+  Layout().save(flat)
+  assert os.listdir(flat) == [] and Layout.load(flat).levels == 0
+
+@pytest.mark.parametrize('kind', ['ranged', 'hashed'])
+def test_flat_folder_with_files_keeps_its_layout(tmp_path, kind):
+  root = str(tmp_path / 'flat')
+  os.makedirs(root)
+  touch(root, Layout(), index_name(1), '.png')
+  with pytest.raises(ValueError):
+    Layout(kind).save(root)
+  ## the files stay visible
+  assert not os.path.exists(os.path.join(root, output_layout.LAYOUT_FILE))
+  assert len(output_layout.scan(root, ('.png',))) == 1
+  ## a new layout for an empty folder (other files than data are fine)
+  empty = str(tmp_path / 'empty')
+  os.makedirs(empty)
+  touch(empty, Layout(), '.hidden', '')
+  Layout(kind).save(empty)
+  assert Layout.load(empty).kind == kind
+
+@pytest.mark.parametrize('kind', ['flat', 'ranged', 'hashed'])
+def test_scan(tmp_path, kind):
+  root = str(tmp_path / kind)
+  layout = Layout(kind, fan_out=10, width=4)
+  layout.save(root)
+  names = [index_name(i, 4) for i in range(0, 250, 7)]
+  for name in names:
+    touch(root, layout, name, '.png')
+    touch(root, layout, name, '.txt')
+  touch(root, layout, names[0] + '_l1', '.JPG')
+  found = output_layout.scan(root, ('.png', '.jpg'))
+  assert sorted(os.path.basename(p) for p in found) == sorted([n + '.png' for n in names] + [names[0] + '_l1.JPG'])
+  assert all(p == layout.path(root, os.path.basename(p)[:-4], os.path.splitext(p)[1]) for p in found)
+  if kind != 'hashed':
+    ## index order
+    assert [os.path.basename(p) for p in found if p.endswith('.png')] == [n + '.png' for n in names]
+  ## the files of the dataset only, not its layout.json
+  assert len(list(output_layout.entries(root))) == 2 * len(names) + 1
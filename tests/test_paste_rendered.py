@@ -0,0 +1,91 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import multiprocessing
+import numpy as np
+import pytest
+
+import synthetic
+import paste_rendered
+from paste_rendered import CompositeStream, WorkerTraceback, make_sample
+
+def make_inputs(folder, n_sprites = 3, n_backgrounds = 4):
+  ## object images with label files and backgrounds with label files from the benchmark inputs
+  rng = np.random.default_rng(0)
+  img_list, bg_list = [], []
+  for i in range(n_sprites):
+    path = str(folder / 'obj_{}.png'.format(i))
+    synthetic.sprite((24, 32), rng).save(path)
+    with open(path[:-4] + '.txt', 'w') as f:
+      f.write(' '.join(synthetic.sprite_label()))
+    img_list.append(path)
+  for i in range(n_backgrounds):
+    path = str(folder / 'bg_{}.png'.format(i))
+    synthetic.background((64, 48), rng).save(path)
+    with open(path[:-4] + '.txt', 'w') as f:
+      f.write(synthetic.label_text(2, rng))
+    bg_list.append(path)
+  return img_list, bg_list
+
+def assert_same_samples(a, b):
+  assert len(a) == len(b)
+  for (image_a, labels_a), (image_b, labels_b) in zip(a, b):
+    assert np.array_equal(image_a, image_b)
+    assert np.array_equal(labels_a, labels_b)
+
+def test_seeded_stream_does_not_depend_on_the_workers(tmp_path):
+  img_list, bg_list = make_inputs(tmp_path)
+  serial = list(CompositeStream(img_list, bg_list, n=6, seed=3, workers=0))
+  parallel = list(CompositeStream(img_list, bg_list, n=6, seed=3, workers=2))
+  assert_same_samples(serial, parallel)
+
+def test_samples_are_yielded_in_index_order(tmp_path):
+  img_list, bg_list = make_inputs(tmp_path)
+  expected = [make_sample(i, img_list, bg_list, 5) for i in range(2, 7)]
+  with CompositeStream(img_list, bg_list, n=5, seed=5, workers=2, prefetch=4, start=2) as stream:
+    assert_same_samples(list(stream), expected)
+
+def test_bounded_stream_stops_after_n_samples(tmp_path):
+  img_list, bg_list = make_inputs(tmp_path)
+  for workers in (0, 2):
+    samples = list(CompositeStream(img_list, bg_list, n=3, seed=1, workers=workers))
+    assert len(samples) == 3
+    image, labels = samples[0]
+    assert image.shape == (48, 64, 3)
+    assert labels.shape[1] == 5
+
+def test_worker_exception_is_raised_with_its_traceback(tmp_path):
+  img_list, bg_list = make_inputs(tmp_path)
+  os.remove(bg_list[1][:-4] + '.txt')
+  stream = CompositeStream(img_list, bg_list, n=4, seed=1, workers=2)
+  with pytest.raises(FileNotFoundError) as info:
+    list(stream)
+  assert isinstance(info.value.__cause__, WorkerTraceback)
+  assert 'make_sample' in str(info.value.__cause__)
+  assert stream._processes == []
+
+def test_killed_worker_raises_instead_of_hanging(tmp_path, monkeypatch):
+  if multiprocessing.get_start_method() != 'fork':
+    pytest.skip('the patched make_sample only reaches forked workers')
+  img_list, bg_list = make_inputs(tmp_path)
+  def killed(*args, **kwargs):
+    os._exit(1)
+  monkeypatch.setattr(paste_rendered, 'make_sample', killed)
+  monkeypatch.setattr(paste_rendered, 'RESULT_POLL', .1)
+  stream = CompositeStream(img_list, bg_list, n=4, seed=1, workers=2)
+  with pytest.raises(RuntimeError, match='died'):
+    list(stream)
+  assert stream._processes == []
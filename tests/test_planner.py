@@ -0,0 +1,53 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+import planner
+import index_pass
+
+OBJECTS = [{'rotation_range': (0, 360), 'cam_pos_range': (10, 50)} for _ in range(3)]
+
+def frame(slots, slot_width = 40, height = 30):
+  ## a packed frame with a small opaque square in every slot
+  rgba = np.zeros((height, slot_width * slots, 4), np.uint8)
+  for k in range(slots):
+    rgba[10:20, k * slot_width + 5:k * slot_width + 15] = (200, 100, 50, 255)
+  return rgba
+
+def test_schedule_covers_every_object():
+  entries = list(planner.schedule(OBJECTS, 30))
+  assert len(entries) == 30
+  assert [sum(1 for e in entries if e[1] == i) for i in range(3)] == [10, 10, 10]
+  packed = list(planner.schedule(OBJECTS, 30, pack_size=2))
+  assert planner.frame_count(3, 30, 2) == 20
+  assert sorted(set(e[0] for e in packed)) == list(range(20))
+
+def test_project():
+  projection = planner.project(100, 2., 1000, sprites_per_frame=2, chunk_size=30, worker_counts=(1, 4))
+  assert projection['sprites'] == 200
+  assert projection['bytes'] == 100 * 1000 + 200 * planner.LABEL_LINE_BYTES
+  ## 4 chunks: one round on 4 workers
+  assert [row['hours'] for row in projection['workers']] == [200 / 3600., 60 / 3600.]
+
+def test_output_bytes_of_the_written_sprites():
+  rgba = frame(2)
+  slots = [rgba[:, :40], rgba[:, 40:]]
+  assert planner.output_bytes(rgba, 40) == sum(len(index_pass.png_bytes(s)) for s in slots)
+  ## trimmed sprites
+  assert planner.output_bytes(rgba, 40, trim=True) == sum(len(index_pass.png_bytes(index_pass.trim(s)[0])) for s in slots)
+  ## further output sizes add their sprites
+  assert planner.output_bytes(rgba, 40, sizes=[20]) > planner.output_bytes(rgba, 40)
+  assert planner.output_bytes(frame(1), 40, sizes=[20, 10]) > planner.output_bytes(frame(1), 40, sizes=[20])
@@ -0,0 +1,70 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+import pyramid
+import relight
+
+def test_parse_sizes():
+  assert pyramid.parse_sizes('256, 1024,512,,256') == [1024, 512, 256]
+  assert pyramid.parse_sizes('') == []
+
+def test_level_size():
+  assert pyramid.level_size((400, 200), 100) == (100, 50)
+  assert pyramid.level_size((200, 400), 100) == (50, 100)
+  ## never enlarged, never empty
+  assert pyramid.level_size((40, 20), 100) == (40, 20)
+  assert pyramid.level_size((1000, 1), 10) == (10, 1)
+
+def test_area_weights():
+  weights = pyramid.area_weights(3, 2)
+  assert np.allclose(weights, [[2/3, 1/3, 0], [0, 1/3, 2/3]])
+  assert np.allclose(pyramid.area_weights(4, 4), np.eye(4))
+
+def test_resize_area_averages_blocks():
+  img = np.arange(16, dtype=np.float64).reshape(4, 4)
+  assert np.allclose(pyramid.resize_area(img, 2, 2), [[2.5, 4.5], [10.5, 12.5]])
+  ## the mean of the image is kept for any size
+  assert np.isclose(pyramid.resize_area(img, 3, 3).mean(), img.mean())
+
+def test_downscale_rgba_without_dark_fringes():
+  ## a white opaque half next to a black transparent one
+  rgba = np.zeros((2, 4, 4), np.uint8)
+  rgba[:, :2] = 255
+  small = pyramid.downscale_rgba(rgba, 2, 1)
+  assert small.shape == (1, 2, 4)
+  ## colour of the opaque part, the alpha averaged
+  assert small[0, 0].tolist() == [255, 255, 255, 255]
+  assert small[0, 1].tolist() == [0, 0, 0, 0]
+  half = pyramid.downscale_rgba(rgba, 1, 1)
+  assert half[0, 0, :3].tolist() == [255, 255, 255] and half[0, 0, 3] in (127, 128)
+
+def test_downscale_rgba_same_size_is_unchanged():
+  rgba = np.random.RandomState(0).randint(0, 256, (3, 5, 4)).astype(np.uint8)
+  assert pyramid.downscale_rgba(rgba, 5, 3) is rgba
+
+def test_to_linear_inverts_to_srgb8():
+  rgba = np.random.RandomState(1).randint(0, 256, (8, 8, 4)).astype(np.uint8)
+  rgba[..., 3] = 255
+  assert np.abs(relight.to_srgb8(pyramid.to_linear(rgba)).astype(int) - rgba).max() <= 1
+
+def test_downscale_index_takes_the_majority():
+  class_img = np.array([[0, 0, 1, 1],
+                        [0, 2, 1, 1],
+                        [2, 2, 0, 0],
+                        [2, 2, 0, 1]])
+  assert pyramid.downscale_index(class_img, 2, 2).tolist() == [[0, 1], [2, 0]]
+  assert pyramid.downscale_index(class_img, 4, 4) is class_img
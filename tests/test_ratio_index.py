@@ -0,0 +1,63 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import numpy as np
+
+from ratio_index import RatioIndex, signed_aspect
+
+def entry(name, w, h):
+  return {'img': name, 'width': w, 'height': h}
+
+def make_index():
+  ## the ratio keys of the info file don't matter, entries are sorted by their boxes
+  return RatioIndex({'0': {'1.0': [entry('square', .2, .2), entry('tall', .1, .4)],
+                           '-2.0': [entry('wide', .4, .2), entry('wider', .6, .1)]},
+                     '1': {'1.0': [entry('other', .3, .3)]},
+                     '2': {}})
+
+def test_signed_aspect_is_symmetric():
+  assert signed_aspect(1., 1.) == 0
+  assert np.isclose(signed_aspect(2., 1.), -signed_aspect(1., 2.))
+  assert signed_aspect(2., 1.) < 0 < signed_aspect(1., 2.)
+
+def test_classes_and_length():
+  index = make_index()
+  assert '0' in index and '1' in index
+  ## classes without entries are left out
+  assert '2' not in index
+  assert len(index) == 5
+
+def test_nearest_by_aspect():
+  index = make_index()
+  names = [index.entries['0'][i]['img'] for i in index.nearest('0', .5, .25, k=4)]
+  assert names == ['wide', 'square', 'wider', 'tall']
+  assert [index.entries['0'][i]['img'] for i in index.nearest('0', .1, .3, k=1)] == ['tall']
+
+def test_nearest_ignores_size_by_default():
+  index = RatioIndex({'0': {'1.0': [entry('small', .01, .01), entry('large', .5, .5)]}})
+  ## same aspect ratio: ties keep the order of the index (by size), whatever the size of the box
+  assert [index.entries['0'][i]['img'] for i in index.nearest('0', .5, .5, k=2)] == ['small', 'large']
+  assert [index.entries['0'][i]['img'] for i in index.nearest('0', .5, .5, k=1, size_weight=1)] == ['large']
+
+def test_nearest_k_larger_than_class():
+  index = make_index()
+  assert len(index.nearest('1', .1, .1, k=5)) == 1
+
+def test_sample_draws_among_nearest():
+  index = make_index()
+  rng = random.Random(0)
+  drawn = set(index.sample('0', .5, .25, k=2, rng=rng)['img'] for _ in range(50))
+  assert drawn == {'wide', 'square'}
@@ -0,0 +1,27 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+
+from run_benchmarks import addon_imports
+
+def test_addon_imports_follow_generate_samples():
+  modules = addon_imports()
+  ## the add-on modules imported from SampleGenerator are listed by name, bpy and the modules importing it are left out
+  for name in ('numpy', 'label_store', 'index_pass', 'work_queue', 'asset_cache', 'output_layout'):
+    assert name in modules
+  assert 'bpy' not in modules and 'render_tuning' not in modules
+  for name in modules:
+    importlib.import_module(name)
@@ -0,0 +1,78 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import numpy as np
+from PIL import Image
+
+from sprite_atlas import build_atlas, trim_sprite, SpriteAtlas
+
+def write_sprite(folder, name, pixels, label):
+  path = str(folder / (name + '.png'))
+  Image.fromarray(pixels).save(path)
+  with open(path[:-4] + '.txt', 'w') as f:
+    f.write(label)
+  return path
+
+def object_pixels(width = 20, height = 10, box = (5, 2, 9, 6)):
+  ## transparent image with an opaque rectangle at box (xmin, ymin, xmax, ymax)
+  pixels = np.zeros((height, width, 4), np.uint8)
+  xmin, ymin, xmax, ymax = box
+  pixels[ymin:ymax, xmin:xmax] = (10, 20, 30, 255)
+  return pixels
+
+def test_trim_sprite_crops_pixels_and_label(tmp_path):
+  path = write_sprite(tmp_path, 'a', object_pixels(), '3 0.35 0.4 0.2 0.4\n')
+  crop, label = trim_sprite(path, margin=1)
+  ## alpha extent plus one pixel on every side
+  assert crop.shape == (6, 6, 4)
+  assert (crop[1:-1, 1:-1, 3] == 255).all() and crop[0, :, 3].max() == 0
+  c, x, y, w, h = label
+  assert c == 3
+  ## the box (7, 4, 4, 4 pixels) relative to the crop starting at pixel (4, 1)
+  assert np.allclose(np.array([x, y, w, h]) * 6, (3, 3, 4, 4))
+
+def test_trim_sprite_skips_unusable_images(tmp_path):
+  empty = write_sprite(tmp_path, 'empty', np.zeros((4, 4, 4), np.uint8), '0 0.5 0.5 0.5 0.5\n')
+  several = write_sprite(tmp_path, 'several', object_pixels(), '0 0.5 0.5 0.5 0.5\n1 0.5 0.5 0.5 0.5\n')
+  assert trim_sprite(empty) == (None, None)
+  assert trim_sprite(several) == (None, None)
+
+def test_atlas_round_trip(tmp_path):
+  paths = [write_sprite(tmp_path, 'a', object_pixels(), '3 0.35 0.4 0.2 0.4\n'),
+           write_sprite(tmp_path, 'empty', np.zeros((4, 4, 4), np.uint8), '0 0.5 0.5 0.5 0.5\n'),
+           write_sprite(tmp_path, 'b', object_pixels(30, 30, (0, 0, 30, 12)), '1 0.5 0.2 1.0 0.4\n')]
+  atlas_path = str(tmp_path / 'sprites.atlas')
+  assert build_atlas(paths, atlas_path) == 2
+
+  atlas = SpriteAtlas(atlas_path)
+  assert len(atlas) == 2
+  assert atlas.names == ['a.png', 'b.png']
+  for i, path in ((0, paths[0]), (1, paths[2])):
+    crop, label = trim_sprite(path)
+    assert np.array_equal(atlas.pixels(i), crop)
+    img, atlas_label = atlas.sprite(atlas.index_of(atlas.names[i]))
+    assert img.size == (crop.shape[1], crop.shape[0])
+    assert np.array_equal(np.asarray(img), crop)
+    assert atlas_label[0] == int(label[0]) and np.allclose(atlas_label[1:], label[1:])
+
+  ## only the path is pickled, the copy maps the same file
+  copy = pickle.loads(pickle.dumps(atlas))
+  assert np.array_equal(copy.pixels(1), atlas.pixels(1))
+
+def test_empty_atlas(tmp_path):
+  atlas_path = str(tmp_path / 'sprites.atlas')
+  assert build_atlas([], atlas_path) == 0
+  assert len(SpriteAtlas(atlas_path)) == 0
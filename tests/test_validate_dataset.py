@@ -0,0 +1,129 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import numpy as np
+from PIL import Image
+
+import validate_dataset
+from validate_dataset import parse_label_text, check_boxes, check_batch, scan_batches, store_indices, Statistics
+import label_store
+
+def write_image(folder, name, size = (40, 20)):
+  Image.new('RGB', size).save(os.path.join(str(folder), name))
+
+def write_label(folder, name, text):
+  with open(os.path.join(str(folder), name), 'w') as f:
+    f.write(text)
+
+def kinds(result):
+  return sorted((kind, name) for kind, name, _ in result['issues'])
+
+def test_parse_label_text():
+  rows, malformed = parse_label_text('1 0.5 0.5 0.2 0.2\n\n1 0.5 0.5\n2 a 0.5 0.1 0.1\n3 0.1 0.2 0.1 0.1 \n')
+  assert rows.tolist() == [[1, .5, .5, .2, .2], [3, .1, .2, .1, .1]]
+  assert malformed == [3, 4]
+  rows, malformed = parse_label_text('')
+  assert rows.shape == (0, 5) and malformed == []
+
+def test_check_boxes():
+  rows = np.array([[0, .5, .5, .2, .2],
+                   [0, .95, .5, .2, .2],   ## right edge outside
+                   [0, .5, .5, 0, .2],     ## zero width
+                   [5, .5, .5, .2, .2],    ## unknown class
+                   [1, np.nan, .5, np.inf, .1],
+                   [np.nan, .5, .5, .2, .2]])
+  non_finite, out_of_range, zero_size, unknown_class = check_boxes(rows, classes=[0, 1])
+  assert non_finite.tolist() == [False, False, False, False, True, True]
+  assert out_of_range.tolist() == [False, True, False, False, False, False]
+  assert zero_size.tolist() == [False, False, True, False, False, False]
+  assert unknown_class.tolist() == [False, False, False, True, False, False]
+  ## within the tolerance
+  assert not check_boxes(np.array([[0, .5, .5, 1.001, .2]]), tolerance=1e-2)[1].any()
+  assert not check_boxes(np.array([[7, .5, .5, .2, .2]]))[3].any()
+
+def test_check_batch_issues(tmp_path):
+  write_image(tmp_path, 'good.png')
+  write_label(tmp_path, 'good.txt', '0 0.5 0.5 0.5 0.5\n1 0.25 0.25 0.1 0.2\n')
+  write_image(tmp_path, 'no_label.png')
+  write_label(tmp_path, 'no_image.txt', '0 0.5 0.5 0.5 0.5\n')
+  write_image(tmp_path, 'bad.jpg')
+  write_label(tmp_path, 'bad.txt', '0 0.5 0.5\n0 0.99 0.5 0.1 0.1\n0 0.5 0.5 0 0.1\n9 0.5 0.5 0.1 0.1\n1 nan 0.5 inf 0.1\n')
+  write_label(tmp_path, 'broken.png', 'not an image')
+  write_label(tmp_path, 'broken.txt', '')
+  batch = ['good.png', 'good.txt', 'no_label.png', 'no_image.txt', 'bad.jpg', 'bad.txt', 'broken.png', 'broken.txt']
+  result = check_batch(str(tmp_path), batch, classes=[0, 1])
+  assert kinds(result) == [('malformed_label', 'bad.txt'), ('missing_label', 'no_label.png'), ('non_finite', 'bad.jpg'),
+                           ('orphan_label', 'no_image.txt'), ('out_of_range', 'bad.jpg'), ('unknown_class', 'bad.jpg'),
+                           ('unreadable_image', 'broken.png'), ('zero_size', 'bad.jpg')]
+  assert result['images'] == 4
+  assert result['objects'] == 6
+  ## the non finite row isn't in the statistics
+  assert result['classes'] == {0: 3, 1: 1, 9: 1}
+  assert result['area'].sum() == 4
+  assert result['objects_per_image'][:5].tolist() == [1, 0, 1, 0, 1]
+
+def test_check_batch_with_a_label_store(tmp_path):
+  images, store_path = tmp_path / 'images', str(tmp_path / 'store')
+  os.makedirs(str(images))
+  for name in ('a', 'b', 'c'):
+    write_image(images, name + '.png')
+  write_label(images, 'x.txt', '')
+  with label_store.LabelWriter(store_path) as writer:
+    writer.add('a', [(0, .5, .5, .5, .5)])
+    writer.add('b', [(0, 1.5, .5, .5, .5)])
+    writer.add('orphan', [])
+  batch = ['a.png', 'b.png', 'c.png', 'x.txt']
+  store = label_store.LabelStore(store_path)
+  indices = store_indices(store, batch)
+  assert indices == [0, 1, -1, -1]
+  for given in (indices, None):
+    result = check_batch(str(images), batch, store_path, given)
+    ## label files are ignored with a store
+    assert kinds(result) == [('missing_label', 'c.png'), ('out_of_range', 'b.png')]
+    assert sorted(result['store_indices']) == [0, 1]
+
+def test_scan_batches(tmp_path):
+  os.makedirs(str(tmp_path / 'sub'))
+  for name in ('a.png', 'a.txt', 'b.JPG', 'notes.md', os.path.join('sub', 'c.png')):
+    write_label(tmp_path, name, '')
+  batches = list(scan_batches(str(tmp_path), 2))
+  assert [len(b) for b in batches] == [2, 1]
+  assert sorted(sum(batches, [])) == ['a.png', 'a.txt', 'b.JPG']
+  recursive = sum(scan_batches(str(tmp_path), 10, recursive=True), [])
+  assert os.path.join('sub', 'c.png') in recursive
+
+def test_main_reports_orphans_of_the_store(tmp_path, monkeypatch):
+  images, store_path, report = tmp_path / 'images', str(tmp_path / 'store'), str(tmp_path / 'report.json')
+  os.makedirs(str(images))
+  write_image(images, 'a.png')
+  with label_store.LabelWriter(store_path) as writer:
+    writer.add('a', [(0, .5, .5, .5, .5)])
+    writer.add('orphan', [])
+  monkeypatch.setattr(sys, 'argv', ['validate_dataset.py', '--i', str(images), '--label_store', store_path,
+                                    '--w', '1', '--report_path', report])
+  assert validate_dataset.main() == 1
+  with open(report) as f:
+    stats = json.load(f)
+  assert stats['images'] == 1 and stats['issues'] == {'orphan_label': 1}
+
+def test_statistics_sum_batches():
+  stats = Statistics()
+  result = check_batch('.', [])
+  stats.add(result)
+  stats.add(result)
+  assert stats.to_dict()['images'] == 0 and stats.issues == {}
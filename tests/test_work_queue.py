@@ -0,0 +1,151 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import pytest
+
+import work_queue
+import label_store
+from work_queue import WorkQueue
+
+def age(lease, seconds):
+  ## last heartbeat of a lease seconds ago
+  mtime = os.stat(lease.path).st_mtime - seconds
+  os.utime(lease.path, (mtime, mtime))
+
+def store_names(store_path):
+  return label_store.LabelStore(store_path).names
+
+def test_create_and_join(tmp_path):
+  path = str(tmp_path / 'queue')
+  queue = WorkQueue.create(path, 10, chunk_size=4, worker='a')
+  assert (queue.n_samples, queue.n_chunks) == (10, 3)
+  ## later workers join the existing job
+  joined = WorkQueue.create(path, 99, chunk_size=5, worker='b')
+  assert (joined.n_samples, joined.chunk_size) == (10, 4)
+
+def test_leases_are_exclusive(tmp_path):
+  path = str(tmp_path / 'queue')
+  a = WorkQueue.create(path, 10, chunk_size=4, worker='a')
+  b = WorkQueue(path, worker='b')
+  leases = [a.acquire(), b.acquire(), a.acquire()]
+  assert [(l.chunk, l.start, l.end) for l in leases] == [(0, 0, 4), (1, 4, 8), (2, 8, 10)]
+  assert b.acquire() is None
+  a.complete(leases[0])
+  assert a.status() == {'done': 1, 'active': 2, 'expired': 0, 'pending': 0, 'chunks': 3}
+  assert not a.is_done()
+
+def test_expired_lease_is_taken_over(tmp_path):
+  path = str(tmp_path / 'queue')
+  a = WorkQueue.create(path, 4, chunk_size=4, lease_timeout=60, worker='a')
+  b = WorkQueue(path, worker='b')
+  lease = a.acquire()
+  assert b.acquire() is None
+  age(lease, 120)
+  assert a.status()['expired'] == 1
+  taken = b.acquire()
+  assert taken.chunk == lease.chunk
+  ## the first worker finds out with its next heartbeat and doesn't mark the chunk done
+  assert not a.heartbeat(lease) and lease.lost
+  a.complete(lease)
+  assert not a.is_done()
+  b.complete(taken)
+  assert a.is_done()
+
+def test_heartbeat_of_a_vanished_lease(tmp_path, monkeypatch):
+  path = str(tmp_path / 'queue')
+  a = WorkQueue.create(path, 4, chunk_size=4, worker='a')
+  lease = a.acquire()
+  ## taken over right between reading and touching the lease
+  read = work_queue._read
+  def read_and_take_over(lease_path):
+    content = read(lease_path)
+    os.remove(lease_path)
+    return content
+  monkeypatch.setattr(work_queue, '_read', read_and_take_over)
+  assert not a.heartbeat(lease) and lease.lost
+
+def test_steps_cover_the_job(tmp_path):
+  path = str(tmp_path / 'queue')
+  a = WorkQueue.create(path, 5, chunk_size=2, worker='a')
+  assert [step for step, _ in a.steps()] == [0, 1, 2, 3, 4]
+  assert a.is_done()
+  assert list(WorkQueue(path, worker='b').steps()) == []
+
+def test_steps_wait_for_crashed_workers(tmp_path, monkeypatch):
+  monkeypatch.setattr(work_queue, 'POLL_INTERVAL', .05)
+  path = str(tmp_path / 'queue')
+  store_path = str(tmp_path / 'labels')
+  a = WorkQueue.create(path, 4, chunk_size=2, lease_timeout=.5, worker='a')
+  b = WorkQueue(path, worker='b')
+  ## a leases chunk 0, writes a label and crashes
+  crashed = a.steps(store_path)
+  step, chunk_store = next(crashed)
+  label_store.append_labels(chunk_store, 'crashed', [])
+
+  start = time.time()
+  steps = []
+  for step, chunk_store in b.steps(store_path):
+    label_store.append_labels(chunk_store, str(step), [(0, .5, .5, .1, .1)])
+    steps.append(step)
+  ## b waited for the lease of chunk 0 to expire and rendered it again
+  assert time.time() - start >= .4
+  assert sorted(steps) == [0, 1, 2, 3]
+  ## and merged the labels of all chunks in step order, without the partial store of the crashed worker
+  assert b.is_done()
+  assert store_names(store_path) == ['0', '1', '2', '3']
+
+def test_merge_labels_of_further_sizes(tmp_path):
+  path = str(tmp_path / 'queue')
+  store_path = str(tmp_path / 'labels')
+  a = WorkQueue.create(path, 4, chunk_size=2, worker='a')
+  for step, chunk_store in a.steps():
+    pass
+  for chunk in (1, 0):
+    for suffix in ('', '_64'):
+      label_store.append_labels(a.label_store_path(chunk) + suffix, str(chunk) + suffix, [])
+  assert a.merge_labels(store_path)
+  assert store_names(store_path) == ['0', '1']
+  assert store_names(store_path + '_64') == ['0_64', '1_64']
+  ## once per job
+  assert not WorkQueue(path, worker='b').merge_labels(store_path)
+
+def test_failed_merge_is_retried(tmp_path, monkeypatch):
+  path = str(tmp_path / 'queue')
+  store_path = str(tmp_path / 'labels')
+  a = WorkQueue.create(path, 4, chunk_size=2, worker='a')
+  for step, chunk_store in a.steps():
+    label_store.append_labels(a.label_store_path(step // 2), str(step), [(0, .5, .5, .1, .1)])
+    label_store.append_labels(a.label_store_path(step // 2) + '_64', str(step), [])
+
+  merge = label_store.merge
+  def fail_after_the_first_store(store_paths, out_path):
+    if out_path.startswith(store_path + '_64'):
+      merge(store_paths[:1], out_path)
+      raise OSError('disk full')
+    return merge(store_paths, out_path)
+  monkeypatch.setattr(label_store, 'merge', fail_after_the_first_store)
+  with pytest.raises(OSError):
+    a.merge_labels(store_path)
+  assert not os.path.exists(store_path + '_64')
+  monkeypatch.setattr(label_store, 'merge', merge)
+
+  ## the retry merges what is missing, without duplicates
+  assert WorkQueue(path, worker='b').merge_labels(store_path)
+  assert store_names(store_path) == ['0', '1', '2', '3']
+  assert store_names(store_path + '_64') == ['0', '1', '2', '3']
+  assert not a.merge_labels(store_path)
+  assert sorted(os.listdir(str(tmp_path))) == ['labels', 'labels_64', 'queue']
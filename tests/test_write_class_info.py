@@ -0,0 +1,114 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import json
+import sqlite3
+from PIL import Image
+
+import write_class_info
+from write_class_info import update_index, class_info, class_info_from_store, parse_label
+import label_store
+
+LABELS = {'0000': '1 0.5 0.5 0.4 0.2',
+          '0001': '0 0.5 0.5 0.2 0.4',
+          '0002': '1 0.5 0.5 0.3 0.3',
+          '0003': '',
+          '0004': '1 0.5 0.5 0.4 0.21'}
+
+def write_sample(folder, name, label):
+  Image.new('RGBA', (4, 4)).save(os.path.join(folder, name + '.png'))
+  with open(os.path.join(folder, name + '.txt'), 'w') as f:
+    f.write(label)
+
+def write_samples(folder, labels = LABELS):
+  os.makedirs(folder, exist_ok=True)
+  for name, label in labels.items():
+    write_sample(folder, name, label)
+
+def baseline_info(input_path):
+  ## the object info as the script built it before the index existed
+  info = {}
+  for img_name in sorted(glob.glob(input_path + "/*.png")):
+    with open(img_name[:-4] + '.txt') as f:
+      label = f.read()
+    if label:
+      obj_class, x_c, y_c, w, h = map(float, label.split(' '))
+      ratio = h/w if w >= h else -w/h
+      entry = {'img': img_name.split('/')[-1], 'center_x': x_c, 'center_y': y_c, 'width': w, 'height': h}
+      info.setdefault(int(obj_class), {}).setdefault(round(ratio, 1), []).append(entry)
+  return info
+
+def test_json_matches_the_baseline(tmp_path):
+  folder = str(tmp_path / 'rgba')
+  write_samples(folder)
+  db = sqlite3.connect(':memory:')
+  assert update_index(db, folder, workers=2) == (5, 0)
+  assert json.dumps(class_info(db)) == json.dumps(baseline_info(folder))
+
+def test_incremental_updates(tmp_path, monkeypatch):
+  folder = str(tmp_path / 'rgba')
+  write_samples(folder)
+  db = sqlite3.connect(str(tmp_path / 'index.sqlite'))
+  update_index(db, folder)
+  ## unchanged files aren't parsed again
+  assert update_index(db, folder) == (0, 0)
+
+  parsed = []
+  original = write_class_info.parse_label
+  def counting(path):
+    parsed.append(os.path.basename(path))
+    return original(path)
+  monkeypatch.setattr(write_class_info, 'parse_label', counting)
+  with open(os.path.join(folder, '0001.txt'), 'w') as f:
+    f.write('2 0.5 0.5 0.25 0.5')
+  os.remove(os.path.join(folder, '0002.png'))
+  write_sample(folder, '0005', '0 0.1 0.1 0.1 0.1')
+  assert update_index(db, folder) == (2, 1)
+  assert sorted(parsed) == ['0001.txt', '0005.txt']
+  assert json.dumps(class_info(db)) == json.dumps(baseline_info(folder))
+
+def test_zero_size_boxes(tmp_path):
+  folder = str(tmp_path / 'rgba')
+  write_samples(folder, {'0000': '1 0.5 0.5 0 0.2', '0001': '1 0.5 0.5 0 0', '0002': '1 0.5 0.5 0.2 0'})
+  db = sqlite3.connect(':memory:')
+  assert update_index(db, folder) == (3, 0)
+  from_txt = class_info(db)
+
+  store_path = str(tmp_path / 'store')
+  label_store.from_txt(folder, store_path)
+  from_store = class_info_from_store(label_store.LabelStore(store_path))
+  ## one ratio bin (0, the index stores -0 as 0) with the same entries
+  assert list(from_txt[1]) == [0] and list(from_store[1]) == [0]
+  assert from_txt[1][0] == from_store[1][0]
+
+def test_label_deleted_while_parsing(tmp_path, monkeypatch):
+  folder = str(tmp_path / 'rgba')
+  write_samples(folder)
+  assert parse_label(os.path.join(folder, 'missing.txt')) is None
+
+  original = write_class_info.scan_labels
+  def scan_then_delete(input_path):
+    found = original(input_path)
+    os.remove(os.path.join(input_path, '0000.txt'))
+    return found
+  monkeypatch.setattr(write_class_info, 'scan_labels', scan_then_delete)
+  db = sqlite3.connect(':memory:')
+  assert update_index(db, folder) == (5, 0)
+  monkeypatch.undo()
+  assert all(e['img'] != '0000.png' for ratios in class_info(db).values() for entries in ratios.values() for e in entries)
+  ## and it leaves the index with the next run
+  assert update_index(db, folder) == (0, 1)
@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import json
+import hashlib
+import pytest
+from PIL import Image
+
+from yolo_example import example_fields
+
+LABEL_MAP = {'cube': 1, 'ball': 2}
+
+@pytest.fixture
+def converter():
+  ## the converter needs TensorFlow and the object detection API
+  pytest.importorskip('tensorflow')
+  pytest.importorskip('object_detection')
+  pytest.importorskip('lxml')
+  import yolo_2_tf_record
+  return yolo_2_tf_record
+
+def jpeg_bytes(color, size = (16, 8)):
+  buffer = io.BytesIO()
+  Image.new('RGB', size, color).save(buffer, format='JPEG')
+  return buffer.getvalue()
+
+def write_example(folder, name, color, label):
+  path = os.path.join(str(folder), name + '.jpg')
+  with open(path, 'wb') as f:
+    f.write(jpeg_bytes(color))
+  with open(path[:-4] + '.txt', 'w') as f:
+    f.write(label)
+  return path
+
+def load_manifest(output):
+  with open(output + '.manifest.json') as f:
+    return json.load(f)
+
+def test_example_fields_hashes_the_image():
+  encoded = jpeg_bytes((255, 0, 0))
+  fields = example_fields('1 0.5 0.5 0.5 0.25\n', encoded, {1: 'cube'})
+  assert fields['key'] == hashlib.sha256(encoded).hexdigest()
+  assert (fields['format'], fields['width'], fields['height']) == ('JPEG', 16, 8)
+  assert fields['xmin'] == [.25] and fields['ymax'] == [.625]
+  assert fields['classes'] == [1]
+
+def test_manifest_digests_match_the_images(converter, tmp_path):
+  examples = [write_example(tmp_path, 'a', (255, 0, 0), '1 0.5 0.5 0.5 0.5\n'),
+              write_example(tmp_path, 'b', (0, 255, 0), '2 0.5 0.5 0.2 0.2\n')]
+  output = str(tmp_path / 'train.record')
+  shards, written = converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples)
+  assert written == 2 and len(shards) == 1
+  manifest = load_manifest(output)
+  for example in examples:
+    with open(example, 'rb') as f:
+      assert manifest['examples'][example]['sha256'] == hashlib.sha256(f.read()).hexdigest()
+
+def test_update_writes_only_changed_examples(converter, tmp_path):
+  examples = [write_example(tmp_path, name, (i * 60, 0, 0), '1 0.5 0.5 0.5 0.5\n') for i, name in enumerate('abcd')]
+  output = str(tmp_path / 'train.record')
+  first, written = converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples, num_shards=2)
+  assert written == 4 and len(first) == 2
+
+  ## nothing changed: nothing written, the shards are kept
+  shards, written = converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples, num_shards=2)
+  assert written == 0 and shards == first
+
+  ## a changed label rewrites the shard holding the example (as a new shard)
+  with open(examples[0][:-4] + '.txt', 'w') as f:
+    f.write('2 0.5 0.5 0.1 0.1\n')
+  manifest = load_manifest(output)
+  old_shard = [shard for shard, shard_examples in manifest['shards'].items() if examples[0] in shard_examples][0]
+  shards, written = converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples, num_shards=2)
+  assert written == len(manifest['shards'][old_shard])
+  assert old_shard not in shards and not os.path.exists(old_shard)
+  assert sorted(load_manifest(output)['examples']) == sorted(examples)
+
+  ## a deleted example leaves the manifest
+  os.remove(examples[3])
+  os.remove(examples[3][:-4] + '.txt')
+  converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples[:3], num_shards=2)
+  assert sorted(load_manifest(output)['examples']) == sorted(examples[:3])
+
+def test_manifest_lists_only_written_examples(converter, tmp_path, monkeypatch):
+  examples = [write_example(tmp_path, name, (i * 60, 0, 0), '1 0.5 0.5 0.5 0.5\n') for i, name in enumerate('abc')]
+  output = str(tmp_path / 'train.record')
+  ## the labels of b vanish between planning and writing its shard
+  read_label = converter.read_label
+  calls = []
+  def vanishing(example, image_dir, label_store=None):
+    calls.append(example)
+    if example == examples[1] and calls.count(example) > 1:
+      return None
+    return read_label(example, image_dir, label_store)
+  monkeypatch.setattr(converter, 'read_label', vanishing)
+  shards, written = converter.update_tf_record(output, LABEL_MAP, str(tmp_path), examples)
+  assert written == 2
+  manifest = load_manifest(output)
+  assert sorted(e for shard_examples in manifest['shards'].values() for e in shard_examples) == [examples[0], examples[2]]
+  ## the shard isn't dirty on the next run
+  monkeypatch.setattr(converter, 'read_label', read_label)
+  os.remove(examples[1])
+  assert converter.update_tf_record(output, LABEL_MAP, str(tmp_path), [examples[0], examples[2]]) == (shards, 0)
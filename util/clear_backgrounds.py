@@ -0,0 +1,268 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Clears objects from background images without gimp (headless replacement for util/gimp-clear-script.py).
+Reads Yolo style label files to gather the corresponding object bounding boxes and fills them by inpainting:
+a smooth push-pull fill of the surrounding colours plus the fine texture of a neighbouring region.
+
+With --reference_path the results are compared to images cleared with gimp (same file names) and the
+throughput and the mean absolute error / PSNR inside the cleared areas are reported."""
+
+import os
+import time
+import numpy as np
+from scipy import ndimage
+from PIL import Image
+import argparse
+import multiprocessing
+import profiling
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+import output_layout
+
+parser = argparse.ArgumentParser(description='Clear labelled objects from background images.')
+parser.add_argument('--input_path', '--i', action='store',
+                    default='../bg',
+                    help='Path to the background images with Yolo label files.')
+parser.add_argument('--output_path', '--o', action='store',
+                    default=None,
+                    help='Output path, required unless --in_place is set.')
+parser.add_argument('--in_place', dest='in_place', action='store_true', default=False,
+                    help='Overwrite the input images like the gimp script (each one replaced at once, hardlinked copies keep the original).')
+parser.add_argument('--ignored_classes', nargs='+', default=None, type = int,
+                    help='Classes that are not cleared (default: IGNORED_CLASSES).')
+parser.add_argument('--sampling_radius', action='store', type = int,
+                    default=50,
+                    help='Border in pixels around a box that is considered for filling (like the gimp heal-selection sampling radius).')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=multiprocessing.cpu_count(),
+                    help='Number of processes.')
+parser.add_argument('--reference_path', action='store',
+                    default=None,
+                    help='Folder with gimp cleared versions of the images to benchmark against.')
+profiling.add_arguments(parser)
+
+IGNORED_CLASSES = [1]
+
+def label_boxes(label_path, width, height, ignored_classes = IGNORED_CLASSES):
+  """Reads the pixel boxes (x0, y0, x1, y1) of all objects that are to be cleared from a Yolo label file."""
+  boxes = []
+  with open(label_path) as f_labels:
+    labels = f_labels.read().split('\n')
+  for label in labels:
+    params = label.split(' ')
+    if len(params) != 5:
+      continue;
+    c, x, y, w, h = list(map(float, params))
+    if int(c) in ignored_classes:
+      continue;
+    x *= width
+    y *= height
+    w *= width
+    h *= height
+    ## same rectangle as the gimp script: the corner truncated like there, the size truncated by gimp-image-select-rectangle
+    x0 = min(max(int(x-w/2), 0), width)
+    y0 = min(max(int(y-h/2), 0), height)
+    x1 = min(max(int(x-w/2) + int(w), 0), width)
+    y1 = min(max(int(y-h/2) + int(h), 0), height)
+    if x1 > x0 and y1 > y0:
+      boxes.append((x0, y0, x1, y1))
+  return boxes
+
+def _down(values, weights):
+  ## sums 2x2 blocks (pads odd sizes)
+  h, w = weights.shape
+  pad = ((0, h % 2), (0, w % 2))
+  values = np.pad(values, pad + ((0, 0),))
+  weights = np.pad(weights, pad)
+  values = values[0::2, 0::2] + values[1::2, 0::2] + values[0::2, 1::2] + values[1::2, 1::2]
+  weights = weights[0::2, 0::2] + weights[1::2, 0::2] + weights[0::2, 1::2] + weights[1::2, 1::2]
+  return values, weights
+
+def push_pull_fill(img, mask):
+  """Fills the masked pixels of img with a smooth interpolation of the unmasked pixels.
+  
+  Arguments:
+    img {numpy.array} -- float image (height x width x channels)
+    mask {numpy.array} -- boolean mask of the pixels to be filled
+  
+  Returns:
+    filled {numpy.array} -- image with filled mask area
+  """
+  weights = (~mask).astype(np.float64)
+  values = img * weights[:,:,None]
+  pyramid = [(values, weights)]
+  while min(weights.shape) > 1 and (weights == 0).any():
+    values, weights = _down(values, weights)
+    pyramid.append((values, weights))
+
+  ## pull: fill empty pixels of every level with the (upsampled) coarser level
+  filled = None
+  for values, weights in reversed(pyramid):
+    level = values / np.maximum(weights, 1e-12)[:,:,None]
+    if filled is not None:
+      h, w = weights.shape
+      zoom = (h / filled.shape[0], w / filled.shape[1], 1)
+      coarse = ndimage.zoom(filled, zoom, order=1, mode='nearest', grid_mode=True)[:h, :w]
+      ## blend coarse values in where the weights are low to avoid blocky fills
+      alpha = np.minimum(weights, 1)[:,:,None]
+      level = alpha * level + (1 - alpha) * coarse
+    filled = level
+  return np.where(mask[:,:,None], filled, img)
+
+def _donor(box, mask, width, height, radius):
+  ## top left corner of the neighbouring region (same size as the box) with the least masked pixels
+  x0, y0, x1, y1 = box
+  w = x1 - x0
+  h = y1 - y0
+  best = None
+  for dx, dy in ((-w, 0), (w, 0), (0, -h), (0, h), (-w, -h), (w, -h), (-w, h), (w, h)):
+    for scale in (1, .5):
+      nx = x0 + int(np.sign(dx) * min(abs(dx), radius + w) * scale) if dx else x0
+      ny = y0 + int(np.sign(dy) * min(abs(dy), radius + h) * scale) if dy else y0
+      if nx < 0 or ny < 0 or nx + w > width or ny + h > height:
+        continue;
+      overlap = mask[ny:ny+h, nx:nx+w].mean()
+      if best is None or overlap < best[0]:
+        best = (overlap, nx, ny)
+  return best
+
+def clear_image(img, boxes, sampling_radius = 50, texture_sigma = 2.):
+  """Removes the objects in boxes from an image.
+  
+  Arguments:
+    img {numpy.array} -- RGB image (uint8)
+    boxes {list} -- pixel boxes (x0, y0, x1, y1)
+  
+  Keyword Arguments:
+    sampling_radius {int} -- border around the boxes the fill is computed from (default: {50})
+    texture_sigma {float} -- gaussian sigma separating texture from colour (default: {2.})
+  
+  Returns:
+    img {numpy.array} -- cleared RGB image (uint8)
+  """
+  if not boxes:
+    return img
+  height, width = img.shape[:2]
+  img = img.astype(np.float64)
+  mask = np.zeros((height, width), dtype=bool)
+  for x0, y0, x1, y1 in boxes:
+    mask[y0:y1, x0:x1] = True
+
+  ## smooth fill, computed on the area around the boxes only
+  ys, xs = np.where(mask.any(axis=1))[0], np.where(mask.any(axis=0))[0]
+  r = sampling_radius
+  wy0, wy1 = max(ys[0] - r, 0), min(ys[-1] + r + 1, height)
+  wx0, wx1 = max(xs[0] - r, 0), min(xs[-1] + r + 1, width)
+  window_mask = mask[wy0:wy1, wx0:wx1]
+  if window_mask.all():
+    window_mask = mask
+    wy0, wy1, wx0, wx1 = 0, height, 0, width
+  result = img.copy()
+  result[wy0:wy1, wx0:wx1] = push_pull_fill(img[wy0:wy1, wx0:wx1], window_mask)
+
+  ## texture of a neighbouring region on top of the smooth fill
+  detail = img - ndimage.gaussian_filter(img, (texture_sigma, texture_sigma, 0))
+  for box in boxes:
+    donor = _donor(box, mask, width, height, sampling_radius)
+    if donor is None:
+      continue;
+    _, nx, ny = donor
+    x0, y0, x1, y1 = box
+    patch = detail[ny:ny+y1-y0, nx:nx+x1-x0] * (~mask[ny:ny+y1-y0, nx:nx+x1-x0])[:,:,None]
+    result[y0:y1, x0:x1] += patch * mask[y0:y1, x0:x1, None]
+  return np.clip(np.round(result), 0, 255).astype(np.uint8)
+
+def clear_file(img_path, output_path = None, ignored_classes = IGNORED_CLASSES, sampling_radius = 50):
+  """Clears one image file (using the label file next to it) and writes the result.
+  Returns the path of the written image or None if no label file was found."""
+  label_path = img_path[:-4]+'.txt'
+  if not os.path.exists(label_path):
+    print('{} not found'.format(label_path))
+    return None
+  img = Image.open(img_path)
+  boxes = label_boxes(label_path, img.size[0], img.size[1], ignored_classes)
+  cleared = clear_image(np.asarray(img.convert('RGB')), boxes, sampling_radius)
+  out_path = img_path if output_path is None else os.path.join(output_path, os.path.basename(img_path))
+  ## written next to the result and renamed, a crash never leaves a truncated image and other links to the file are kept
+  tmp_path = '{}.{}.tmp'.format(out_path, os.getpid())
+  Image.fromarray(cleared).save(tmp_path, format=Image.registered_extensions()[os.path.splitext(out_path)[1].lower()], quality=95)
+  os.replace(tmp_path, out_path)
+  return out_path
+
+def _clear(args):
+  return args[0], clear_file(*args)
+
+def compare(img_path, reference_path, label_path, ignored_classes = IGNORED_CLASSES):
+  """Mean absolute error and PSNR between two images inside the cleared boxes."""
+  a = np.asarray(Image.open(img_path).convert('RGB'), dtype=np.float64)
+  b = np.asarray(Image.open(reference_path).convert('RGB'), dtype=np.float64)
+  mask = np.zeros(a.shape[:2], dtype=bool)
+  for x0, y0, x1, y1 in label_boxes(label_path, a.shape[1], a.shape[0], ignored_classes):
+    mask[y0:y1, x0:x1] = True
+  if not mask.any():
+    return None
+  diff = (a - b)[mask]
+  mse = (diff**2).mean()
+  return np.abs(diff).mean(), 10*np.log10(255.**2 / max(mse, 1e-12))
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('clear_backgrounds', args)
+  if not args.output_path and not args.in_place:
+    parser.error('set --output_path or --in_place to overwrite the input images')
+  ignored_classes = IGNORED_CLASSES if args.ignored_classes is None else args.ignored_classes
+  layout = output_layout.Layout.load(args.input_path)
+  img_list = output_layout.scan(args.input_path, ('.jpg',))
+  out_dirs = [None] * len(img_list)
+  if args.output_path:
+    ## cleared images keep their place in the layout of the input folder
+    layout.save(args.output_path)
+    out_dirs = [os.path.dirname(layout.path(args.output_path, os.path.basename(img_path)[:-4], create=True)) for img_path in img_list]
+
+  tasks = [(img_path, out_dir, ignored_classes, args.sampling_radius) for img_path, out_dir in zip(img_list, out_dirs)]
+  start = time.time()
+  written = []
+  pool = multiprocessing.Pool(args.workers)
+  for n, (img_path, out_path) in enumerate(pool.imap_unordered(_clear, tasks, chunksize=4)):
+    if out_path:
+      written.append((img_path, out_path))
+      profiling.count()
+    if (n+1) % 100 == 0:
+      print(n+1, 'images cleared.')
+  pool.close()
+  pool.join()
+  duration = time.time() - start
+  print('{} images cleared in {:.1f}s ({:.2f} images/s with {} workers)'.format(
+    len(written), duration, len(written)/max(duration, 1e-9), args.workers))
+
+  if args.reference_path:
+    with profiling.stage('compare'):
+      scores = []
+      for img_path, out_path in written:
+        reference = os.path.join(args.reference_path, os.path.basename(img_path))
+        if os.path.exists(reference):
+          score = compare(out_path, reference, img_path[:-4]+'.txt', ignored_classes)
+          if score:
+            scores.append(score)
+      if scores:
+        scores = np.array(scores)
+        print('compared to {} gimp cleared images: mean absolute error {:.2f}, PSNR {:.2f} dB'.format(
+          len(scores), scores[:,0].mean(), scores[:,1].mean()))
+      else:
+        print('no gimp cleared reference images found in', args.reference_path)
+  profiling.finish()
+
+if __name__ == "__main__":
+  main()
@@ -12,14 +12,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Creates Yolo style label files for the coco data set. Requires pycocotools."""
+"""Creates Yolo style label files for the coco data set.
+
+The annotation file is streamed instead of loaded as a whole: images and annotations are collected in one pass into
+compact NumPy arrays, grouped by image id and converted vectorized. Label files are written by a thread pool."""
 
 import json
-from PIL import Image
-import os, glob
+import os
 import numpy as np
 import argparse
-from pycocotools.coco import COCO
+from concurrent.futures import ThreadPoolExecutor
+import profiling
 
 parser = argparse.ArgumentParser(description='Create yolo-style label files from COCO training data.')
 parser.add_argument('--input_file', '--i', action='store',
@@ -28,35 +31,196 @@ parser.add_argument('--input_file', '--i', action='store',
 parser.add_argument('--output_path', '--o', action='store',
                     default='../coco/train2017',
                     help='Path to output folder.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=8,
+                    help='Number of threads writing label files.')
+profiling.add_arguments(parser)
+
+CHUNK_SIZE = 1 << 20
+WRITE_BATCH = 10000
+
+class _Reader(object):
+  ## buffered reader decoding one json value at a time
+  def __init__(self, f):
+    self.f = f
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+    self.decoder = json.JSONDecoder()
+
+  def _fill(self):
+    chunk = self.f.read(CHUNK_SIZE)
+    self.buf = self.buf[self.pos:] + chunk
+    self.pos = 0
+    self.eof = not chunk
+
+  def peek(self):
+    ## next non whitespace character
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+        self.pos += 1
+      if self.pos < len(self.buf) or self.eof:
+        return self.buf[self.pos:self.pos+1]
+      self._fill()
+
+  def expect(self, chars):
+    c = self.peek()
+    if c not in chars:
+      raise ValueError('Unexpected {!r} in json file, expected one of {!r}.'.format(c, chars))
+    self.pos += 1
+    return c
 
-args = parser.parse_args()
-
-coco=COCO(args.input_file)
-imgIds = coco.getImgIds()
-
-counter = 1
-for imgId in imgIds:
-  img = coco.loadImgs(imgId)[0]
-  annIds = coco.getAnnIds(imgIds=imgId, iscrowd=None)
-  anns = coco.loadAnns(annIds)
-  f_out = open(args.output_path + '/' + img['file_name'].split('.')[0]+'.txt', mode='w')
-
-  for ann in anns:
-    # print(ann['bbox'])
-    # print(img['file_name'])
-    x = float(ann['bbox'][0])
-    y = float(ann['bbox'][1])
-    width = float(ann['bbox'][2])
-    height = float(ann['bbox'][3])
-    #yolo format ([x_centre, y_centre, width, heigth] relative to image size)
-    c_x = (x + width/2)/img['width']
-    c_y = (y + height/2)/img['height']
-    w = width/img['width']
-    h = height/img['height']
-    f_out.write("{} {} {} {} {}\n".format(ann['category_id'], c_x, c_y, w, h))
+  def value(self):
+    ## decodes the next complete json value (values ending at the buffer end might be cut off)
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+        if end < len(self.buf) or self.eof:
+          self.pos = end
+          return value
+      except ValueError:
+        if self.eof:
+          raise
+      self._fill()
+
+def iter_json_arrays(f, keys):
+  """Streams the items of the given top level arrays of a json object.
+  
+  Arguments:
+    f {file} -- json file opened in text mode
+    keys {list} -- keys of the arrays to be streamed, other values are skipped
   
-  if counter % 200 == 0:
-    print(counter, 'YOLO label files created.')
-  counter += 1
+  Yields:
+    (key, item) -- for every item of the streamed arrays in file order
+  """
+  reader = _Reader(f)
+  reader.expect('{')
+  if reader.peek() == '}':
+    return
+  while True:
+    key = reader.value()
+    reader.expect(':')
+    if key in keys and reader.peek() == '[':
+      reader.expect('[')
+      if reader.peek() == ']':
+        reader.expect(']')
+      else:
+        while True:
+          yield key, reader.value()
+          if reader.expect(',]') == ']':
+            break
+    else:
+      reader.value()
+    if reader.expect(',}') == '}':
+      break
+
+class _ArrayBuilder(object):
+  ## appends rows to fixed size numpy blocks
+  def __init__(self, dtype, width, block = 1 << 16):
+    self.dtype = dtype
+    self.width = width
+    self.block_size = block
+    self.blocks = []
+    self.current = np.empty((block, width), dtype)
+    self.n = 0
+
+  def append(self, row):
+    if self.n == self.block_size:
+      self.blocks.append(self.current)
+      self.current = np.empty((self.block_size, self.width), self.dtype)
+      self.n = 0
+    self.current[self.n] = row
+    self.n += 1
+
+  def array(self):
+    return np.concatenate(self.blocks + [self.current[:self.n]])
+
+def read_coco(input_file):
+  """Reads images and annotations of a COCO annotation file in a single streaming pass.
   
-  f_out.close()
+  Returns:
+    images {numpy.array} -- (id, width, height) per image (int64)
+    file_names {list} -- file name per image
+    anns {numpy.array} -- (image_id, category_id) per annotation (int64)
+    boxes {numpy.array} -- COCO bbox (x, y, width, height) per annotation (float64)
+  """
+  images = _ArrayBuilder(np.int64, 3)
+  file_names = []
+  anns = _ArrayBuilder(np.int64, 2)
+  boxes = _ArrayBuilder(np.float64, 4)
+  with open(input_file, 'r') as f:
+    for key, item in iter_json_arrays(f, ('images', 'annotations')):
+      if key == 'images':
+        images.append((item['id'], item['width'], item['height']))
+        file_names.append(item['file_name'])
+      else:
+        anns.append((item['image_id'], item['category_id']))
+        boxes.append(item['bbox'])
+  return images.array(), file_names, anns.array(), boxes.array()
+
+def yolo_boxes(boxes, img_width, img_height):
+  """Converts COCO boxes (x, y, width, height in pixels) to yolo format ([x_centre, y_centre, width, heigth] relative to image size)."""
+  return np.stack([(boxes[:,0] + boxes[:,2]/2)/img_width,
+                   (boxes[:,1] + boxes[:,3]/2)/img_height,
+                   boxes[:,2]/img_width,
+                   boxes[:,3]/img_height], axis=1)
+
+def group_annotations(images, anns, boxes):
+  """Groups the annotations by image and converts their boxes (see read_coco for the arrays).
+  Annotations of image ids that are not among the images are left out.
+
+  Returns:
+    anns {numpy.array} -- (image_id, category_id) per annotation, grouped by image in file order
+    yolo {numpy.array} -- yolo box per annotation (see yolo_boxes)
+    starts, ends {numpy.array} -- anns[starts[i]:ends[i]] are the annotations of images[i]
+    unmatched {numpy.array} -- image ids of the left out annotations
+  """
+  ## image of every annotation
+  img_pos = np.argsort(images[:,0], kind='stable')
+  sorted_ids = images[img_pos,0]
+  pos = np.minimum(np.searchsorted(sorted_ids, anns[:,0]), max(len(sorted_ids) - 1, 0))
+  matched = sorted_ids[pos] == anns[:,0] if len(sorted_ids) else np.zeros(len(anns), bool)
+  unmatched = anns[~matched,0]
+  anns, boxes, ann_img = anns[matched], boxes[matched], img_pos[pos[matched]]
+
+  ## group annotations by image (stable, so annotations keep their file order)
+  order = np.argsort(anns[:,0], kind='stable')
+  anns, boxes, ann_img = anns[order], boxes[order], ann_img[order]
+  starts = np.searchsorted(anns[:,0], images[:,0], side='left')
+  ends = np.searchsorted(anns[:,0], images[:,0], side='right')
+  yolo = yolo_boxes(boxes, images[ann_img,1], images[ann_img,2])
+  return anns, yolo, starts, ends, unmatched
+
+def write_label(path, classes, boxes):
+  with open(path, mode='w') as f_out:
+    f_out.write(''.join("{} {} {} {} {}\n".format(c, *box) for c, box in zip(classes, boxes)))
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('coco_to_yolo', args)
+
+  with profiling.stage('read'):
+    images, file_names, anns, boxes = read_coco(args.input_file)
+  print(len(file_names), 'images and', len(anns), 'annotations read.')
+
+  with profiling.stage('convert'):
+    anns, yolo, starts, ends, unmatched = group_annotations(images, anns, boxes)
+  if len(unmatched):
+    ids = np.unique(unmatched)
+    print('{} annotations of {} unknown image ids left out (e.g. {}).'.format(len(unmatched), len(ids), ', '.join(map(str, ids[:5]))))
+
+  def write(i):
+    path = args.output_path + '/' + file_names[i].split('.')[0] + '.txt'
+    write_label(path, anns[starts[i]:ends[i],1].tolist(), yolo[starts[i]:ends[i]].tolist())
+
+  with profiling.stage('write'), ThreadPoolExecutor(max_workers=args.workers) as executor:
+    for batch_start in range(0, len(file_names), WRITE_BATCH):
+      batch_end = min(batch_start + WRITE_BATCH, len(file_names))
+      list(executor.map(write, range(batch_start, batch_end)))
+      profiling.count(batch_end - batch_start)
+      print(batch_end, 'YOLO label files created.')
+  profiling.finish()
+
+if __name__ == "__main__":
+  main()
@@ -13,13 +13,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Copies images and label files from one folder to another if objects of classes defined by the 
-'classes'-parameter are contained (Or only if they explicitely are NOT contained if the 'reverse'-parameter is set)."""
+'classes'-parameter are contained (Or only if they explicitely are NOT contained if the 'reverse'-parameter is set).
 
-import os, glob
-import numpy as np
+The label files are parsed once into an inverted index (class -> images) that is stored next to the input folder,
+so building several subsets of the same folder does not read the labels again (it is rebuilt when the folder changed).
+Subsets are copied by default, hardlinks and symlinks share the files with the input folder."""
+
+import os
+import random
 import argparse
 import json
+import hashlib
 from shutil import copy2
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import profiling
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore, LabelWriter, parse_labels
+import output_layout
 
 parser = argparse.ArgumentParser(description='Copies images and labels depending on class.')
 parser.add_argument('--input_path', '--i', action='store',
@@ -35,51 +48,203 @@ parser.add_argument('--classes', '--c', nargs='+', default=[1, 2, 3], type = int
                     help='Class-categories that are to be copied over (seperated by spaces).')
 parser.add_argument('--reverse', '--r', dest='reverse', action='store_true', default=False,
                     help='Reverses the script function into only copying images without objects of the specified categories.')
+parser.add_argument('--mode', '--m', action='store', choices=['hardlink', 'symlink', 'copy'],
+                    default='copy',
+                    help='How files are placed in the output folder. Hardlinks fall back to copies across file systems. '
+                         'Hardlinked and symlinked files are the files of the input folder, a tool changing them in place changes both.')
+parser.add_argument('--random', dest='random', action='store_true', default=False,
+                    help='Chooses n images uniformly at random instead of the first n in sorted order.')
+parser.add_argument('--seed', action='store', type = int,
+                    default=None,
+                    help='Seed for --random.')
+parser.add_argument('--index_path', action='store',
+                    default=None,
+                    help='Path to the class index (default: input_path + "_class_index.json").')
+parser.add_argument('--rebuild', dest='rebuild', action='store_true', default=False,
+                    help='Rebuilds the class index even if it exists.')
+parser.add_argument('--label_store', action='store',
+                    default=None,
+                    help='Read the labels from a label store (see blender_addon/label_store.py) instead of the .txt files in input_path.')
+parser.add_argument('--out_label_store', action='store',
+                    default=None,
+                    help='Append the labels of the chosen images to this label store instead of placing .txt files in out_path.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=16,
+                    help='Number of threads reading labels and placing files.')
+output_layout.add_arguments(parser)
+profiling.add_arguments(parser)
+
+def read_label_classes(txt_path):
+  """Returns a Counter of the object classes in a Yolo label file."""
+  with open(txt_path, mode = "r") as label_file:
+    label = label_file.read()
+  return Counter(int(line.split(' ')[0]) for line in label.split('\n') if line)
+
+def build_class_index(input_path, workers = 16):
+  """Scans input_path once and builds an inverted index of the labelled images.
+  
+  Arguments:
+    input_path {str} -- Folder with images and Yolo label files.
+  
+  Keyword Arguments:
+    workers {int} -- number of threads reading label files (default: {16})
+  
+  Returns:
+    index {dict} -- {'images': [file name without extension], 'ext': [image extension],
+                     'classes': {class: [[image index, object count], ...]}}
+  """
+  labels = set()
+  images = {}
+  for entry in output_layout.entries(input_path):
+    stem, ext = os.path.splitext(entry.name)
+    if ext == '.txt':
+      labels.add(stem)
+    elif ext in ('.jpg', '.png') and images.get(stem) != '.jpg':
+      images[stem] = ext
+  names = sorted(stem for stem in labels if stem in images)
+
+  layout = output_layout.Layout.load(input_path)
+  classes = {}
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    counts = executor.map(read_label_classes, [layout.path(input_path, name, '.txt') for name in names], chunksize=256)
+    for i, count in enumerate(counts):
+      for c, n in count.items():
+        classes.setdefault(str(c), []).append([i, n])
+      if (i+1) % 10000 == 0:
+        print(i+1, 'label files indexed')
+  return {'images': names, 'ext': [images[name] for name in names], 'classes': classes}
+
+def scan_images(input_path):
+  """Returns {file name without extension: image extension} of the jpg and png images in input_path (jpg preferred)."""
+  images = {}
+  for entry in output_layout.entries(input_path):
+    stem, ext = os.path.splitext(entry.name)
+    if ext in ('.jpg', '.png') and images.get(stem) != '.jpg':
+      images[stem] = ext
+  return images
+
+def build_store_class_index(input_path, store):
+  """Builds the inverted index (see build_class_index) from a label store."""
+  images = scan_images(input_path)
+  store_ids = [i for i in np.argsort(store.names, kind='stable') if store.names[i] in images]
+  names = [store.names[i] for i in store_ids]
+  position = np.full(len(store), -1, dtype=np.int64)
+  position[np.array(store_ids, dtype=np.int64)] = np.arange(len(store_ids))
+  row_images = position[store.image_ids()]
+  keep = row_images >= 0
+  pairs, counts = np.unique(np.stack([np.asarray(store.classes)[keep].astype(np.int64), row_images[keep]]), axis=1, return_counts=True)
+  classes = {}
+  for (c, i), n in zip(pairs.T.tolist(), counts.tolist()):
+    classes.setdefault(str(c), []).append([i, n])
+  return {'images': names, 'ext': [images[name] for name in names], 'classes': classes}
+
+def folder_state(input_path):
+  """Hash of the names, modification times and sizes of the images and label files in input_path."""
+  h = hashlib.sha256()
+  for entry in output_layout.entries(input_path):
+    if os.path.splitext(entry.name)[1] in ('.txt', '.jpg', '.png'):
+      st = entry.stat()
+      h.update('{}\0{}\0{}\n'.format(entry.name, st.st_mtime_ns, st.st_size).encode('utf-8'))
+  return h.hexdigest()
 
-args = parser.parse_args()
-
-txt_list = sorted(glob.glob(args.input_path + "/*.txt"))
-stats = {}
-for c in args.classes:
-  stats[c] = 0
-
-n = 0
-
-if not os.path.exists(args.out_path):
-    os.makedirs(args.out_path)
-
-for txt_name in txt_list:
-  label_file = open(txt_name, mode = "r")
-  label = label_file.read()
-  label_file.close()
-  copy = False
-  if args.reverse:
-    copy = True
-  if label or args.reverse:
-    for line in label.split('\n'):
-      if line:
-        obj_class = int(line.split(' ')[0])
-        if obj_class in args.classes:
-          stats[obj_class] += 1
-          if args.reverse:
-            copy = False
+def load_class_index(input_path, index_path, rebuild = False, workers = 16):
+  """The class index of input_path from index_path, built (and stored) if it doesn't exist or the folder changed since."""
+  state = folder_state(input_path)
+  if not rebuild and os.path.isfile(index_path):
+    with open(index_path) as f_index:
+      index = json.load(f_index)
+    if index.get('state') == state:
+      return index
+    print('input folder changed since the class index was built, rebuilding it')
+  index = build_class_index(input_path, workers=workers)
+  index['state'] = state
+  with open(index_path, 'w') as f_index:
+    json.dump(index, f_index)
+  return index
+
+def select_images(index, classes, reverse = False):
+  """Indices (sorted) of the images that contain objects of the given classes (or none of them if reverse is set)."""
+  selected = set()
+  for c in classes:
+    selected.update(i for i, _ in index['classes'].get(str(c), []))
+  if reverse:
+    return [i for i in range(len(index['images'])) if i not in selected]
+  return sorted(selected)
+
+def place_file(src, dst_dir, mode = 'copy', layout = None):
+  """Places src in dst_dir (at its place in layout, flat by default) as hardlink, symlink or copy (replacing an existing file)."""
+  if layout is None:
+    dst = os.path.join(dst_dir, os.path.basename(src))
+  else:
+    stem, ext = os.path.splitext(os.path.basename(src))
+    dst = layout.path(dst_dir, stem, ext, create=True)
+  if os.path.lexists(dst):
+    os.remove(dst)
+  if mode == 'symlink':
+    os.symlink(os.path.abspath(src), dst)
+  elif mode == 'hardlink':
+    try:
+      os.link(src, dst)
+    except OSError:
+      copy2(src, dst)
+  else:
+    copy2(src, dst)
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('copy_if_class', args)
+  with profiling.stage('index'):
+    if args.label_store:
+      ## the store itself is indexed, no need to keep a separate index file
+      index = build_store_class_index(args.input_path, LabelStore(args.label_store))
+    else:
+      index_path = args.index_path or args.input_path.rstrip('/') + '_class_index.json'
+      index = load_class_index(args.input_path, index_path, rebuild=args.rebuild, workers=args.workers)
+
+  with profiling.stage('select'):
+    candidates = select_images(index, args.classes, reverse=args.reverse)
+    if args.random:
+      chosen = sorted(random.Random(args.seed).sample(candidates, min(args.n, len(candidates))))
+    else:
+      chosen = candidates[:args.n]
+
+  input_layout = output_layout.Layout.load(args.input_path)
+  layout = output_layout.from_args(args)
+  layout.save(args.out_path)
+
+  files = []
+  for i in chosen:
+    name = input_layout.path(args.input_path, index['images'][i])
+    files.append(name + index['ext'][i])
+    if not args.out_label_store:
+      files.append(name + '.txt')
+  with profiling.stage('place'), ThreadPoolExecutor(max_workers=args.workers) as executor:
+    for n, _ in enumerate(executor.map(lambda f: place_file(f, args.out_path, args.mode, layout), files)):
+      profiling.count()
+      if (n+1) % 1000 == 0:
+        print(n+1, "files placed")
+  print(len(chosen), "images copied")
+
+  if args.out_label_store:
+    with profiling.stage('labels'):
+      input_store = LabelStore(args.label_store) if args.label_store else None
+      with LabelWriter(args.out_label_store) as writer:
+        for i in chosen:
+          name = index['images'][i]
+          if input_store is not None:
+            rows = input_store.rows(input_store.index_of(name))
           else:
-            copy = True
-    if copy:
-      if os.path.isfile(txt_name[:-4] + '.jpg'):
-        copy2(txt_name[:-4] + '.jpg', args.out_path)
-      elif os.path.isfile(txt_name[:-4] + '.png'):
-        copy2(txt_name[:-4] + '.png', args.out_path)
-      else:
-        continue;
-      copy2(txt_name, args.out_path)
-      n += 1
-      if n >=args.n:
-        break;
-  if copy and n%50==0:
-    print(n, "images copied")
-    if not args.reverse:
-      print(stats)
-
-if not args.reverse:
-  print(stats)
+            with open(input_layout.path(args.input_path, name, '.txt')) as label_file:
+              rows = parse_labels(label_file.read())
+          writer.add(name, rows)
+
+  if not args.reverse:
+    chosen_set = set(chosen)
+    stats = {}
+    for c in args.classes:
+      stats[c] = sum(count for i, count in index['classes'].get(str(c), []) if i in chosen_set)
+    print(stats)
+  profiling.finish()
+
+if __name__ == "__main__":
+  main()
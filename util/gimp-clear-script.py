@@ -13,7 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Clears objects from background images with the help of gimp and its 'heal-selection' filter.
-Reads Yolo style label files to gather the corresponding object bounding boxes. Copy into Gimps python-console to use."""
+Reads Yolo style label files to gather the corresponding object bounding boxes. Copy into Gimps python-console to use.
+For a headless (and parallel) alternative see util/clear_backgrounds.py."""
 
 def clear(folder):
   import os, glob
@@ -0,0 +1,54 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Background loading at the target resolution for the compositing scripts (paste_rendered.py, overlay_rendered.py).
+
+JPEGs are decoded at reduced scale (DCT scaling by 1/2, 1/4 or 1/8, as far as the result stays at least as large as the
+target) and resized once, so a 12 MP photo used for a 640 px sample is never decoded or composited at full size.
+Labels are relative to the image size and stay valid."""
+
+from PIL import Image
+
+def scaled_size(size, output_size):
+  """(width, height) of an image of the given size with its long side scaled down to output_size (never enlarged)."""
+  width, height = size
+  scale = float(output_size) / max(width, height)
+  if scale >= 1:
+    return size
+  return (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+
+def open_background(path, output_size = None, mode = None):
+  """Opens and decodes an image, reduced so its long side is at most output_size.
+
+  Arguments:
+    path {str} -- Path of the image.
+
+  Keyword Arguments:
+    output_size {int} -- maximal width and height in pixels (default: {None}, full size)
+    mode {str} -- PIL mode the image is converted to (default: {None}, as stored)
+
+  Returns:
+    img {PIL.Image} -- The loaded image.
+  """
+  img = Image.open(path)
+  target = scaled_size(img.size, output_size) if output_size else img.size
+  if target != img.size:
+    ## only has an effect on JPEGs, has to be called before loading
+    img.draft(mode, target)
+  img.load()
+  if mode and img.mode != mode:
+    img = img.convert(mode)
+  if img.size != target:
+    img = img.resize(target, Image.BICUBIC)
+  return img
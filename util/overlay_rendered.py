@@ -14,16 +14,21 @@
 # limitations under the License.
 """Insert object images into background images by scaling and placing them corresponding to labelled objects in the background images. Needs a json info file containing classes and aspect-ratios of rendered objects that can be generated with util/write_class_info.py."""
 
-import os, glob
+import os
 import numpy as np
 from scipy import ndimage, signal
 from PIL import Image
 import argparse
-from matplotlib import pyplot as plt
-import matplotlib.patches as patches
 import random
 import json
-from pycocotools.coco import COCO
+import profiling
+from ratio_index import RatioIndex
+from sprite_atlas import SpriteAtlas
+from image_loading import open_background
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore, LabelWriter
+import output_layout
 
 parser = argparse.ArgumentParser(description='Paste croppped object images into backgrounds.')
 parser.add_argument('--input_path', '--i', action='store',
@@ -41,16 +46,23 @@ parser.add_argument('--n', action='store', type = int,
 parser.add_argument('--output_path', '--o', action='store',
                     default='../overlay',
                     help='Output path.')
-
-args = parser.parse_args()
-
-img_list = sorted(glob.glob(args.input_path + "/*.png"))
-bg_list = sorted(glob.glob(args.bg_path + "/*.png")+glob.glob(args.bg_path + "/*.jpg"))
-
-json_file = open(args.object_info)
-obj_info = json.loads(json_file.read())
-json_file.close()
-obj_classes = obj_info.keys()
+parser.add_argument('--atlas', action='store',
+                    default=None,
+                    help='Path to a sprite atlas (generated with util/sprite_atlas.py) used instead of the object images in input_path.')
+parser.add_argument('--bg_label_store', action='store',
+                    default=None,
+                    help='Label store (see blender_addon/label_store.py) with the labels of the background images.')
+parser.add_argument('--out_label_store', action='store',
+                    default=None,
+                    help='Append the labels of the generated images to this label store instead of writing .txt files.')
+parser.add_argument('--k', action='store', type = int,
+                    default=5,
+                    help='Number of closest object images (by aspect ratio and size) a replacement is chosen from.')
+parser.add_argument('--output_size', action='store', type = int,
+                    default=None,
+                    help='Maximal width and height of the generated images in pixels (backgrounds are decoded at reduced size, default: background size).')
+output_layout.add_arguments(parser)
+profiling.add_arguments(parser)
 
 def read_classes(line):
   c, x, y, w, h = line.split(' ')
@@ -126,7 +138,8 @@ def resize_and_paste(obj_img, obj_w, obj_h, obj_c_x, obj_c_y, bg, w, h, c_x, c_y
   scale_factor = max(ratio_x, ratio_y) + shift
 
   new_size = (int(obj_img.size[0] * scale_factor), int(obj_img.size[1] * scale_factor))
-  obj_img = obj_img.resize(new_size, Image.BICUBIC)
+  with profiling.stage('resize'):
+    obj_img = obj_img.resize(new_size, Image.BICUBIC)
 
   # coordinates for pasting (center x,y of the background image - offset of the object center in the object image)
   x = int(c_x*bg_width-(new_size[0]*obj_c_x))
@@ -142,7 +155,8 @@ def resize_and_paste(obj_img, obj_w, obj_h, obj_c_x, obj_c_y, bg, w, h, c_x, c_y
   if top_shift:
     y = int(y + obj_h*scale_factor*shift*obj_c_y)
 
-  bg = bg.paste(obj_img,(x,y),obj_img)
+  with profiling.stage('paste'):
+    bg = bg.paste(obj_img,(x,y),obj_img)
 
   c_x = (x + new_size[0]*obj_c_x)/bg_width
   c_y = (y + new_size[1]*obj_c_y)/bg_height
@@ -151,66 +165,109 @@ def resize_and_paste(obj_img, obj_w, obj_h, obj_c_x, obj_c_y, bg, w, h, c_x, c_y
   return bg, c_x , c_y, w, h
 
 
-if not os.path.exists(args.output_path):
-    os.makedirs(args.output_path)
-
-bg_count = 0
-i = 0
-while i < args.n:
-
-  bg = Image.open(bg_list[bg_count%len(bg_list)])
-  # print("BG Image: ", bg_list[bg_count%len(bg_list)])
-  print('Image: ', i)
-
-  bg_labels_file = open(bg_list[bg_count%len(bg_list)][:-4] + '.txt', mode = "r")
+def overlay(bg, bg_labels, ratio_index, input_path, atlas = None, k = 5, input_layout = None):
+  """Replaces the labelled objects of a background image with object images of the same class and a similar ratio.
+  
+  Arguments:
+    bg {PIL.Image} -- Background image (altered in place)
+    bg_labels {list} -- Labels (class, x, y, w, h) of the background image (class as str like the object info keys)
+    ratio_index {RatioIndex} -- index of the object images
+    input_path {str} -- Path to the object images
+  
+  Keyword Arguments:
+    atlas {SpriteAtlas} -- sprite atlas used instead of the object images (default: {None})
+    k {int} -- number of closest object images a replacement is chosen from (default: {5})
+    input_layout {output_layout.Layout} -- directory layout of input_path (default: {None}, read from input_path)
+  
+  Returns:
+    labels {list} -- Labels (class, x, y, w, h) of the resulting image
+  """
+  if input_layout is None and atlas is None:
+    input_layout = output_layout.Layout.load(input_path)
   labels = []
-
-  count = 0
-  for line in bg_labels_file:
-    c, c_x, c_y, w, h = read_classes(line)
-    if w >= h:
-      ratio = str(round(h/w,1))
-    else:
-      ratio = str(round(-w/h,1))
-    ## check if object image with similar ratio exists
-    if c in obj_info:
-      if not ratio in obj_info[c]:
-        ratios = list(obj_info[c].keys())
-        ratio = ratios[random.randint(0,len(ratios)-1)]
-      ## choose a random object image with similar ratio
-      obj_dict = obj_info[c][ratio][random.randint(0,len(obj_info[c][ratio])-1)]
-      obj_img = Image.open(os.path.join(args.input_path, obj_dict['img']))
-      obj_c_x = obj_dict['center_x']
-      obj_c_y = obj_dict['center_y']
-      obj_w = obj_dict['width']
-      obj_h = obj_dict['height']
+  for c, c_x, c_y, w, h in bg_labels:
+    if c in ratio_index:
+      ## choose a random object image among the ones with the closest ratio
+      obj_dict = ratio_index.sample(c, w, h, k=k)
+      if atlas is not None:
+        ## trimmed sprite with its label relative to the crop
+        obj_img, (_, obj_c_x, obj_c_y, obj_w, obj_h) = atlas.sprite(atlas.index_of(obj_dict['img']))
+      else:
+        with profiling.stage('decode'):
+          obj_name, obj_ext = os.path.splitext(obj_dict['img'])
+          obj_img = Image.open(input_layout.path(input_path, obj_name, obj_ext))
+          obj_img.load()
+        obj_c_x = obj_dict['center_x']
+        obj_c_y = obj_dict['center_y']
+        obj_w = obj_dict['width']
+        obj_h = obj_dict['height']
       ## resize and paste onto background
       obj_img, c_x, c_y, w, h = resize_and_paste(obj_img, obj_w, obj_h, obj_c_x, obj_c_y, bg, w, h, c_x, c_y)
-      # print('new bbox size', w, h)
 
       ## add new label
-
-      # w = (obj_img.size[0]*float(w))/bg.size[0]
-      # h = (obj_img.size[1]*float(h))/bg.size[1]
-      # c_x = (pos[0] + obj_img.size[0]*float(c_x)) / bg.size[0]
-      # c_y = (pos[1] + obj_img.size[1]*float(c_y)) / bg.size[1]
-
       labels.append((c, c_x, c_y, w, h))
-      count += 1
     else:
       # print('Class {} not found in rendered training images'.format(c))
       labels.append((c, c_x, c_y, w, h))
+  return labels
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('overlay_rendered', args)
+
+  bg_list = output_layout.scan(args.bg_path, ('.png', '.jpg'))
+
+  json_file = open(args.object_info)
+  obj_info = json.loads(json_file.read())
+  json_file.close()
+  ratio_index = RatioIndex(obj_info)
+  atlas = SpriteAtlas(args.atlas) if args.atlas else None
+  input_layout = output_layout.Layout.load(args.input_path)
+  bg_label_store = LabelStore(args.bg_label_store) if args.bg_label_store else None
+
+  layout = output_layout.from_args(args)
+  layout.save(args.output_path)
+  writer = LabelWriter(args.out_label_store) if args.out_label_store else None
+
+  bg_count = 0
+  i = 0
+  while i < args.n:
+
+    with profiling.stage('decode'):
+      bg = open_background(bg_list[bg_count%len(bg_list)], args.output_size)
+    print('Image: ', i)
+
+    bg_name = bg_list[bg_count%len(bg_list)]
+    if bg_label_store is not None:
+      rows = bg_label_store.rows(bg_label_store.index_of(os.path.basename(bg_name)[:-4]))
+      bg_labels = [(str(c), x, y, w, h) for c, x, y, w, h in rows]
+    else:
+      bg_labels_file = open(bg_name[:-4] + '.txt', mode = "r")
+      bg_labels = [read_classes(line) for line in bg_labels_file]
+      bg_labels_file.close()
+
+    labels = overlay(bg, bg_labels, ratio_index, args.input_path, atlas=atlas, k=args.k, input_layout=input_layout)
 
-    
+    name = output_layout.index_name(i)
+    with profiling.stage('save'):
+      bg.save(layout.path(args.output_path, name, '.jpg', create=True))
+    with profiling.stage('labels'):
+      if writer:
+        writer.add(name, [(int(c), c_x, c_y, w, h) for c, c_x, c_y, w, h in labels])
+      else:
+        out_file = open(layout.path(args.output_path, name, '.txt'), mode = 'w')
+        for line in labels:
+          out_file.write("{} {} {} {} {}\n".format(*line))
+        out_file.close()
+    profiling.count()
+    i+=1
+    bg_count+=1
+    if i%100==0:
+      print(i, 'images processed.')
 
-  bg.save('{}/{}.jpg'.format(args.output_path, i))
-  out_file = open('{}/{}.txt'.format(args.output_path, i), mode = 'w')
+  if writer:
+    writer.close()
+  profiling.finish()
 
-  for line in labels:
-    out_file.write("{} {} {} {} {}\n".format(*line))
-  bg_labels_file.close()
-  out_file.close()
-  i+=1
-  bg_count+=1
-  if i%100==0:
-    print(i, 'images processed.')
\ No newline at end of file
+if __name__ == "__main__":
+  main()
@@ -12,17 +12,34 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Insert object images into background images by scaling and placing them randomly."""
+"""Insert object images into background images by scaling and placing them randomly.
 
-import os, glob
+Can be used as a script (writes jpg images and label files) or imported to get composites in memory:
+
+  from paste_rendered import CompositeStream
+  with CompositeStream(img_list, bg_list, seed=0, workers=4) as stream:
+    for image, labels in stream:
+      ...
+"""
+
+import os
 import numpy as np
 from scipy import ndimage, signal
 from PIL import Image
 import argparse
-from matplotlib import pyplot as plt
-import matplotlib.patches as patches
 import random
 import json
+import pickle
+import traceback
+import multiprocessing
+from queue import Empty
+import profiling
+from sprite_atlas import SpriteAtlas
+from image_loading import open_background
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore, LabelWriter
+import output_layout
 
 parser = argparse.ArgumentParser(description='Paste croppped object images into backgrounds.')
 parser.add_argument('--input_path', '--i', action='store',
@@ -49,16 +66,35 @@ parser.add_argument('--min_objects', action='store', type = int,
 parser.add_argument('--output_path', '--o', action='store',
                     default='../augmented',
                     help='Output path.')
+parser.add_argument('--atlas', action='store',
+                    default=None,
+                    help='Path to a sprite atlas (generated with util/sprite_atlas.py) used instead of the object images in input_path.')
+parser.add_argument('--label_store', action='store',
+                    default=None,
+                    help='Label store (see blender_addon/label_store.py) with the labels of the object images.')
+parser.add_argument('--bg_label_store', action='store',
+                    default=None,
+                    help='Label store with the labels of the background images.')
+parser.add_argument('--out_label_store', action='store',
+                    default=None,
+                    help='Append the labels of the generated images to this label store instead of writing .txt files.')
+parser.add_argument('--seed', action='store', type = int,
+                    default=None,
+                    help='Seed for reproducible composites.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=0,
+                    help='Number of worker processes compositing in the background (0 composites in the main process).')
+parser.add_argument('--output_size', action='store', type = int,
+                    default=None,
+                    help='Maximal width and height of the generated images in pixels (backgrounds are decoded at reduced size, default: background size).')
+
+output_layout.add_arguments(parser)
+profiling.add_arguments(parser)
 
 # determines if labels of background objects, which are occluded by added objects will be deleted
 DELETE_OCCLUDED_OBJECT_LABELS = True
 IGNORE_BG_LABELS = False
 
-args = parser.parse_args()
-
-img_list = sorted(glob.glob(args.input_path + "/*.png"))
-bg_list = sorted(glob.glob(args.bg_path + "/*.png")+glob.glob(args.bg_path + "/*.jpg"))
-
 
 def read_classes(line):
   c, x, y, w, h = line.split(' ')
@@ -86,7 +122,7 @@ def delete_occluded_labels(prior_labels, added_labels):
   return prior_labels
 
 
-def rand_resize(img, bg, max_ratio = 1.3, min_ratio =.07):
+def rand_resize(img, bg, max_ratio = 1.3, min_ratio =.07, rng = random):
   """Resizes img to a fraction of the background image within given bounds.
   
   Arguments:
@@ -96,29 +132,33 @@ def rand_resize(img, bg, max_ratio = 1.3, min_ratio =.07):
   Keyword Arguments:
     max_ratio {float} -- maximum fraction of background size (default: {.7})
     min_ratio {float} -- minimum fraction of background size (default: {.07})
+    rng {random.Random} -- random number generator (default: {random})
   """
 
   short_side = min(*bg.size)
-  new_size = random.randint(int(short_side*min_ratio),int(short_side*max_ratio))
+  new_size = rng.randint(int(short_side*min_ratio),int(short_side*max_ratio))
   ratios = np.divide(img.size,max(img.size))
-  return img.resize(list(map(int,(np.multiply(ratios, new_size)))), Image.BICUBIC)
+  with profiling.stage('resize'):
+    return img.resize(list(map(int,(np.multiply(ratios, new_size)))), Image.BICUBIC)
 
-def rand_paste(img, bg, outside_ratio = .5):
+def rand_paste(img, bg, outside_ratio = .5, rng = random):
   """Pastes img into background (placed randomly)
   
   Arguments:
     img {PIL.Image} -- Image that will be pasted.
     bg {PIL.Image} -- Background Image.
     outside_ratio {Float} -- part of img that is allowed to hang over the borders of bg and by that get cut off.
+    rng {random.Random} -- random number generator (default: {random})
   
   Returns:
     bg {PIL.Image} -- Resulting Image.
     placed_coords {(int, int)} -- top-left corner of Image placement
   """
 
-  x = random.randint(-int(img.size[0]*outside_ratio), bg.size[0] - int(img.size[0]*(1-outside_ratio)))
-  y = random.randint(-int(img.size[1]*outside_ratio), bg.size[1] - int(img.size[1]*(1-outside_ratio)))
-  bg.paste(img,(x,y),img)
+  x = rng.randint(-int(img.size[0]*outside_ratio), bg.size[0] - int(img.size[0]*(1-outside_ratio)))
+  y = rng.randint(-int(img.size[1]*outside_ratio), bg.size[1] - int(img.size[1]*(1-outside_ratio)))
+  with profiling.stage('paste'):
+    bg.paste(img,(x,y),img)
 
   return bg, (x, y)
 
@@ -155,9 +195,10 @@ def masked_rand_paste(img, bg, mask_img, border_ratio = .0, erosion_ratio = .1):
 
   if erosion > 0:
     #mask_img = ndimage.binary_erosion(mask_img, structure=np.ones((erosion ,erosion))).astype(mask_img.dtype)
-    mask_img = np.logical_not(mask_img)
-    mask_img = signal.fftconvolve(mask_img, np.ones((erosion,erosion)), 'same') > .5
-    mask_img = np.logical_not(mask_img)
+    with profiling.stage('erosion'):
+      mask_img = np.logical_not(mask_img)
+      mask_img = signal.fftconvolve(mask_img, np.ones((erosion,erosion)), 'same') > .5
+      mask_img = np.logical_not(mask_img)
 
   # print("Size x and y:", img.size[0], img.size[1])
   # print("Border x and y:", border_x, border_y)
@@ -179,38 +220,64 @@ def masked_rand_paste(img, bg, mask_img, border_ratio = .0, erosion_ratio = .1):
   ## get position of top left corner
   random_pos = [x[i] - int(img.size[0]/2), y[i] - int(img.size[1]/2)]
 
-  bg.paste(img, random_pos ,img)
+  with profiling.stage('paste'):
+    bg.paste(img, random_pos ,img)
 
   return bg, random_pos
 
 
-if not os.path.exists(args.output_path):
-    os.makedirs(args.output_path)
 
-bg_count = 0
-i = 0
-while i < args.n:
+
+def load_sprite(img_list, i, label_store = None):
+  """Returns object image i and its label fields (class, x, y, w, h) from a list of image paths or a SpriteAtlas.
+  Labels of image paths are read from label_store if given, else from the label file next to the image."""
+  if isinstance(img_list, SpriteAtlas):
+    return img_list.sprite(i)
+  img_name = img_list[i]
+  with profiling.stage('decode'):
+    img = Image.open(img_name)
+    img.load()
+  if label_store is not None:
+    rows = label_store.rows(label_store.index_of(os.path.basename(img_name)[:-4]))
+    return img, rows[0] if len(rows) == 1 else []
+  img_label_file = open(img_name[:-4] + '.txt', mode = "r")
+  label = img_label_file.read().replace('\n','').split(' ')
+  img_label_file.close()
+  return img, label
+
+def composite(bg, bg_labels, img_list, min_objects = 1, n_objects = 3, min_ratio = .5, max_ratio = 1.5, rng = random, label_store = None):
+  """Pastes a random number of random object images into a background.
+  
+  Arguments:
+    bg {PIL.Image} -- Background image (altered in place).
+    bg_labels {list} -- Labels (class, x, y, w, h) of the background image.
+    img_list {list} -- Paths of the object images (each with a label file next to it) or a SpriteAtlas.
   
-  bg = Image.open(bg_list[bg_count%len(bg_list)])
-  # print("BG Image: ", bg_list[bg_count%len(bg_list)])
+  Keyword Arguments:
+    min_objects {int} -- minimum number of pasted objects (default: {1})
+    n_objects {int} -- maximum number of pasted objects (default: {3})
+    min_ratio {float} -- minimal ratio between object and background size (default: {.5})
+    max_ratio {float} -- maximal ratio between object and background size (default: {1.5})
+    rng {random.Random} -- random number generator (default: {random})
+    label_store {LabelStore} -- labels of the object images (default: {None}, read from label files)
+  
+  Returns:
+    bg {PIL.Image} -- Resulting Image.
+    labels {list} -- Labels (class, x, y, w, h) of the resulting image.
+  """
 
-  bg_labels_file = open(bg_list[bg_count%len(bg_list)][:-4] + '.txt', mode = "r")
   added_labels = []
 
   count = 0
-  n = random.randint(args.min_objects,args.n_objects)
+  n = rng.randint(min_objects, n_objects)
   while count < n:
-    ## open random object image
-    img_name = img_list[random.randint(0,len(img_list)-1)]
-    img = Image.open(img_name)
-    ## read class
-    img_label_file = open(img_name[:-4] + '.txt', mode = "r")
-    label = img_label_file.read().replace('\n','').split(' ')
+    ## open random object image and read class
+    img, label = load_sprite(img_list, rng.randint(0,len(img_list)-1), label_store)
     if len(label) == 5:
       obj_class, c_x, c_y, w, h = label
       ## resize and paste random into background
-      img = rand_resize(img, bg, max_ratio =args.max_ratio, min_ratio =args.min_ratio)
-      bg, pos = rand_paste(img, bg)
+      img = rand_resize(img, bg, max_ratio =max_ratio, min_ratio =min_ratio, rng=rng)
+      bg, pos = rand_paste(img, bg, rng=rng)
     else:
       continue;
 
@@ -220,25 +287,210 @@ while i < args.n:
     centre_x = (pos[0] + img.size[0]*float(c_x)) / bg.size[0]
     centre_y = (pos[1] + img.size[1]*float(c_y)) / bg.size[1]
 
-    added_labels.append((obj_class, centre_x, centre_y, width, height))
+    added_labels.append((int(obj_class), centre_x, centre_y, width, height))
     count += 1
 
-  bg.save('{}/{}.jpg'.format(args.output_path, i))
-  out_file = open('{}/{}.txt'.format(args.output_path, i), mode = 'w')
-  labels = []
-  if not IGNORE_BG_LABELS:
-    for line in bg_labels_file:
-      labels.append(read_classes(line))
+  labels = [] if IGNORE_BG_LABELS else list(bg_labels)
   if DELETE_OCCLUDED_OBJECT_LABELS:
     labels = delete_occluded_labels(labels, added_labels)
   else:
     labels += added_labels
+  return bg, labels
 
-  for line in labels:
-    out_file.write("{} {} {} {} {}\n".format(*line))
-  bg_labels_file.close()
-  out_file.close()
-  i+=1
-  bg_count+=1
-  if i%100==0:
-    print(i, 'images processed.')
\ No newline at end of file
+def make_sample(index, img_list, bg_list, seed = None, bg_label_store = None, output_size = None, **kwargs):
+  """Creates the composite with the given index. With a seed the result only depends on seed and index.
+  
+  Arguments:
+    index {int} -- Sample index (selects the background image).
+    img_list {list} -- Paths of the object images or a SpriteAtlas.
+    bg_list {list} -- Paths of the background images (each with a label file next to it).
+  
+  Keyword Arguments:
+    seed {int} -- Seed of the sample stream (default: {None})
+    bg_label_store {LabelStore} -- labels of the background images (default: {None}, read from label files)
+    output_size {int} -- maximal width and height of the sample, the background is reduced to it (default: {None})
+    **kwargs -- passed on to composite()
+  
+  Returns:
+    image {numpy.array} -- RGB image (uint8, height x width x 3)
+    labels {numpy.array} -- Labels (float64, n x 5) with rows class, x, y, w, h
+  """
+
+  rng = random.Random() if seed is None else random.Random('{}-{}'.format(seed, index))
+  bg_name = bg_list[index%len(bg_list)]
+  with profiling.stage('decode'):
+    bg = open_background(bg_name, output_size, mode='RGB')
+  bg_labels = []
+  if bg_label_store is not None:
+    bg_labels = bg_label_store.rows(bg_label_store.index_of(os.path.basename(bg_name)[:-4]))
+  else:
+    with open(bg_name[:-4] + '.txt', mode = "r") as bg_labels_file:
+      for line in bg_labels_file:
+        bg_labels.append(read_classes(line))
+  bg, labels = composite(bg, bg_labels, img_list, rng=rng, **kwargs)
+  return np.asarray(bg), np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+
+RESULT_POLL = 1. ## seconds between checks that the workers are still alive while waiting for a sample
+
+class WorkerTraceback(Exception):
+  """Traceback of an exception raised in a CompositeStream worker (the cause of the exception re-raised by the consumer)."""
+
+  def __str__(self):
+    return '\n\n' + self.args[0]
+
+def _worker(task_queue, result_queue, img_list, bg_list, seed, kwargs, profile):
+  ## composites the indices from task_queue until it receives None (stage timings are sent along with the samples).
+  ## an exception is sent to the consumer as (index, exception, traceback) and stops the worker
+  profiling.enable_timers(profile)
+  for index in iter(task_queue.get, None):
+    try:
+      sample = make_sample(index, img_list, bg_list, seed, **kwargs)
+    except Exception as e:
+      try:
+        pickle.dumps(e)
+      except Exception:
+        e = RuntimeError(repr(e))
+      result_queue.put((index, e, traceback.format_exc()))
+      return
+    result_queue.put((index,) + sample + (profiling.pop_stats(),))
+
+class CompositeStream(object):
+  """Iterator over in-memory composites (image_array, labels_array) as returned by make_sample().
+  
+  Composites are created by worker processes that keep up to 'prefetch' samples ahead of the consumer.
+  Samples are yielded in index order, so a seeded stream is reproducible independent of the number of workers.
+  
+  Arguments:
+    img_list {list} -- Paths of the object images or a SpriteAtlas.
+    bg_list {list} -- Paths of the background images.
+  
+  Keyword Arguments:
+    n {int} -- Number of samples, None for an infinite stream (default: {None})
+    seed {int} -- Seed for reproducible composites (default: {None})
+    workers {int} -- Number of worker processes, 0 composites in the consuming process (default: {0})
+    prefetch {int} -- Maximum number of samples composited ahead (default: {2*workers})
+    start {int} -- Index of the first sample (default: {0})
+    **kwargs -- passed on to make_sample() and composite()
+  """
+
+  def __init__(self, img_list, bg_list, n = None, seed = None, workers = 0, prefetch = None, start = 0, **kwargs):
+    if not len(img_list) or not bg_list:
+      raise ValueError('CompositeStream needs object and background images.')
+    self.img_list = img_list if isinstance(img_list, SpriteAtlas) else list(img_list)
+    self.bg_list = list(bg_list)
+    self.n = n
+    self.seed = seed
+    self.workers = workers
+    self.prefetch = max(prefetch or 2*workers, 1)
+    self.start = start
+    self.kwargs = kwargs
+    self._processes = []
+
+  def __iter__(self):
+    end = None if self.n is None else self.start + self.n
+    if self.workers < 1:
+      index = self.start
+      while end is None or index < end:
+        yield make_sample(index, self.img_list, self.bg_list, self.seed, **self.kwargs)
+        index += 1
+      return
+
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    self._start_workers(task_queue, result_queue)
+    try:
+      ## keep 'prefetch' samples in flight, reorder finished samples by index
+      submitted = self.start
+      while submitted - self.start < self.prefetch and (end is None or submitted < end):
+        task_queue.put(submitted)
+        submitted += 1
+      finished = {}
+      index = self.start
+      while end is None or index < end:
+        while index not in finished:
+          result = self._result(result_queue)
+          if isinstance(result[1], BaseException):
+            raise result[1] from WorkerTraceback(result[2])
+          i, image, labels, stats = result
+          profiling.add_stats(stats)
+          finished[i] = (image, labels)
+        if end is None or submitted < end:
+          task_queue.put(submitted)
+          submitted += 1
+        yield finished.pop(index)
+        index += 1
+    finally:
+      self.close()
+
+  def _result(self, result_queue):
+    ## next message of the workers, raises if one of them died without sending its exception (killed, native crash)
+    while True:
+      try:
+        return result_queue.get(timeout=RESULT_POLL)
+      except Empty:
+        for p in self._processes:
+          if not p.is_alive():
+            raise RuntimeError('CompositeStream worker {} died (exit code {}).'.format(p.pid, p.exitcode))
+
+  def _start_workers(self, task_queue, result_queue):
+    self.close()
+    for _ in range(self.workers):
+      p = multiprocessing.Process(target=_worker, args=(task_queue, result_queue, self.img_list, self.bg_list, self.seed, self.kwargs, profiling.is_enabled()))
+      p.daemon = True
+      p.start()
+      self._processes.append(p)
+
+  def close(self):
+    """Stops all worker processes."""
+    for p in self._processes:
+      p.terminate()
+      p.join()
+    self._processes = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('paste_rendered', args)
+
+  if args.atlas:
+    img_list = SpriteAtlas(args.atlas)
+  else:
+    img_list = output_layout.scan(args.input_path, ('.png',))
+  bg_list = output_layout.scan(args.bg_path, ('.png', '.jpg'))
+
+  layout = output_layout.from_args(args)
+  layout.save(args.output_path)
+
+  stream = CompositeStream(img_list, bg_list, n=args.n, seed=args.seed, workers=args.workers,
+                           min_objects=args.min_objects, n_objects=args.n_objects,
+                           min_ratio=args.min_ratio, max_ratio=args.max_ratio, output_size=args.output_size,
+                           label_store=LabelStore(args.label_store) if args.label_store else None,
+                           bg_label_store=LabelStore(args.bg_label_store) if args.bg_label_store else None)
+  writer = LabelWriter(args.out_label_store) if args.out_label_store else None
+  with stream:
+    for i, (image, labels) in enumerate(stream):
+      name = output_layout.index_name(i)
+      with profiling.stage('save'):
+        Image.fromarray(image).save(layout.path(args.output_path, name, '.jpg', create=True))
+      with profiling.stage('labels'):
+        if writer:
+          writer.add(name, labels)
+        else:
+          with open(layout.path(args.output_path, name, '.txt'), mode = 'w') as out_file:
+            for c, c_x, c_y, w, h in labels:
+              out_file.write("{} {} {} {} {}\n".format(int(c), c_x, c_y, w, h))
+      profiling.count()
+      if (i+1)%100==0:
+        print(i+1, 'images processed.')
+  if writer:
+    writer.close()
+  profiling.finish()
+
+if __name__ == "__main__":
+  main()
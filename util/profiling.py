@@ -0,0 +1,231 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in instrumentation for the util scripts: named stage timers, periodic throughput lines and optional
+cProfile and tracemalloc capture, written to a JSON report per run. Disabled it costs one function call per stage.
+
+Enabled with the --profile argument (see add_arguments) or the SG_PROFILE environment variable
+(e.g. SG_PROFILE=1 or SG_PROFILE=cprofile,tracemalloc; SG_PROFILE_REPORT sets the report path).
+
+  import profiling
+  profiling.setup('paste_rendered', args)
+  with profiling.stage('decode'):
+    ...
+  profiling.count()       # one item processed (throughput)
+  profiling.finish()      # stops capturing and writes the report
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import cProfile
+import pstats
+import tracemalloc
+
+MODES = ('cprofile', 'tracemalloc')
+
+class _NullStage(object):
+  ## context manager doing nothing (used while profiling is disabled)
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+NULL_STAGE = _NullStage()
+
+class _Stage(object):
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.profiler.add_time(self.name, time.perf_counter() - self.start)
+    return False
+
+class Profiler(object):
+  """Collects stage timings and throughput of one run.
+  
+  Arguments:
+    name {str} -- name of the script (used in the report and its default path)
+  
+  Keyword Arguments:
+    enabled {bool} -- collect anything at all (default: {False})
+    modes {list} -- additional captures, any of 'cprofile' and 'tracemalloc' (default: {()})
+    report_path {str} -- path of the JSON report (default: {<name>_profile_<time>.json})
+    interval {float} -- seconds between throughput lines (default: {10.})
+  """
+
+  def __init__(self, name = None, enabled = False, modes = (), report_path = None, interval = 10.):
+    self.name = name
+    self.enabled = enabled
+    self.modes = list(modes)
+    self.report_path = report_path or '{}_profile_{}.json'.format(name, time.strftime('%Y%m%d-%H%M%S'))
+    self.interval = interval
+    self.stats = {}
+    self.items = 0
+    self.start_time = time.time()
+    self.last_report = (self.start_time, 0)
+    self.cprofile = None
+
+  def start(self):
+    if not self.enabled:
+      return
+    self.start_time = time.time()
+    self.last_report = (self.start_time, 0)
+    if 'tracemalloc' in self.modes:
+      tracemalloc.start()
+    if 'cprofile' in self.modes:
+      self.cprofile = cProfile.Profile()
+      self.cprofile.enable()
+
+  def stage(self, name):
+    """Context manager adding its run time to the stage 'name'."""
+    if not self.enabled:
+      return NULL_STAGE
+    return _Stage(self, name)
+
+  def add_time(self, name, seconds):
+    stat = self.stats.get(name)
+    if stat is None:
+      self.stats[name] = [1, seconds, seconds]
+    else:
+      stat[0] += 1
+      stat[1] += seconds
+      stat[2] = max(stat[2], seconds)
+
+  def add_stats(self, stats):
+    """Merges stage timings collected elsewhere (e.g. by pop_stats() in a worker process)."""
+    for name, (count, total, longest) in (stats or {}).items():
+      stat = self.stats.setdefault(name, [0, 0., 0.])
+      stat[0] += count
+      stat[1] += total
+      stat[2] = max(stat[2], longest)
+
+  def pop_stats(self):
+    """Returns and resets the stage timings (None while disabled)."""
+    if not self.enabled:
+      return None
+    stats = self.stats
+    self.stats = {}
+    return stats
+
+  def count(self, n = 1):
+    """Counts processed items and prints a throughput line every 'interval' seconds."""
+    if not self.enabled:
+      return
+    self.items += n
+    now = time.time()
+    last_time, last_items = self.last_report
+    if now - last_time >= self.interval:
+      print('[{}] {} items, {:.2f} items/s (total {:.2f} items/s)'.format(
+        self.name, self.items, (self.items - last_items) / (now - last_time), self.items / (now - self.start_time)))
+      self.last_report = (now, self.items)
+
+  def report(self):
+    """The report as dict."""
+    duration = time.time() - self.start_time
+    stages = {}
+    for name, (count, total, longest) in sorted(self.stats.items(), key=lambda s: -s[1][1]):
+      stages[name] = {'count': count, 'total_s': total, 'mean_s': total / count, 'max_s': longest,
+                      'share': total / duration if duration > 0 else 0.}
+    report = {'script': self.name, 'argv': sys.argv, 'pid': os.getpid(),
+              'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start_time)),
+              'duration_s': duration, 'items': self.items,
+              'items_per_s': self.items / duration if duration > 0 else 0., 'stages': stages}
+    if 'tracemalloc' in self.modes and tracemalloc.is_tracing():
+      current, peak = tracemalloc.get_traced_memory()
+      top = tracemalloc.take_snapshot().statistics('lineno')[:20]
+      report['tracemalloc'] = {'current_bytes': current, 'peak_bytes': peak,
+                               'top': [{'location': str(s.traceback), 'bytes': s.size, 'count': s.count} for s in top]}
+    if self.cprofile is not None:
+      stats = pstats.Stats(self.cprofile, stream=io.StringIO())
+      stats.sort_stats('cumulative')
+      top = []
+      for func in stats.fcn_list[:30]:
+        cc, nc, tt, ct, _ = stats.stats[func]
+        top.append({'function': '{}:{}({})'.format(*func), 'calls': nc, 'tottime_s': tt, 'cumtime_s': ct})
+      report['cprofile'] = {'stats_file': os.path.splitext(self.report_path)[0] + '.prof', 'top': top}
+    return report
+
+  def finish(self):
+    """Stops the captures and writes the report (and the cProfile stats next to it)."""
+    if not self.enabled:
+      return None
+    if self.cprofile is not None:
+      self.cprofile.disable()
+    report = self.report()
+    if self.cprofile is not None:
+      self.cprofile.dump_stats(report['cprofile']['stats_file'])
+      self.cprofile = None
+    if tracemalloc.is_tracing():
+      tracemalloc.stop()
+    with open(self.report_path, 'w') as f_report:
+      json.dump(report, f_report, indent=2)
+    print('[{}] profile report written to {}'.format(self.name, self.report_path))
+    return report
+
+profiler = Profiler()
+
+def add_arguments(parser):
+  """Adds the profiling arguments to an argparse parser."""
+  parser.add_argument('--profile', nargs='*', choices=MODES, default=None,
+                      help='Write a profiling report with stage timings (optionally with cprofile and/or tracemalloc capture).')
+  parser.add_argument('--profile_report', action='store', default=None,
+                      help='Path of the profiling report (default: <script>_profile_<time>.json).')
+  parser.add_argument('--profile_interval', action='store', type = float, default=10.,
+                      help='Seconds between throughput lines while profiling.')
+
+def setup(name, args = None):
+  """Configures and starts the global profiler from parsed arguments (see add_arguments) or SG_PROFILE."""
+  global profiler
+  modes = getattr(args, 'profile', None)
+  report_path = getattr(args, 'profile_report', None)
+  interval = getattr(args, 'profile_interval', 10.)
+  env = os.environ.get('SG_PROFILE', '')
+  if modes is None and env and env != '0':
+    modes = [m for m in env.split(',') if m in MODES]
+    report_path = report_path or os.environ.get('SG_PROFILE_REPORT')
+  profiler = Profiler(name, enabled=modes is not None, modes=modes or (), report_path=report_path, interval=interval)
+  profiler.start()
+  return profiler
+
+def enable_timers(enabled = True):
+  """Enables stage timers only (in worker processes that send their timings back with pop_stats())."""
+  global profiler
+  profiler = Profiler(profiler.name, enabled=enabled)
+
+def stage(name):
+  return profiler.stage(name)
+
+def count(n = 1):
+  profiler.count(n)
+
+def add_stats(stats):
+  profiler.add_stats(stats)
+
+def pop_stats():
+  return profiler.pop_stats()
+
+def is_enabled():
+  return profiler.enabled
+
+def finish():
+  return profiler.finish()
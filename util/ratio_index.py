@@ -0,0 +1,95 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Nearest-neighbour lookup of rendered object images by aspect ratio (optionally weighted by relative box size).
+Built from the object info generated with util/write_class_info.py."""
+
+import random
+import numpy as np
+
+# smallest box side taken into account (avoids division by zero for degenerated labels)
+MIN_SIDE = 1e-6
+
+def signed_aspect(w, h):
+  """Signed aspect ratio of a box: log(h/w), negative for wide and positive for tall boxes.
+  Unlike the h/w | -w/h ratio keys of the info file it is continuous around square boxes."""
+  return np.log(np.maximum(h, MIN_SIDE) / np.maximum(w, MIN_SIDE))
+
+class RatioIndex(object):
+  """Keeps one array per class sorted by signed aspect ratio (ties sorted by relative box size).
+  
+  Arguments:
+    obj_info {dict} -- object info ({class: {ratio: [entry, ...]}}) with entries containing 'width' and 'height'
+  """
+
+  def __init__(self, obj_info):
+    self.entries = {}
+    self.aspects = {}
+    self.sizes = {}
+    for c in obj_info:
+      entries = [e for ratio in obj_info[c] for e in obj_info[c][ratio]]
+      if not entries:
+        continue;
+      w = np.array([e['width'] for e in entries], dtype=np.float64)
+      h = np.array([e['height'] for e in entries], dtype=np.float64)
+      aspects = signed_aspect(w, h)
+      sizes = np.log(np.maximum(w*h, MIN_SIDE**2))
+      order = np.lexsort((sizes, aspects))
+      self.entries[c] = [entries[i] for i in order]
+      self.aspects[c] = aspects[order]
+      self.sizes[c] = sizes[order]
+
+  def __contains__(self, c):
+    return c in self.entries
+
+  def __len__(self):
+    return sum(len(e) for e in self.entries.values())
+
+  def nearest(self, c, w, h, k = 5, size_weight = 0):
+    """Indices of the k entries of class c closest to a box of width w and height h.
+    
+    Candidates are searched in a window of the sorted aspect array (O(log n + k)) and ranked by
+    |aspect difference| + size_weight * |log size difference|.
+    
+    Arguments:
+      c {str} -- class
+      w {float} -- relative width of the box
+      h {float} -- relative height of the box
+    
+    Keyword Arguments:
+      k {int} -- number of returned entries (default: {5})
+      size_weight {float} -- weight of the relative box size, 0 matches only by aspect ratio (default: {0}). Sizes are
+        relative to the image of the entry and to the image of the box, so they are only comparable if both have
+        similar sizes (e.g. renders and backgrounds of the same resolution)
+    
+    Returns:
+      indices {numpy.array} -- indices into self.entries[c], closest first
+    """
+    aspects = self.aspects[c]
+    target = signed_aspect(w, h)
+    pos = int(np.searchsorted(aspects, target))
+    ## k entries on each side contain the k closest by aspect; with size weighting the window is widened
+    ## and the result is approximate
+    window = k if size_weight == 0 else 2*k
+    lo = max(0, pos - window)
+    hi = min(len(aspects), pos + window)
+    dist = np.abs(aspects[lo:hi] - target)
+    if size_weight:
+      dist += size_weight * np.abs(self.sizes[c][lo:hi] - np.log(max(w*h, MIN_SIDE**2)))
+    return lo + np.argsort(dist, kind='stable')[:k]
+
+  def sample(self, c, w, h, k = 5, size_weight = 0, rng = random):
+    """Returns a random entry among the k nearest entries of class c (see nearest())."""
+    indices = self.nearest(c, w, h, k=k, size_weight=size_weight)
+    return self.entries[c][indices[rng.randint(0, len(indices)-1)]]
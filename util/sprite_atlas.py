@@ -0,0 +1,180 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Packs rendered object images (alpha-trimmed RGBA crops) and their labels into one memory-mapped atlas file.
+Reading sprites from the atlas needs no decoding and all processes using it share the same page cache.
+
+The atlas consists of two files:
+  <atlas> -- raw RGBA pixels of all crops, one after another
+  <atlas>.npz -- index with byte offsets, crop sizes, labels (relative to the crop) and image names
+"""
+
+import os
+import numpy as np
+from PIL import Image
+import argparse
+import multiprocessing
+import sys
+import profiling
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+import index_pass
+import output_layout
+
+parser = argparse.ArgumentParser(description='Pack object images and labels into a memory-mapped sprite atlas.')
+parser.add_argument('--input_path', '--i', action='store',
+                    default='../scenes/samples/train/rgba',
+                    help='Path to the object images.')
+parser.add_argument('--out_path', '--o', action='store',
+                    default='../scenes/samples/train/sprites.atlas',
+                    help='Output path for the atlas file.')
+parser.add_argument('--margin', action='store', type = int,
+                    default=1,
+                    help='Transparent border in pixels kept around the trimmed object.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=multiprocessing.cpu_count(),
+                    help='Number of processes decoding images.')
+profiling.add_arguments(parser)
+
+def trim_sprite(img_name, margin = 1):
+  """Decodes an object image and crops it to its alpha extent plus margin.
+  
+  Arguments:
+    img_name {str} -- Path to the object image (with a Yolo label file next to it).
+  
+  Keyword Arguments:
+    margin {int} -- border in pixels kept around the non transparent area (default: {1})
+  
+  Returns:
+    pixels {numpy.array} -- RGBA crop (uint8, height x width x 4) or None if the image has no single object label or is empty
+    label {tuple} -- (class, x, y, w, h) relative to the crop
+  """
+  with open(img_name[:-4] + '.txt', mode = "r") as img_label_file:
+    label = img_label_file.read().replace('\n','').split(' ')
+  if len(label) != 5:
+    return None, None
+  obj_class, c_x, c_y, w, h = map(float, label)
+
+  pixels = np.asarray(Image.open(img_name).convert('RGBA'))
+  height, width = pixels.shape[:2]
+  crop, extent = index_pass.trim(pixels, margin)
+  if extent is None:
+    return None, None
+  label = (obj_class,) + index_pass.crop_box((c_x, c_y, w, h), (width, height), extent)
+  return np.ascontiguousarray(crop), label
+
+def _trim(args):
+  return (args[0],) + trim_sprite(*args)
+
+def build_atlas(img_list, out_path, margin = 1, workers = 1):
+  """Writes the atlas for the given object images.
+  
+  Arguments:
+    img_list {list} -- Paths to the object images.
+    out_path {str} -- Path of the atlas file (the index is written to out_path + '.npz').
+  
+  Keyword Arguments:
+    margin {int} -- border in pixels kept around the non transparent area (default: {1})
+    workers {int} -- number of decoding processes (default: {1})
+  
+  Returns:
+    n {int} -- number of sprites in the atlas
+  """
+  offsets = []
+  shapes = []
+  labels = []
+  names = []
+  offset = 0
+  tasks = [(img_name, margin) for img_name in img_list]
+  pool = multiprocessing.Pool(workers) if workers > 1 else None
+  results = pool.imap(_trim, tasks, chunksize=64) if pool else map(_trim, tasks)
+  with open(out_path, 'wb') as f_atlas:
+    for img_name, pixels, label in results:
+      if pixels is None:
+        continue;
+      f_atlas.write(pixels.tobytes())
+      offsets.append(offset)
+      shapes.append(pixels.shape[:2])
+      labels.append(label)
+      names.append(os.path.basename(img_name))
+      offset += pixels.nbytes
+      if len(names) % 1000 == 0:
+        print(len(names), 'sprites packed.')
+  if pool:
+    pool.close()
+    pool.join()
+  np.savez(out_path + '.npz',
+           offsets=np.array(offsets, dtype=np.int64),
+           shapes=np.array(shapes, dtype=np.int32).reshape(-1, 2),
+           labels=np.array(labels, dtype=np.float64).reshape(-1, 5),
+           names=np.array(names, dtype=str))
+  return len(names)
+
+class SpriteAtlas(object):
+  """Read access to an atlas written by build_atlas(). Pixels are memory-mapped, nothing is copied until a sprite is resized.
+  Pickling only transfers the path, so the atlas can be handed to worker processes.
+  
+  Arguments:
+    path {str} -- Path of the atlas file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    index = np.load(path + '.npz')
+    self.offsets = index['offsets']
+    self.shapes = index['shapes']
+    self.labels = index['labels']
+    self.names = list(index['names'])
+    self._name_index = None
+    self.data = np.memmap(path, dtype=np.uint8, mode='r') if len(self.offsets) else np.zeros(0, np.uint8)
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def __getstate__(self):
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+  def pixels(self, i):
+    """RGBA pixels of sprite i (read-only view into the atlas, height x width x 4)."""
+    h, w = self.shapes[i]
+    start = self.offsets[i]
+    return self.data[start:start + h*w*4].reshape(h, w, 4)
+
+  def sprite(self, i):
+    """Returns sprite i as PIL.Image (sharing the atlas memory) and its label (class, x, y, w, h)."""
+    h, w = self.shapes[i]
+    img = Image.frombuffer('RGBA', (int(w), int(h)), self.pixels(i), 'raw', 'RGBA', 0, 1)
+    c, c_x, c_y, b_w, b_h = self.labels[i]
+    return img, (int(c), c_x, c_y, b_w, b_h)
+
+  def index_of(self, name):
+    """Index of the sprite created from the object image with the given file name."""
+    if self._name_index is None:
+      self._name_index = {n: i for i, n in enumerate(self.names)}
+    return self._name_index[name]
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('sprite_atlas', args)
+  img_list = output_layout.scan(args.input_path, ('.png',))
+  with profiling.stage('build'):
+    n = build_atlas(img_list, args.out_path, margin=args.margin, workers=args.workers)
+  profiling.count(n)
+  print(n, 'sprites written to', args.out_path)
+  profiling.finish()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,336 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Validates a folder of images with Yolo labels (a dataset or the output of any script in util/) and prints statistics.
+
+Reported issues (one line per issue in the issues file: kind, file, detail):
+  missing_label     -- image without label file (or without entry in the label store)
+  orphan_label      -- label file without image
+  malformed_label   -- line that isn't 'class x y w h'
+  non_finite        -- class or box value that is nan or infinite (left out of the statistics)
+  out_of_range      -- box centre or edge outside [0,1]
+  zero_size         -- box with width or height <= 0
+  unknown_class     -- class id not in --classes
+  unreadable_image  -- image header (or image with --decode) can't be read
+
+The folder is scanned in batches that are checked by a pool of processes, only image headers are read and the boxes
+of a batch are checked at once with numpy. Statistics are fixed-bin histograms, so memory stays bounded for any
+number of samples: objects per class, objects per image, relative box area and box aspect ratio (in pixels)."""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque, Counter
+import numpy as np
+from PIL import Image
+import profiling
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore
+import output_layout
+
+parser = argparse.ArgumentParser(description='Validate images and Yolo labels of a dataset folder and print statistics.')
+parser.add_argument('--input_path', '--i', action='store',
+                    default='../scenes/samples/train/rgba',
+                    help='Path to the images and label files.')
+parser.add_argument('--label_store', action='store',
+                    default=None,
+                    help='Check the labels of a label store (see blender_addon/label_store.py) instead of the .txt files in input_path.')
+parser.add_argument('--classes', '--c', nargs='+', default=None, type = int,
+                    help='Valid class ids (default: every class is valid).')
+parser.add_argument('--recursive', '--r', action='store_true', default=False,
+                    help='Include subfolders of input_path.')
+parser.add_argument('--decode', action='store_true', default=False,
+                    help='Decode every image completely instead of reading its header only.')
+parser.add_argument('--tolerance', action='store', type = float,
+                    default=1e-3,
+                    help='Allowed overshoot of box edges over the image border (relative).')
+parser.add_argument('--issues_path', action='store',
+                    default=None,
+                    help='Write all issues (tab separated: kind, file, detail) to this file.')
+parser.add_argument('--report_path', action='store',
+                    default=None,
+                    help='Write the statistics to this json file.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=multiprocessing.cpu_count(),
+                    help='Number of processes.')
+parser.add_argument('--batch_size', action='store', type = int,
+                    default=2048,
+                    help='Number of directory entries checked per task.')
+profiling.add_arguments(parser)
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+# histogram bins: log10 of the relative box area, log2 of the box aspect ratio (width/height in pixels)
+AREA_BINS = np.linspace(-6, 0, 25)
+ASPECT_BINS = np.linspace(-4, 4, 33)
+MAX_OBJECTS = 64
+SHOWN_ISSUES = 20
+
+def scan_batches(input_path, batch_size, recursive = False):
+  """Yields lists of at most batch_size image and label file paths (relative to input_path) while scanning the folder."""
+  batch = []
+  folders = ['']
+  while folders:
+    folder = folders.pop()
+    with os.scandir(os.path.join(input_path, folder)) as it:
+      for entry in it:
+        if entry.is_dir():
+          if recursive:
+            folders.append(os.path.join(folder, entry.name))
+        elif entry.name.lower().endswith(IMAGE_EXTS + ('.txt',)):
+          batch.append(os.path.join(folder, entry.name))
+          if len(batch) == batch_size:
+            yield batch
+            batch = []
+  if batch:
+    yield batch
+
+def parse_label_text(text):
+  """Parses a Yolo label file. Returns the rows as array (n x 5) and the numbers of malformed lines."""
+  rows = []
+  malformed = []
+  for n, line in enumerate(text.split('\n')):
+    params = line.split()
+    if not params:
+      continue
+    try:
+      if len(params) != 5:
+        raise ValueError
+      rows.append([float(p) for p in params])
+    except ValueError:
+      malformed.append(n+1)
+  return np.array(rows, dtype=np.float64).reshape(-1, 5), malformed
+
+def check_boxes(rows, classes = None, tolerance = 1e-3):
+  """Vectorized checks of label rows (n x 5: class, x, y, w, h). Returns boolean masks (non_finite, out_of_range, zero_size,
+  unknown_class), a row with a non finite value has no other issue."""
+  finite = np.isfinite(rows).all(axis=1)
+  c, x, y, w, h = np.where(finite[:,None], rows, 0).T
+  out_of_range = ((x < 0) | (x > 1) | (y < 0) | (y > 1) |
+                  (x - w/2 < -tolerance) | (x + w/2 > 1 + tolerance) |
+                  (y - h/2 < -tolerance) | (y + h/2 > 1 + tolerance))
+  zero_size = (w <= 0) | (h <= 0)
+  if classes is None:
+    unknown_class = np.zeros(len(rows), dtype=bool)
+  else:
+    unknown_class = ~np.isin(c, classes) | (c != np.round(c))
+  return ~finite, out_of_range & finite, zero_size & finite, unknown_class & finite
+
+def image_size(path, decode = False):
+  """(width, height) of an image read from its header (or decoded completely). Raises on unreadable images."""
+  with Image.open(path) as img:
+    if decode:
+      img.load()
+    return img.size
+
+def _label_source(store_path, _cache = {}):
+  ## one store per worker process (only the path is pickled), its names are never read by the workers
+  if store_path is None:
+    return None
+  if store_path not in _cache:
+    _cache[store_path] = LabelStore(store_path)
+  return _cache[store_path]
+
+def store_indices(store, batch):
+  """Store index of every file of a batch (by its name without extension), -1 for label files and missing names."""
+  indices = []
+  for name in batch:
+    base, ext = os.path.splitext(name)
+    try:
+      indices.append(-1 if ext == '.txt' else store.index_of(os.path.basename(base)))
+    except KeyError:
+      indices.append(-1)
+  return indices
+
+def check_batch(input_path, batch, store_path = None, indices = None, classes = None, tolerance = 1e-3, decode = False):
+  """Checks the images and label files of a batch. Returns a dict of partial statistics, the issues and
+  (with a label store) the store indices of the checked images. indices are the store indices of the batch
+  (see store_indices), looked up by the caller, so the names of the store are only read once."""
+  store = _label_source(store_path)
+  issues = []
+  names = []
+  sizes = []
+  label_rows = []
+  n_images = 0
+  if store is not None and indices is None:
+    indices = store_indices(store, batch)
+  for k, name in enumerate(batch):
+    base, ext = os.path.splitext(name)
+    path = os.path.join(input_path, name)
+    if ext == '.txt':
+      if store is None and not any(os.path.exists(os.path.join(input_path, base + e)) for e in IMAGE_EXTS + tuple(e.upper() for e in IMAGE_EXTS)):
+        issues.append(('orphan_label', name, ''))
+      continue
+    n_images += 1
+    try:
+      size = image_size(path, decode)
+    except Exception as e:
+      issues.append(('unreadable_image', name, str(e).replace('\t', ' ')))
+      size = (0, 0)
+    if store is not None:
+      i = indices[k]
+      if i < 0:
+        issues.append(('missing_label', name, ''))
+        continue
+      rows = store.labels(i)
+      names.append((name, i))
+    else:
+      try:
+        with open(os.path.join(input_path, base + '.txt')) as label_file:
+          rows, malformed = parse_label_text(label_file.read())
+      except FileNotFoundError:
+        issues.append(('missing_label', name, ''))
+        continue
+      for line in malformed:
+        issues.append(('malformed_label', base + '.txt', 'line {}'.format(line)))
+      names.append((name, -1))
+    sizes.append(size)
+    label_rows.append(rows)
+
+  n_objects = np.array([len(rows) for rows in label_rows], dtype=np.int64)
+  rows = np.concatenate(label_rows) if label_rows else np.zeros((0, 5))
+  row_image = np.repeat(np.arange(len(label_rows)), n_objects)
+  non_finite, out_of_range, zero_size, unknown_class = check_boxes(rows, classes, tolerance)
+  for kind, mask in (('non_finite', non_finite), ('out_of_range', out_of_range), ('zero_size', zero_size),
+                     ('unknown_class', unknown_class)):
+    for r in np.nonzero(mask)[0]:
+      issues.append((kind, names[row_image[r]][0], ' '.join('{:g}'.format(v) for v in rows[r])))
+
+  valid = ~zero_size & ~non_finite
+  sizes = np.array(sizes, dtype=np.float64).reshape(-1, 2)
+  pixel_w = rows[valid, 3] * sizes[row_image[valid], 0]
+  pixel_h = rows[valid, 4] * sizes[row_image[valid], 1]
+  has_size = (pixel_w > 0) & (pixel_h > 0)
+  return {
+    'images': n_images,
+    'objects': int(len(rows)),
+    'classes': Counter(rows[~non_finite, 0].astype(np.int64).tolist()),
+    'objects_per_image': np.bincount(np.minimum(n_objects, MAX_OBJECTS), minlength=MAX_OBJECTS+1),
+    'area': np.histogram(np.log10(np.clip(rows[valid, 3] * rows[valid, 4], 1e-12, None)), AREA_BINS)[0],
+    'aspect': np.histogram(np.log2(pixel_w[has_size] / pixel_h[has_size]), ASPECT_BINS)[0],
+    'issues': issues,
+    'store_indices': [i for _, i in names if i >= 0],
+  }
+
+def _check_batch(args):
+  return check_batch(*args)
+
+class Statistics(object):
+  """Sums the partial statistics of check_batch()."""
+
+  def __init__(self):
+    self.images = 0
+    self.objects = 0
+    self.classes = Counter()
+    self.objects_per_image = np.zeros(MAX_OBJECTS+1, dtype=np.int64)
+    self.area = np.zeros(len(AREA_BINS)-1, dtype=np.int64)
+    self.aspect = np.zeros(len(ASPECT_BINS)-1, dtype=np.int64)
+    self.issues = Counter()
+
+  def add(self, result):
+    self.images += result['images']
+    self.objects += result['objects']
+    self.classes.update(result['classes'])
+    self.objects_per_image += result['objects_per_image']
+    self.area += result['area']
+    self.aspect += result['aspect']
+    self.issues.update(kind for kind, _, _ in result['issues'])
+
+  def to_dict(self):
+    return {'images': self.images, 'objects': self.objects,
+            'classes': {str(c): n for c, n in sorted(self.classes.items())},
+            'objects_per_image': self.objects_per_image.tolist(),
+            'area_log10_bins': AREA_BINS.tolist(), 'area': self.area.tolist(),
+            'aspect_log2_bins': ASPECT_BINS.tolist(), 'aspect': self.aspect.tolist(),
+            'issues': dict(self.issues)}
+
+def _print_histogram(title, bins, counts, fmt):
+  print(title)
+  total = max(counts.sum(), 1)
+  for lo, hi, n in zip(bins[:-1], bins[1:], counts):
+    if n:
+      print('  {:>17s} {:10d} {}'.format('{}..{}'.format(fmt(lo), fmt(hi)), n, '#' * int(round(50 * n / total))))
+
+def print_statistics(stats):
+  print('{} images, {} objects'.format(stats.images, stats.objects))
+  print('Objects per class:')
+  for c, n in sorted(stats.classes.items()):
+    print('  class {:4d}: {:10d}'.format(c, n))
+  n_per_image = np.nonzero(stats.objects_per_image)[0]
+  print('Objects per image: ' + '; '.join('{}{}: {}'.format(n, '+' if n == MAX_OBJECTS else '', stats.objects_per_image[n]) for n in n_per_image))
+  _print_histogram('Relative box area:', AREA_BINS, stats.area, lambda v: '{:.0e}'.format(10**v))
+  _print_histogram('Box aspect ratio (width/height in pixels):', ASPECT_BINS, stats.aspect, lambda v: '{:.2f}'.format(2**v))
+  if stats.issues:
+    print('Issues: ' + '; '.join('{}: {}'.format(kind, n) for kind, n in sorted(stats.issues.items())))
+  else:
+    print('No issues found.')
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('validate_dataset', args)
+  stats = Statistics()
+  issues_file = open(args.issues_path, 'w') if args.issues_path else None
+  store = LabelStore(args.label_store) if args.label_store else None
+  store_seen = np.zeros(len(store), dtype=bool) if store is not None else None
+  shown = 0
+  start = time.time()
+
+  def add(result):
+    nonlocal shown
+    stats.add(result)
+    profiling.count(result['images'])
+    if store_seen is not None:
+      store_seen[result['store_indices']] = True
+    for issue in result['issues']:
+      if issues_file:
+        issues_file.write('\t'.join(issue) + '\n')
+      if shown < SHOWN_ISSUES:
+        print(*issue)
+        shown += 1
+
+  ## at most a few batches per worker in flight, the folder is scanned while checking
+  pool = multiprocessing.Pool(args.workers)
+  pending = deque()
+  ## the subfolders of a ranged or hashed layout are always included
+  recursive = args.recursive or output_layout.Layout.load(args.input_path).levels > 0
+  for batch in scan_batches(args.input_path, args.batch_size, recursive):
+    indices = store_indices(store, batch) if store is not None else None
+    pending.append(pool.apply_async(_check_batch, ((args.input_path, batch, args.label_store, indices, args.classes, args.tolerance, args.decode),)))
+    while len(pending) >= 4 * args.workers or (pending and pending[0].ready()):
+      add(pending.popleft().get())
+  while pending:
+    add(pending.popleft().get())
+  pool.close()
+  pool.join()
+
+  if store_seen is not None:
+    for i in np.nonzero(~store_seen)[0]:
+      add({'images': 0, 'objects': 0, 'classes': Counter(), 'objects_per_image': 0, 'area': 0, 'aspect': 0,
+           'issues': [('orphan_label', store.names[i], 'label store entry without image')], 'store_indices': []})
+  if issues_file:
+    issues_file.close()
+
+  duration = time.time() - start
+  print_statistics(stats)
+  print('{} images checked in {:.1f}s ({:.0f} images/s)'.format(stats.images, duration, stats.images / max(duration, 1e-9)))
+  if args.report_path:
+    with open(args.report_path, 'w') as f_report:
+      json.dump(stats.to_dict(), f_report, indent=2)
+  profiling.finish()
+  return 1 if stats.issues else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -12,12 +12,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Creates a json info file containing classes and aspect-ratios of rendered object-images."""
+"""Creates a json info file containing classes and aspect-ratios of rendered object-images.
 
-import os, glob
+Labels are kept in a SQLite index keyed by image name together with the modification time and size of the label file,
+so a rerun only parses label files that were added or changed since the last run (in a thread pool)."""
+
+import os
 import numpy as np
 import argparse
 import json
+import sqlite3
+import profiling
+from concurrent.futures import ThreadPoolExecutor
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore
+import output_layout
 
 parser = argparse.ArgumentParser(description='Write a class_info file with image names for each class and ratio.')
 parser.add_argument('--input_path', '--i', action='store',
@@ -26,38 +36,141 @@ parser.add_argument('--input_path', '--i', action='store',
 parser.add_argument('--out_path', '--o', action='store',
                     default='../scenes/samples/train/obj_info.json',
                     help='Output path for the object info json file.')
+parser.add_argument('--index_path', action='store',
+                    default=None,
+                    help='Path to the persistent label index (default: out_path with .sqlite extension).')
+parser.add_argument('--label_store', action='store',
+                    default=None,
+                    help='Read the labels from a label store (see blender_addon/label_store.py) instead of the .txt files in input_path.')
+parser.add_argument('--workers', '--w', action='store', type = int,
+                    default=16,
+                    help='Number of threads reading label files.')
+profiling.add_arguments(parser)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+  img TEXT PRIMARY KEY,
+  mtime INTEGER,
+  size INTEGER,
+  class INTEGER,
+  center_x REAL,
+  center_y REAL,
+  width REAL,
+  height REAL,
+  ratio REAL
+);
+CREATE INDEX IF NOT EXISTS labels_class_ratio ON labels (class, ratio);
+"""
+
+def scan_labels(input_path):
+  """Returns {image name: (mtime_ns, size)} of the label files of all png images in input_path (in any layout, see output_layout.py)."""
+  names = set()
+  stats = {}
+  for entry in output_layout.entries(input_path):
+    if entry.name.endswith('.png'):
+      names.add(entry.name[:-4])
+    elif entry.name.endswith('.txt'):
+      st = entry.stat()
+      stats[entry.name[:-4]] = (st.st_mtime_ns, st.st_size)
+  return {name + '.png': stats[name] for name in names if name in stats}
+
+def parse_label(label_path):
+  """Reads a single object label file. Returns (class, x_c, y_c, w, h, ratio) or None for empty or invalid labels
+  and label files deleted since they were scanned. Zero sizes aren't divided by (like in class_info_from_store)."""
+  try:
+    with open(label_path, mode = "r") as img_label_file:
+      label = img_label_file.read().split()
+  except FileNotFoundError:
+    return None
+  if len(label) != 5:
+    return None
+  obj_class, x_c, y_c, w, h = map(float, label)
+  if w >= h:
+    ratio = h/(w or 1)
+  else:
+    ratio = -w/(h or 1)
+  return int(obj_class), x_c, y_c, w, h, ratio
 
-args = parser.parse_args()
-
-img_list = sorted(glob.glob(args.input_path + "/*.png"))
-
-info = {}
-
-for img_name in img_list:
-  img_label_file = open(img_name[:-4] + '.txt', mode = "r")
-  label = img_label_file.read()
-  if label:
-    obj_class, x_c, y_c, w, h = map(float, label.split(' '))
-    obj_class = int(obj_class)
-    if w >= h:
-      ratio = h/w
-    else:
-      ratio = -w/h
-    if obj_class in info:
-      if round(ratio,1) in info[obj_class]:
-        info[obj_class][round(ratio,1)].append({'img': img_name.split('/')[-1], 'center_x': x_c, 'center_y': y_c, 'width': w, 'height': h})
-      else:
-        info[obj_class][round(ratio,1)] = [{'img': img_name.split('/')[-1], 'center_x': x_c, 'center_y': y_c, 'width': w, 'height': h}]
-    else:
-      info[obj_class] = {round(ratio,1): [{'img': img_name.split('/')[-1], 'center_x': x_c, 'center_y': y_c, 'width': w, 'height': h}]}
-    img_label_file.close()
-
-for k in info:
-  ratios = 'ratios: '
-  for l in sorted(info[k]):
-    ratios += '{}: {}; '.format(l,len(info[k][l]))
-  print('class {} {}'.format(k,ratios))
+def update_index(db, input_path, workers = 16):
+  """Brings the index up to date with the label files in input_path.
   
+  Arguments:
+    db {sqlite3.Connection} -- index database
+    input_path {str} -- Path to the object images.
+  
+  Keyword Arguments:
+    workers {int} -- number of threads reading label files (default: {16})
+  
+  Returns:
+    changed {int} -- number of parsed label files
+    removed {int} -- number of images removed from the index
+  """
+  db.executescript(SCHEMA)
+  with profiling.stage('scan'):
+    on_disk = scan_labels(input_path)
+  indexed = {img: (mtime, size) for img, mtime, size in db.execute('SELECT img, mtime, size FROM labels')}
+  changed = [img for img, stat in on_disk.items() if indexed.get(img) != stat]
+  removed = [img for img in indexed if img not in on_disk]
+
+  layout = output_layout.Layout.load(input_path)
+  with profiling.stage('parse'), ThreadPoolExecutor(max_workers=workers) as executor:
+    labels = executor.map(parse_label, [layout.path(input_path, img[:-4], '.txt') for img in changed], chunksize=256)
+    rows = []
+    for img, label in zip(changed, labels):
+      rows.append((img,) + on_disk[img] + (label if label else (None,)*6))
+  profiling.count(len(changed))
+  with profiling.stage('store'), db:
+    db.executemany('INSERT OR REPLACE INTO labels VALUES (?,?,?,?,?,?,?,?,?)', rows)
+    db.executemany('DELETE FROM labels WHERE img = ?', [(img,) for img in removed])
+  return len(changed), len(removed)
+
+def class_info(db):
+  """Builds the object info ({class: {ratio rounded to .1: [entry, ...]}}) from the index."""
+  info = {}
+  query = 'SELECT img, class, center_x, center_y, width, height, ratio FROM labels WHERE class IS NOT NULL ORDER BY img'
+  for img, obj_class, x_c, y_c, w, h, ratio in db.execute(query):
+    entry = {'img': img, 'center_x': x_c, 'center_y': y_c, 'width': w, 'height': h}
+    info.setdefault(obj_class, {}).setdefault(round(ratio,1), []).append(entry)
+  return info
+
+def class_info_from_store(store):
+  """Builds the object info from a label store (images with exactly one object, sorted by name)."""
+  n_objects = np.diff(store.offsets)
+  single = np.where(n_objects == 1)[0]
+  rows = store.offsets[single]
+  w = np.asarray(store.w[rows])
+  h = np.asarray(store.h[rows])
+  ratios = np.where(w >= h, h/np.where(w == 0, 1, w), -w/np.where(h == 0, 1, h))
+  info = {}
+  for i in sorted(range(len(single)), key=lambda i: store.names[single[i]]):
+    entry = {'img': store.names[single[i]] + '.png', 'center_x': float(store.cx[rows[i]]), 'center_y': float(store.cy[rows[i]]),
+             'width': float(w[i]), 'height': float(h[i])}
+    info.setdefault(int(store.classes[rows[i]]), {}).setdefault(round(float(ratios[i]),1), []).append(entry)
+  return info
+
+def main():
+  args = parser.parse_args()
+  profiling.setup('write_class_info', args)
+
+  if args.label_store:
+    info = class_info_from_store(LabelStore(args.label_store))
+  else:
+    index_path = args.index_path or os.path.splitext(args.out_path)[0] + '.sqlite'
+    db = sqlite3.connect(index_path)
+    changed, removed = update_index(db, args.input_path, workers=args.workers)
+    print('{} label files parsed, {} removed from the index.'.format(changed, removed))
+    info = class_info(db)
+    db.close()
+
+  for k in info:
+    ratios = 'ratios: '
+    for l in sorted(info[k]):
+      ratios += '{}: {}; '.format(l,len(info[k][l]))
+    print('class {} {}'.format(k,ratios))
+
+  with profiling.stage('write'), open(args.out_path, 'w') as outfile:
+      json.dump(info, outfile)
+  profiling.finish()
 
-with open(args.out_path, 'w') as outfile:
-    json.dump(info, outfile)
+if __name__ == "__main__":
+  main()
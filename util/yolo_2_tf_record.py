@@ -21,15 +21,26 @@ Assumes train and/or val folder inside input folder with images and Yolo label f
 Example usage:
     ./yolo_2_tf_record --data_dir=/home/user/images \
         --output_dir=/home/user/images/output
+
+    # 16 shards per split written by 8 processes
+    ./yolo_2_tf_record --data_dir=/home/user/images \
+        --output_dir=/home/user/images/output --num_shards=16 --workers=8
+
+    # only convert images added or changed since the last incremental run
+    ./yolo_2_tf_record --data_dir=/home/user/images \
+        --output_dir=/home/user/images/output --incremental
 """
 
 import hashlib
 import io
+import json
 import logging
+import multiprocessing
 import os
-import glob
 import random
 import re
+import sys
+import time
 
 from lxml import etree
 import PIL.Image
@@ -38,24 +49,42 @@ import tensorflow as tf
 from object_detection.utils import dataset_util
 from object_detection.utils import label_map_util
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender_addon'))
+from label_store import LabelStore, format_labels
+import output_layout
+from yolo_example import example_fields
+import profiling
+
 flags = tf.app.flags
 flags.DEFINE_string('data_dir', '../openImages', 'Root directory to raw dataset.')
 flags.DEFINE_string('output_dir', '../openImages', 'Path to directory to output TFRecords.')
 flags.DEFINE_string('label_map_path', '../openImages/label_map.pbtxt',
                     'Path to label map proto')
+flags.DEFINE_integer('num_shards', 1, 'Number of TFRecord files per split.')
+flags.DEFINE_integer('workers', 1, 'Number of processes writing shards.')
+flags.DEFINE_string('label_store', None,
+                    'Directory with one label store per split (train, val; see '
+                    'blender_addon/label_store.py) used instead of the .txt label files.')
+flags.DEFINE_boolean('incremental', False,
+                     'Keep a manifest of converted examples next to the output and only '
+                     'write new or changed examples into additional shards.')
 FLAGS = flags.FLAGS
 
 
-def txt_to_tf_example(txt, img_path, label_map_dict):
+def txt_to_tf_example(txt, img_path, label_map_dict, label_id_dict=None):
   """Convert XML derived dict to tf.Example proto.
 
   Notice that this function normalizes the bounding box coordinates provided
   by the raw data.
 
   Args:
+    txt: content of the Yolo label file or a list of label rows
+      (class, x, y, w, h) read from a label store.
     data: dict holding PASCAL XML fields for a single image (obtained by
       running dataset_util.recursive_parse_xml_to_dict)
     label_map_dict: A map from string label names to integers ids.
+    label_id_dict: The reversed label map (integer ids to string label names),
+      built from label_map_dict if not given.
     image_subdirectory: String specifying subdirectory within the
       Pascal dataset directory holding the actual image data.
     ignore_difficult_instances: Whether to skip difficult instances in the
@@ -72,43 +101,23 @@ def txt_to_tf_example(txt, img_path, label_map_dict):
   _, filename = os.path.split(img_path)
   with tf.gfile.GFile(img_path, 'rb') as fid:
     encoded_jpg = fid.read()
-  encoded_jpg_io = io.BytesIO(encoded_jpg)
-  image = PIL.Image.open(encoded_jpg_io)
-  if image.format != 'JPEG':
+  if label_id_dict is None:
+    label_id_dict = {idx: name for name, idx in label_map_dict.items()}
+  fields = example_fields(txt, encoded_jpg, label_id_dict)
+  if fields['format'] != 'JPEG':
     raise ValueError('Image {} format not JPEG'.format(img_path))
-  key = hashlib.sha256(encoded_jpg).hexdigest()
-
-  width = int(image.size[0])
-  height = int(image.size[1])
-
-  xmin = []
-  ymin = []
-  xmax = []
-  ymax = []
-  classes = []
-  classes_text = []
-  truncated = []
-  poses = []
-  difficult_obj = []
-  for obj in txt.split('\n'):
-    if obj == '':
-      continue
-    difficult_obj.append(0)
-    obj_data = obj.split(' ')
-
-    xmin.append(float(obj_data[1])-float(obj_data[3])/2)
-    ymin.append(float(obj_data[2])-float(obj_data[4])/2)
-    xmax.append(float(obj_data[1])+float(obj_data[3])/2)
-    ymax.append(float(obj_data[2])+float(obj_data[4])/2)
-    # class_name = get_class_name_from_filename(data['filename'])
-    # classes_text.append(class_name.encode('utf8'))
-    # classes.append(label_map_dict[class_name])
-    for name, idx in label_map_dict.items():
-      if idx == int(obj_data[0]):
-        classes_text.append(name.encode('utf8'))
-    classes.append(int(obj_data[0]))
-    truncated.append(0)
-    poses.append('Frontal'.encode('utf8'))
+  width = fields['width']
+  height = fields['height']
+  key = fields['key']
+  xmin = fields['xmin']
+  ymin = fields['ymin']
+  xmax = fields['xmax']
+  ymax = fields['ymax']
+  classes = fields['classes']
+  classes_text = fields['classes_text']
+  difficult_obj = [0] * len(classes)
+  truncated = [0] * len(classes)
+  poses = ['Frontal'.encode('utf8')] * len(classes)
 
   example = tf.train.Example(features=tf.train.Features(feature={
       'image/height': dataset_util.int64_feature(height),
@@ -133,39 +142,242 @@ def txt_to_tf_example(txt, img_path, label_map_dict):
   return example
 
 
-def create_tf_record(output_filename,
-                     label_map_dict,
-                     image_dir):
-  """Creates a TFRecord file from examples.
+def shard_filenames(output_filename, num_shards):
+  """Output file names of all shards (the plain output_filename for a single shard)."""
+  if num_shards == 1:
+    return [output_filename]
+  return ['{}-{:05d}-of-{:05d}'.format(output_filename, i, num_shards)
+          for i in range(num_shards)]
+
+
+def read_label(example, image_dir, label_store=None):
+  """Labels of an example: the content of its .txt file, its rows in the
+  label store or None if there are no labels."""
+  name = os.path.split(example)[1].split('.')[0]
+  if label_store is not None:
+    if name not in label_store:
+      return None
+    return label_store.rows(label_store.index_of(name))
+  txt_file = os.path.splitext(example)[0] + '.txt'
+  if not os.path.exists(txt_file):
+    return None
+  with tf.gfile.GFile(txt_file, 'r') as fid:
+    return fid.read()
+
+
+def write_shard(shard_filename, examples, label_map_dict, image_dir, label_store_path=None):
+  """Writes the given examples to one TFRecord file.
 
   Args:
-    output_filename: Path to where output file is saved.
+    shard_filename: Path to where the shard is saved.
+    examples: Image paths of the examples in this shard.
     label_map_dict: The label map dictionary.
-    annotations_dir: Directory where annotation files are stored.
-    image_dir: Directory where image files are stored.
-    examples: Examples to parse and save to tf record.
+    image_dir: Directory where image and label files are stored.
+    label_store_path: Label store used instead of the label files.
+
+  Returns:
+    The manifest entries (see file_state) of the written examples by image
+    path.
   """
-  writer = tf.python_io.TFRecordWriter(output_filename)
-  examples = glob.glob(os.path.join(image_dir, '*.jpg'))+glob.glob(os.path.join(image_dir, '*.png'))
+  label_id_dict = {idx: name for name, idx in label_map_dict.items()}
+  label_store = LabelStore(label_store_path) if label_store_path else None
+  writer = tf.python_io.TFRecordWriter(shard_filename)
+  states = {}
   for idx, example in enumerate(examples):
     if idx % 100 == 0:
-      print('On image {} of {}'.format(idx, len(examples)))
-      logging.info('On image %d of %d', idx, len(examples))
-    txt_file = os.path.join(image_dir, os.path.split(example)[1].split('.')[0] + '.txt')
-
-    if not os.path.exists(txt_file):
-      logging.warning('Could not find %s, ignoring example.', txt_file)
+      logging.info('%s: on image %d of %d', shard_filename, idx, len(examples))
+    labels = read_label(example, image_dir, label_store)
+    if labels is None:
+      logging.warning('Could not find labels of %s, ignoring example.', example)
       continue
-    with tf.gfile.GFile(txt_file, 'r') as fid:
-      yolo_str = fid.read()
 
-    tf_example = txt_to_tf_example(yolo_str, example, label_map_dict)
+    # stats before reading, a file changed meanwhile is converted again next run
+    state = file_state(example, labels)
+    tf_example = txt_to_tf_example(labels, example, label_map_dict, label_id_dict)
+    # the sha256 of the image computed for the example
+    state['sha256'] = tf_example.features.feature['image/key/sha256'].bytes_list.value[0].decode('utf8')
     writer.write(tf_example.SerializeToString())
+    states[example] = state
 
   writer.close()
+  return states
+
+
+def _write_shard(args):
+  return write_shard(*args)
+
+
+def _write_shards(tasks, workers):
+  """Runs write_shard for all tasks and returns the manifest entries of
+  all written examples."""
+  states = {}
+  if workers > 1 and len(tasks) > 1:
+    # spawn, since forking a process with an initialized tensorflow is unsafe
+    pool = multiprocessing.get_context('spawn').Pool(min(workers, len(tasks)))
+    for shard_states in pool.imap_unordered(_write_shard, tasks):
+      states.update(shard_states)
+    pool.close()
+    pool.join()
+  else:
+    for shard_states in map(_write_shard, tasks):
+      states.update(shard_states)
+  return states
+
+
+def file_state(example, labels):
+  """Manifest entry of an example without reading the image: its file
+  stats and the sha256 of its labels (the sha256 of the image is added by
+  write_shard, which reads the image anyway).
+
+  Args:
+    example: Path to the image.
+    labels: Labels of the example as returned by read_label.
+
+  Returns:
+    A dict with image file stats and sha256 of the labels.
+  """
+  if not isinstance(labels, str):
+    labels = format_labels(labels)
+  label_sha256 = hashlib.sha256(labels.encode('utf8')).hexdigest()
+  img_stat = os.stat(example)
+  return {'stat': [img_stat.st_mtime_ns, img_stat.st_size], 'label_sha256': label_sha256}
+
+
+def update_tf_record(output_filename, label_map_dict, image_dir, examples,
+                     num_shards=1, workers=1, label_store_path=None):
+  """Converts only examples that are new or changed since the last run.
+
+  The manifest (output_filename + '.manifest.json') maps every shard to its
+  examples and every example to its file stats and sha256 (as computed while
+  converting it). An example counts as changed if its file stats or its
+  labels differ, only labels are read to find out. New examples are written into
+  additional shards. Shards holding changed or deleted examples are rewritten
+  (as new shards) and the old files removed. The current shard list is
+  written to output_filename + '.shards', one path per line.
+
+  Args:
+    output_filename: Path prefix of the shards.
+    label_map_dict: The label map dictionary.
+    image_dir: Directory where image and label files are stored.
+    examples: Image paths of all current examples.
+    num_shards: Maximum number of shards written in this run.
+    workers: Number of processes writing shards in parallel.
+    label_store_path: Label store used instead of the label files.
+
+  Returns:
+    The list of all current shard files and the number of written examples.
+  """
+  manifest_path = output_filename + '.manifest.json'
+  manifest = {'generation': 0, 'shards': {}, 'examples': {}}
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as fid:
+      manifest = json.load(fid)
+
+  known = manifest['examples']
+  label_store = LabelStore(label_store_path) if label_store_path else None
+  current = {}
+  for example in examples:
+    labels = read_label(example, image_dir, label_store)
+    if labels is not None:
+      current[example] = file_state(example, labels)
+
+  def unchanged(example):
+    return (example in current and example in known and
+            current[example]['stat'] == known[example]['stat'] and
+            current[example]['label_sha256'] == known[example]['label_sha256'])
+
+  shards = manifest['shards']
+  dirty = [shard for shard, shard_examples in shards.items()
+           if not all(unchanged(e) for e in shard_examples)]
+  in_clean_shards = set(e for shard, shard_examples in shards.items()
+                        if shard not in dirty for e in shard_examples)
+  to_write = sorted(e for e in current if e not in in_clean_shards)
+
+  states = {}
+  if to_write:
+    generation = manifest['generation']
+    n = min(num_shards, len(to_write))
+    filenames = ['{}-{:04d}-{:05d}-of-{:05d}'.format(output_filename, generation, i, n)
+                 for i in range(n)]
+    tasks = [(filename, to_write[i::n], label_map_dict, image_dir, label_store_path)
+             for i, filename in enumerate(filenames)]
+    states = _write_shards(tasks, workers)
+    for shard in dirty:
+      del shards[shard]
+      if os.path.exists(shard):
+        os.remove(shard)
+    # the examples actually written (labels may have vanished meanwhile)
+    for filename, shard_examples, _, _, _ in tasks:
+      written = [e for e in shard_examples if e in states]
+      if written:
+        shards[filename] = written
+      elif os.path.exists(filename):
+        os.remove(filename)
+    manifest['generation'] = generation + 1
+  elif dirty:
+    # only deletions: shards without any remaining example
+    for shard in dirty:
+      if not any(e in current for e in shards[shard]):
+        del shards[shard]
+        if os.path.exists(shard):
+          os.remove(shard)
+  # entries of unchanged examples are kept, the others come from write_shard
+  manifest['examples'] = {e: states[e] if e in states else known[e]
+                          for shard_examples in shards.values()
+                          for e in shard_examples if e in states or unchanged(e)}
+
+  with open(manifest_path + '.tmp', 'w') as fid:
+    json.dump(manifest, fid)
+  os.replace(manifest_path + '.tmp', manifest_path)
+  with open(output_filename + '.shards', 'w') as fid:
+    fid.write(''.join(shard + '\n' for shard in sorted(shards)))
+  return sorted(shards), len(states)
+
+
+def create_tf_record(output_filename,
+                     label_map_dict,
+                     image_dir,
+                     num_shards=1,
+                     workers=1,
+                     incremental=False,
+                     label_store_path=None):
+  """Creates TFRecord files from examples.
+
+  Args:
+    output_filename: Path to where output file is saved (shards get the
+      suffix -XXXXX-of-YYYYY).
+    label_map_dict: The label map dictionary.
+    image_dir: Directory where image files are stored.
+    num_shards: Number of TFRecord files the examples are distributed over.
+    workers: Number of processes writing shards in parallel.
+    incremental: Only write new or changed examples (see update_tf_record).
+    label_store_path: Label store used instead of the label files.
+
+  Returns:
+    The list of current shard files.
+  """
+  examples = output_layout.scan(image_dir, ('.jpg', '.png'))
+
+  start = time.time()
+  with profiling.stage('write'):
+    if incremental:
+      filenames, written = update_tf_record(output_filename, label_map_dict, image_dir,
+                                            examples, num_shards, workers, label_store_path)
+    else:
+      filenames = shard_filenames(output_filename, num_shards)
+      tasks = [(filename, examples[i::num_shards], label_map_dict, image_dir, label_store_path)
+               for i, filename in enumerate(filenames)]
+      written = len(_write_shards(tasks, workers))
+  profiling.count(written)
+  duration = time.time() - start
+  print('{}: {} examples written, {} shard(s), {:.1f} examples/s'.format(
+      output_filename, written, len(filenames), written / max(duration, 1e-9)))
+  return filenames
 
 
 def main(_):
+  ## tf flags can't take the profiling arguments, enabled with SG_PROFILE instead
+  profiling.setup('yolo_2_tf_record')
   data_dir = FLAGS.data_dir
   label_map_dict = label_map_util.get_label_map_dict(FLAGS.label_map_path)
 
@@ -173,12 +385,20 @@ def main(_):
   train_dir = os.path.join(data_dir, 'train')
   val_dir = os.path.join(data_dir, 'val')
 
+  train_store = os.path.join(FLAGS.label_store, 'train') if FLAGS.label_store else None
+  val_store = os.path.join(FLAGS.label_store, 'val') if FLAGS.label_store else None
+
   if os.path.exists(train_dir):
     train_output_path = os.path.join(FLAGS.output_dir, 'train.record')
-    create_tf_record(train_output_path, label_map_dict, train_dir)
+    create_tf_record(train_output_path, label_map_dict, train_dir,
+                     FLAGS.num_shards, FLAGS.workers, FLAGS.incremental,
+                     train_store)
   if os.path.exists(val_dir):
     val_output_path = os.path.join(FLAGS.output_dir, 'val.record')
-    create_tf_record(val_output_path, label_map_dict, val_dir)
+    create_tf_record(val_output_path, label_map_dict, val_dir,
+                     FLAGS.num_shards, FLAGS.workers, FLAGS.incremental,
+                     val_store)
+  profiling.finish()
 
 if __name__ == '__main__':
   tf.app.run()
@@ -0,0 +1,91 @@
+# coding=utf-8
+# Copyright 2018 Bertram Sändig.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads the fields of a TFRecord example (image header, hash and Yolo boxes) without TensorFlow.
+Used by util/yolo_2_tf_record.py."""
+
+import hashlib
+import io
+import struct
+
+import PIL.Image
+
+
+def image_size(encoded):
+  """Reads format and size from the header of an encoded image without decoding it.
+
+  Args:
+    encoded: encoded image bytes.
+
+  Returns:
+    format: 'JPEG', 'PNG' or the format detected by PIL.
+    width: image width.
+    height: image height.
+  """
+  if encoded[:2] == b'\xff\xd8':
+    i = 2
+    while i + 9 < len(encoded):
+      if encoded[i] != 0xFF:
+        i += 1
+        continue
+      marker = encoded[i + 1]
+      if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+        i += 1 if marker == 0xFF else 2
+        continue
+      # start of frame markers (SOF0-SOF15 without DHT, JPG and DAC)
+      if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+        height, width = struct.unpack('>HH', encoded[i + 5:i + 9])
+        return 'JPEG', width, height
+      i += 2 + struct.unpack('>H', encoded[i + 2:i + 4])[0]
+  elif encoded[:8] == b'\x89PNG\r\n\x1a\n':
+    width, height = struct.unpack('>II', encoded[16:24])
+    return 'PNG', width, height
+  image = PIL.Image.open(io.BytesIO(encoded))
+  return image.format, image.size[0], image.size[1]
+
+
+def example_fields(txt, encoded, label_id_dict):
+  """Reads image size, hash and boxes of an example.
+
+  Args:
+    txt: content of the Yolo label file or a list of label rows
+      (class, x, y, w, h) read from a label store.
+    encoded: encoded image bytes.
+    label_id_dict: A map from integer ids to string label names.
+
+  Returns:
+    A dict with format, width, height, key (sha256 of the image), the box
+    coordinates xmin, ymin, xmax, ymax, the classes and their names
+    (classes_text, only for ids in label_id_dict).
+  """
+  image_format, width, height = image_size(encoded)
+  fields = {'format': image_format, 'width': width, 'height': height,
+            'key': hashlib.sha256(encoded).hexdigest(),
+            'xmin': [], 'ymin': [], 'xmax': [], 'ymax': [],
+            'classes': [], 'classes_text': []}
+  if isinstance(txt, str):
+    objects = [obj.split(' ') for obj in txt.split('\n') if obj != '']
+  else:
+    objects = txt
+  for obj_data in objects:
+    c_x, c_y, w, h = float(obj_data[1]), float(obj_data[2]), float(obj_data[3]), float(obj_data[4])
+    fields['xmin'].append(c_x-w/2)
+    fields['ymin'].append(c_y-h/2)
+    fields['xmax'].append(c_x+w/2)
+    fields['ymax'].append(c_y+h/2)
+    class_id = int(obj_data[0])
+    if class_id in label_id_dict:
+      fields['classes_text'].append(label_id_dict[class_id].encode('utf8'))
+    fields['classes'].append(class_id)
+  return fields